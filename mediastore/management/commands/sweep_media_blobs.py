@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from mediastore.refs import recount
+from mediastore.sweep import scan, sweep
+
+
+class Command(BaseCommand):
+    help = 'Удаляет из хранилища по содержимому файлы, на которые не ссылается ни один пост или сообщение'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recount', action='store_true', help='Сначала пересчитать ссылки по всем постам и сообщениям')
+        parser.add_argument('--scan', action='store_true', help='Сначала найти на диске файлы без записи о блобе')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            self.stdout.write(f'Recounted references to {recount()} blob(s)')
+        if options['scan']:
+            self.stdout.write(f'Registered {scan()} unknown blob file(s)')
+        self.stdout.write(f'Removed {sweep()} orphaned blob(s)')
@@ -0,0 +1,19 @@
+from django.db import models
+
+
+class Blob(models.Model):
+    # файл в хранилище по содержимому, см. storage.py; name - путь blobs/ab/cd/<sha256>.<ext>
+    name = models.CharField(max_length=255, primary_key=True)
+    digest = models.CharField(max_length=64, db_index=True)
+    size = models.PositiveBigIntegerField()
+    # сколько полей Post/Message на него ссылается; 0 - кандидат на удаление
+    refcount = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['refcount', 'updated_at'], name='blob_orphan_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.refcount} refs)'
@@ -0,0 +1,64 @@
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from posts.models import Post
+from usersmodel.models import Message
+from .models import Blob
+from .storage import is_blob
+
+# поля, файлы которых лежат в хранилище по содержимому
+FIELDS = {
+    Post: ('image', 'video', 'audio'),
+    Message: ('image', 'video', 'audio'),
+}
+
+
+def names(instance):
+    return Counter(
+        file.name for file in (getattr(instance, field) for field in FIELDS[type(instance)]) if is_blob(file.name)
+    )
+
+
+def stored_names(instance):
+    # имена файлов строки до сохранения; у новой строки их нет
+    if instance.pk is None or instance._state.adding:
+        return Counter()
+    row = type(instance).objects.filter(pk=instance.pk).values_list(*FIELDS[type(instance)]).first()
+    return Counter(name for name in row or () if is_blob(name))
+
+
+def shift(counts, sign):
+    # одно UPDATE на каждое значение сдвига, как в trending._write
+    by_delta = defaultdict(list)
+    for name, count in counts.items():
+        by_delta[sign * count].append(name)
+    now = timezone.now()
+    for delta, batch in by_delta.items():
+        Blob.objects.filter(name__in=batch).update(refcount=F('refcount') + delta, updated_at=now)
+
+
+def retain(counts):
+    shift(counts, 1)
+
+
+def release(counts):
+    shift(counts, -1)
+
+
+def recount():
+    # пересчёт ссылок с нуля, если счётчики разошлись (update() мимо сигналов и т.п.)
+    counts = Counter()
+    for model, fields in FIELDS.items():
+        for row in model.objects.values_list(*fields).iterator():
+            counts.update(name for name in row if is_blob(name))
+    with transaction.atomic():
+        Blob.objects.exclude(name__in=counts).exclude(refcount=0).update(refcount=0, updated_at=timezone.now())
+        by_count = defaultdict(list)
+        for name, count in counts.items():
+            by_count[count].append(name)
+        for count, batch in by_count.items():
+            Blob.objects.filter(name__in=batch).exclude(refcount=count).update(refcount=count)
+    return len(counts)
@@ -0,0 +1,39 @@
+from collections import Counter
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from usersmodel.chat_writer import messages_created
+from . import refs
+
+
+def track(sender, instance, raw=False, **kwargs):
+    if not raw:
+        instance._stored_blobs = refs.stored_names(instance)
+
+
+def update_refs(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    old = instance.__dict__.pop('_stored_blobs', None)
+    if old is None:
+        return
+    new = refs.names(instance)
+    refs.retain(new - old)
+    refs.release(old - new)
+
+
+def drop_refs(sender, instance, **kwargs):
+    refs.release(refs.names(instance))
+
+
+for model in refs.FIELDS:
+    pre_save.connect(track, sender=model, dispatch_uid=f'mediastore-track-{model.__name__}')
+    post_save.connect(update_refs, sender=model, dispatch_uid=f'mediastore-refs-{model.__name__}')
+    post_delete.connect(drop_refs, sender=model, dispatch_uid=f'mediastore-drop-{model.__name__}')
+
+
+@receiver(messages_created)
+def retain_created_messages(sender, messages, **kwargs):
+    counts = sum((refs.names(message) for message in messages), Counter())
+    refs.retain(counts)
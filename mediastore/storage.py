@@ -0,0 +1,95 @@
+import hashlib
+import os
+import posixpath
+import re
+import uuid
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+
+BLOB_ROOT = 'blobs'
+READ_BLOCK = 1024 * 1024
+EXTENSION_RE = re.compile(r'^\.[a-z0-9]{1,10}$')
+
+
+def blob_name(digest, name):
+    # blobs/ab/cd/<sha256>.<ext>: два уровня по 256 каталогов, расширение -
+    # ради типа содержимого при отдаче и для Pillow
+    extension = os.path.splitext(name)[1].lower()
+    if not EXTENSION_RE.match(extension):
+        extension = ''
+    return posixpath.join(BLOB_ROOT, digest[:2], digest[2:4], digest + extension)
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_ROOT + '/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    # Файлы хранятся по sha256 содержимого: одинаковая загрузка записывается
+    # один раз. Хеш считается по ходу записи во временный файл, который затем
+    # переименовывается в итоговый путь. Ссылки считают сигналы (signals.py),
+    # файлы без ссылок удаляет sweep.py. Старые имена вида post_images/...
+    # по-прежнему открываются и отдаются как в FileSystemStorage.
+
+    def get_available_name(self, name, max_length=None):
+        # итоговое имя выбирает _save по содержимому
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        size = 0
+        temp = None
+        if hasattr(content, 'temporary_file_path'):
+            # файл уже на диске (большая загрузка, загрузка частями): только хешируем
+            source = content.temporary_file_path()
+            with open(source, 'rb') as file:
+                for block in iter(lambda: file.read(READ_BLOCK), b''):
+                    digest.update(block)
+                    size += len(block)
+        else:
+            temp_dir = self.path(posixpath.join(BLOB_ROOT, 'tmp'))
+            os.makedirs(temp_dir, exist_ok=True)
+            source = temp = os.path.join(temp_dir, uuid.uuid4().hex)
+            with open(temp, 'wb') as file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+
+        digest = digest.hexdigest()
+        name = blob_name(digest, name)
+        # строку отмечаем до проверки файла: сборщик удаляет строку и файл в одной
+        # транзакции и только если строка давно не менялась
+        touch(name, digest, size)
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # такое содержимое уже есть; исходник убираем, как сделал бы перенос
+            os.remove(source)
+        else:
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if temp is not None:
+                os.replace(temp, full_path)
+            else:
+                file_move_safe(source, full_path, allow_overwrite=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(full_path, self.file_permissions_mode)
+        from .sweep import blob_sweeper
+        blob_sweeper.ensure_started()
+        return name
+
+
+def touch(name, digest, size):
+    from .models import Blob
+
+    if not Blob.objects.filter(name=name).update(updated_at=timezone.now()):
+        Blob.objects.get_or_create(name=name, defaults={'digest': digest, 'size': size})
+
+
+media_store = ContentAddressedStorage()
+
+
+def get_media_store():
+    # вызываемое значение storage= у полей: в миграциях остаётся ссылка, а не путь MEDIA_ROOT
+    return media_store
@@ -0,0 +1,81 @@
+import logging
+import os
+import posixpath
+import shutil
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from social_media.derivatives import target_name
+from social_media.periodic import PeriodicWorker
+from .models import Blob
+from .storage import BLOB_ROOT, media_store
+
+logger = logging.getLogger(__name__)
+
+
+def delete_blob(name):
+    media_store.delete(name)
+    # уменьшенные копии картинки лежат рядом, см. social_media/derivatives.py
+    shutil.rmtree(media_store.path(target_name(name)), ignore_errors=True)
+
+
+def sweep(batch_size=500):
+    # Удаляет файлы, на которые давно никто не ссылается. Строка удаляется
+    # условно и вместе с файлом в одной транзакции: если _save успел отметить
+    # блоб (или на него снова сослались), условие не выполнится.
+    grace = getattr(settings, 'MEDIASTORE_ORPHAN_GRACE', 60 * 60)
+    cutoff = timezone.now() - timedelta(seconds=grace)
+    removed = 0
+    while True:
+        names = list(
+            Blob.objects.filter(refcount__lte=0, updated_at__lt=cutoff).values_list('name', flat=True)[:batch_size]
+        )
+        if not names:
+            return removed
+        for name in names:
+            with transaction.atomic():
+                deleted, _ = Blob.objects.filter(name=name, refcount__lte=0, updated_at__lt=cutoff).delete()
+                if deleted:
+                    delete_blob(name)
+                    removed += 1
+        if len(names) < batch_size:
+            return removed
+
+
+def shards(path):
+    try:
+        return [entry for entry in os.scandir(path) if entry.is_dir() and len(entry.name) == 2]
+    except FileNotFoundError:
+        return []
+
+
+def scan():
+    # Регистрирует файлы blobs/ab/cd/ без строки (например, сохранённые в
+    # откатившейся транзакции) как блобы без ссылок - их удалит sweep()
+    known = set(Blob.objects.values_list('name', flat=True))
+    found = 0
+    for first in shards(media_store.path(BLOB_ROOT)):
+        for second in shards(first.path):
+            for entry in os.scandir(second.path):
+                name = posixpath.join(BLOB_ROOT, first.name, second.name, entry.name)
+                if entry.is_file() and name not in known:
+                    Blob.objects.get_or_create(name=name, defaults={
+                        'digest': os.path.splitext(entry.name)[0], 'size': entry.stat().st_size,
+                    })
+                    found += 1
+    return found
+
+
+def sweep_logged():
+    removed = sweep()
+    if removed:
+        logger.info('Removed %s orphaned media blob(s)', removed)
+
+
+# Фоновый сборщик: поток запускается при первой записи в хранилище
+blob_sweeper = PeriodicWorker(
+    'mediastore-sweep', sweep_logged, lambda: getattr(settings, 'MEDIASTORE_SWEEP_INTERVAL', 60 * 60),
+)
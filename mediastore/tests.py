@@ -0,0 +1,61 @@
+import os
+import tempfile
+from datetime import timedelta
+
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from posts.models import Post
+from usersmodel.models import CustomUser
+from .models import Blob
+from .storage import media_store
+from .sweep import sweep
+
+
+@override_settings(MEDIASTORE_SWEEP_INTERVAL=0, MEDIASTORE_ORPHAN_GRACE=3600)
+class MediaStoreTests(TestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(MEDIA_ROOT=root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+
+    def post(self, content, name='voice.mp3'):
+        return Post.objects.create(user=self.user, title='Post', audio=ContentFile(content, name=name))
+
+    def age(self, blob, seconds):
+        Blob.objects.filter(pk=blob.pk).update(updated_at=timezone.now() - timedelta(seconds=seconds))
+
+    def test_same_content_is_stored_once(self):
+        first, second = self.post(b'same bytes'), self.post(b'same bytes', name='other.mp3')
+        self.assertEqual(first.audio.name, second.audio.name)
+        blob = Blob.objects.get()
+        self.assertEqual(blob.refcount, 2)
+        self.assertEqual(blob.size, len(b'same bytes'))
+        self.assertEqual(os.listdir(os.path.dirname(media_store.path(blob.name))), [os.path.basename(blob.name)])
+
+    def test_delete_releases_references(self):
+        first, second = self.post(b'same bytes'), self.post(b'same bytes')
+        first.delete()
+        self.assertEqual(Blob.objects.get().refcount, 1)
+        second.audio = ContentFile(b'new bytes', name='new.mp3')
+        second.save()
+        refcounts = dict(Blob.objects.values_list('size', 'refcount'))
+        self.assertEqual(refcounts, {len(b'same bytes'): 0, len(b'new bytes'): 1})
+
+    def test_sweep_removes_only_old_orphans(self):
+        orphan = Blob.objects.get(name=self.post(b'orphan').audio.name)
+        fresh_orphan = Blob.objects.get(name=self.post(b'fresh orphan').audio.name)
+        kept = Blob.objects.get(name=self.post(b'kept').audio.name)
+        Post.objects.exclude(audio=kept.name).delete()
+        self.age(orphan, 7200)
+        self.age(kept, 7200)
+
+        self.assertEqual(sweep(), 1)
+        self.assertEqual(set(Blob.objects.values_list('name', flat=True)), {fresh_orphan.name, kept.name})
+        self.assertFalse(media_store.exists(orphan.name))
+        self.assertTrue(media_store.exists(fresh_orphan.name))
+        self.assertTrue(media_store.exists(kept.name))
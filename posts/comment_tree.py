@@ -0,0 +1,76 @@
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+SEGMENT_WIDTH = 8
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+PATH_MAX_LENGTH = 900
+# глубже путь не помещается в Comment.path
+MAX_DEPTH = PATH_MAX_LENGTH // (SEGMENT_WIDTH + 1) - 1
+
+
+def path_segment(pk):
+    # id фиксированной ширины в base36: лексикографический порядок путей
+    # совпадает с обходом дерева в глубину, дети идут по возрастанию id.
+    digits = []
+    while pk:
+        pk, rest = divmod(pk, 36)
+        digits.append(DIGITS[rest])
+    return ''.join(reversed(digits)).rjust(SEGMENT_WIDTH, '0') + '/'
+
+
+def after_child(path, child_id):
+    # Всё, что идёт после ребёнка child_id и всего его поддерева.
+    if not child_id:
+        return path
+    return path + path_segment(child_id) + '~'
+
+
+def with_sibling_rank(queryset):
+    return queryset.annotate(sibling_rank=Window(
+        RowNumber(),
+        partition_by=[F('post_id'), F('parent_comment_id')],
+        order_by=F('path').asc(),
+    ))
+
+
+class ThreadRoot:
+    def __init__(self):
+        self.id = None
+        # корни веток (depth 0) показываются, ответы - до depth = max_depth
+        self.depth = 0
+        self.prefetched_replies = []
+        self.replies_cursor = None
+
+
+def attach_replies(parents, rows, max_depth, limit):
+    # rows отсортированы по path, поэтому родитель всегда обработан раньше детей.
+    # Под каждым из parents - не больше max_depth уровней от его собственной
+    # глубины: в списке могут быть комментарии разной глубины.
+    # replies_cursor = id последнего показанного ответа, если ответы остались
+    # (0 - ответы есть, но глубже лимита и ещё не загружались).
+    nodes, ceilings = {}, {}
+    for parent in parents:
+        parent.prefetched_replies = []
+        parent.replies_cursor = None
+        nodes[parent.id] = parent
+        ceilings[parent.id] = parent.depth + max_depth
+
+    for row in rows:
+        parent = nodes.get(row.parent_comment_id)
+        if parent is None:
+            continue
+        if row.depth > ceilings[parent.id]:
+            if parent.replies_cursor is None:
+                parent.replies_cursor = 0
+            continue
+        if len(parent.prefetched_replies) >= limit:
+            parent.replies_cursor = parent.prefetched_replies[-1].id
+            continue
+        node = nodes.get(row.id, row)
+        if node is row:
+            node.prefetched_replies = []
+            node.replies_cursor = None
+            nodes[row.id] = node
+            ceilings[row.id] = ceilings[parent.id]
+        parent.prefetched_replies.append(node)
+    return parents
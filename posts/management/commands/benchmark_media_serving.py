@@ -0,0 +1,88 @@
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.views.static import serve
+
+from social_media.media_serving import MediaApp, serve_media
+
+CHUNK = 1024 * 1024
+
+
+def consume(response):
+    total = 0
+    for chunk in response.streaming_content if response.streaming else [response.content]:
+        total += len(chunk)
+    if hasattr(response, 'close'):
+        response.close()
+    return total
+
+
+def run_view(view, name, root, headers):
+    request = RequestFactory().get('/media/' + name, headers=headers)
+    if view is serve:
+        return consume(serve(request, name, document_root=root))
+    return consume(view(request, name))
+
+
+async def run_asgi(app, name, headers):
+    total = 0
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        nonlocal total
+        if message['type'] == 'http.response.body':
+            total += len(message.get('body', b''))
+
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': '/media/' + name, 'extensions': {},
+        'headers': [(key.lower().encode(), value.encode()) for key, value in headers.items()],
+    }
+    await app(scope, receive, send)
+    return total
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает отдачу больших файлов из media: django.views.static.serve, serve_media и MediaApp (ASGI)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=256, help='Размер тестового файла, МБ')
+        parser.add_argument('--seeks', type=int, default=50, help='Сколько запросов Range по 1 МБ (перемотка видео)')
+        parser.add_argument('--repeat', type=int, default=3, help='Сколько раз скачивать файл целиком')
+
+    def handle(self, *args, **options):
+        size = options['size'] * CHUNK
+        rng = random.Random(0)
+        ranges = [rng.randrange(0, size - CHUNK) for _ in range(options['seeks'])]
+        with tempfile.TemporaryDirectory() as root, override_settings(MEDIA_ROOT=root):
+            name = 'bench.mp4'
+            with open(os.path.join(root, name), 'wb') as file:
+                for _ in range(options['size']):
+                    file.write(os.urandom(CHUNK))
+
+            app = MediaApp(None)
+            runners = [
+                ('static.serve', lambda headers: run_view(serve, name, root, headers)),
+                ('serve_media', lambda headers: run_view(serve_media, name, root, headers)),
+                ('MediaApp', lambda headers: asyncio.run(run_asgi(app, name, headers))),
+            ]
+            for label, runner in runners:
+                started = time.perf_counter()
+                for _ in range(options['repeat']):
+                    runner({})
+                full = (time.perf_counter() - started) / options['repeat']
+
+                started, transferred = time.perf_counter(), 0
+                for start in ranges:
+                    transferred += runner({'Range': f'bytes={start}-{start + CHUNK - 1}'})
+                seeks = time.perf_counter() - started
+                self.stdout.write(
+                    f'{label:13} full {full * 1000:8.1f} ms ({size / CHUNK / full:7.0f} MB/s)  '
+                    f'{len(ranges)} seeks {seeks * 1000:9.1f} ms, {transferred / CHUNK:8.0f} MB sent'
+                )
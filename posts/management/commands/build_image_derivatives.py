@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from posts.models import Post
+from social_media.derivatives import derivative_pipeline, needs_variants
+from usersmodel.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии картинок постов и сообщений, у которых их ещё нет'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        for model in (Post, Message):
+            total = 0
+            queryset = model.objects.exclude(image='').exclude(image__isnull=True).only('pk', 'image', 'image_variants')
+            for instance in queryset.iterator(chunk_size=options['batch_size']):
+                if needs_variants(instance):
+                    derivative_pipeline.schedule(instance)
+                    total += 1
+            self.stdout.write(f'{model._meta.label}: {total} scheduled')
+        # дождаться пула, иначе команда выйдет раньше, чем варианты запишутся
+        derivative_pipeline.shutdown()
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from posts.models import Comment, CommentReaction, Post, PostReaction
+
+
+def actual_count(model, field, **filters):
+    rows = model.objects.filter(**{field: OuterRef('pk')}, **filters).order_by().values(field)
+    return Coalesce(Subquery(rows.annotate(c=Count('pk')).values('c')), 0)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики лайков, дизлайков и комментариев'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения, ничего не менять')
+
+    def handle(self, *args, **options):
+        targets = [
+            (Post, {
+                'like_count': actual_count(PostReaction, 'post', reaction_type='like'),
+                'dislike_count': actual_count(PostReaction, 'post', reaction_type='dislike'),
+                'comments_count': actual_count(Comment, 'post'),
+            }),
+            (Comment, {
+                'like_count': actual_count(CommentReaction, 'comment', reaction_type='like'),
+                'dislike_count': actual_count(CommentReaction, 'comment', reaction_type='dislike'),
+            }),
+        ]
+        for model, counters in targets:
+            actual = {f'actual_{field}': expression for field, expression in counters.items()}
+            drift = Q()
+            for field in counters:
+                drift |= ~Q(**{field: F(f'actual_{field}')})
+            drifted = list(model.objects.annotate(**actual).filter(drift).values_list('pk', flat=True))
+
+            if drifted and not options['dry_run']:
+                with transaction.atomic():
+                    model.objects.filter(pk__in=drifted).update(**counters)
+
+            verb = 'drifted' if options['dry_run'] else 'repaired'
+            self.stdout.write(f'{model._meta.verbose_name_plural}: {len(drifted)} {verb}')
@@ -0,0 +1,31 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from posts.models import HashtagRollup, Post
+from posts.trending import trending
+
+
+class Command(BaseCommand):
+    help = 'Удаляет старые rollup-ы хештегов; с --backfill пересобирает их по привязкам постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backfill', action='store_true', help='Пересобрать rollup-ы из posts_post_hashtags')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        if options['backfill']:
+            rows = Post.hashtags.through.objects.values_list('hashtag_id', 'post__created_at')
+            counts = Counter()
+            for hashtag_id, created_at in rows.iterator(chunk_size=options['batch_size']):
+                counts[(trending.bucket(created_at.timestamp()), hashtag_id)] += 1
+            with transaction.atomic():
+                HashtagRollup.objects.all().delete()
+                HashtagRollup.objects.bulk_create(
+                    [HashtagRollup(bucket=bucket, hashtag_id=hashtag_id, count=count)
+                     for (bucket, hashtag_id), count in counts.items()],
+                    batch_size=options['batch_size'],
+                )
+            self.stdout.write(f'{len(counts)} rollups rebuilt')
+        self.stdout.write(f'{trending.prune()} old rollups deleted')
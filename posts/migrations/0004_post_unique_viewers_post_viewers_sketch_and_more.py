@@ -0,0 +1,67 @@
+# Generated by Django 5.1.1 on 2026-10-18 10:12
+
+import hashlib
+import math
+
+from django.db import migrations, models
+
+# копия posts.hll на момент миграции: формат регистров должен совпадать с
+# тем, что эта миграция записывает, даже если модуль потом изменится
+PRECISION = 10
+SIZE = 1 << PRECISION
+
+
+def sketch_of(values):
+    registers = bytearray(SIZE)
+    for value in values:
+        digest = hashlib.blake2b(str(value).encode(), digest_size=8).digest()
+        x = int.from_bytes(digest, 'big')
+        index = x >> (64 - PRECISION)
+        rest = x & ((1 << (64 - PRECISION)) - 1)
+        registers[index] = max(registers[index], (64 - PRECISION) - rest.bit_length() + 1)
+    return registers
+
+
+def estimate(registers):
+    alpha = 0.7213 / (1 + 1.079 / SIZE)
+    result = alpha * SIZE * SIZE / sum(2.0 ** -r for r in registers)
+    zeros = registers.count(0)
+    if result <= 2.5 * SIZE and zeros:
+        result = SIZE * math.log(SIZE / zeros)
+    return int(round(result))
+
+
+def fold_viewed_ips(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    posts = []
+    for post in Post.objects.exclude(viewed_ips=None).only('id', 'viewed_ips').iterator():
+        registers = sketch_of(post.viewed_ips or [])
+        post.viewers_sketch = bytes(registers)
+        post.unique_viewers = estimate(registers)
+        posts.append(post)
+    Post.objects.bulk_update(posts, ['viewers_sketch', 'unique_viewers'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_commentreaction_postreaction_delete_reaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='unique_viewers',
+            field=models.PositiveIntegerField(default=0, verbose_name='Уникальные зрители'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='viewers_sketch',
+            field=models.BinaryField(blank=True, default=bytes, editable=False),
+        ),
+        migrations.RunPython(fold_viewed_ips, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='post',
+            name='viewed_ips',
+        ),
+    ]
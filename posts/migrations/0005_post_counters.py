@@ -0,0 +1,72 @@
+# Generated by Django 5.1.1 on 2026-10-18 11:40
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def _count(model, field, **filters):
+    rows = model.objects.filter(**{field: OuterRef('pk')}, **filters).order_by().values(field)
+    return Coalesce(Subquery(rows.annotate(c=Count('pk')).values('c')), 0)
+
+
+def populate_counters(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Comment = apps.get_model('posts', 'Comment')
+    PostReaction = apps.get_model('posts', 'PostReaction')
+    CommentReaction = apps.get_model('posts', 'CommentReaction')
+    Post.objects.update(
+        like_count=_count(PostReaction, 'post', reaction_type='like'),
+        dislike_count=_count(PostReaction, 'post', reaction_type='dislike'),
+        comments_count=_count(Comment, 'post'),
+    )
+    Comment.objects.update(
+        like_count=_count(CommentReaction, 'comment', reaction_type='like'),
+        dislike_count=_count(CommentReaction, 'comment', reaction_type='dislike'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_post_unique_viewers_post_viewers_sketch_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='comments_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество комментариев'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='dislike_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество дизлайков'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество лайков'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-like_count', '-id'], name='post_like_count_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['-dislike_count', '-id'], name='post_dislike_count_idx'),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.1 on 2026-10-18 13:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+# копия posts.comment_tree.path_segment на момент миграции
+SEGMENT_WIDTH = 8
+DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def path_segment(pk):
+    digits = []
+    while pk:
+        pk, rest = divmod(pk, 36)
+        digits.append(DIGITS[rest])
+    return ''.join(reversed(digits)).rjust(SEGMENT_WIDTH, '0') + '/'
+
+
+def build_paths(apps, schema_editor):
+    Comment = apps.get_model('posts', 'Comment')
+    parents = dict(Comment.objects.values_list('id', 'parent_comment_id'))
+    paths = {}
+
+    def path_of(comment_id):
+        if comment_id not in paths:
+            parent_id = parents.get(comment_id)
+            prefix = path_of(parent_id) if parent_id in parents else ''
+            paths[comment_id] = prefix + path_segment(comment_id)
+        return paths[comment_id]
+
+    comments = []
+    for comment_id in parents:
+        path = path_of(comment_id)
+        comments.append(Comment(id=comment_id, path=path, depth=path.count('/') - 1))
+    Comment.objects.bulk_update(comments, ['path', 'depth'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_post_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(blank=True, default='', editable=False, max_length=900),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
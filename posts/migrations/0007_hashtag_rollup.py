@@ -0,0 +1,27 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_comment_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HashtagRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='posts.hashtag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='hashtag_rollup_bucket_idx')],
+                'unique_together': {('hashtag', 'bucket')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:40
+
+import mediastore.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_post_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='audio',
+            field=models.FileField(blank=True, null=True, storage=mediastore.storage.get_media_store, upload_to='post_audios/', verbose_name='Аудио'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=mediastore.storage.get_media_store, upload_to='post_images/', verbose_name='Фото'),
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='video',
+            field=models.FileField(blank=True, null=True, storage=mediastore.storage.get_media_store, upload_to='post_videos/', verbose_name='Видео'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.1.1 on 2026-10-18 21:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0010_post_sort_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResponseMark',
+            fields=[
+                ('key', models.CharField(max_length=64, primary_key=True, serialize=False)),
+                ('marked_at', models.BigIntegerField()),
+            ],
+        ),
+    ]
@@ -1,10 +1,14 @@
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
 from django.conf import settings
 from django.utils.translation import gettext as _
 from django.contrib.sessions.models import Session
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 
+from .comment_tree import MAX_DEPTH, PATH_MAX_LENGTH, path_segment
+from mediastore.storage import get_media_store
+
 
 class Hashtag(models.Model):
     name = models.CharField(max_length=100, unique=True)
@@ -13,31 +17,61 @@ class Hashtag(models.Model):
         return self.name
 
 
+class HashtagRollup(models.Model):
+    # число использований хештега за интервал [bucket, bucket + TRENDING_BUCKET)
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='rollups')
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('hashtag', 'bucket')
+        indexes = [
+            models.Index(fields=['bucket'], name='hashtag_rollup_bucket_idx'),
+        ]
+
+
 class Post(models.Model):
     title = models.CharField(max_length=100,null =True)
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='posts')
-    viewed_ips = models.JSONField(default=list, blank=True,null=True)    
+    viewers_sketch = models.BinaryField(default=bytes, blank=True, editable=False)
     text = models.TextField(verbose_name=_("Текст"), blank=True, null=True)
-    audio = models.FileField(upload_to='post_audios/', blank=True, null=True, verbose_name=_("Аудио"))
-    video = models.FileField(upload_to='post_videos/', blank=True, null=True, verbose_name=_("Видео"))
-    image = models.ImageField(upload_to='post_images/', blank=True, null=True, verbose_name=_("Фото"))
+    audio = models.FileField(upload_to='post_audios/', storage=get_media_store, blank=True, null=True, verbose_name=_("Аудио"))
+    video = models.FileField(upload_to='post_videos/', storage=get_media_store, blank=True, null=True, verbose_name=_("Видео"))
+    image = models.ImageField(upload_to='post_images/', storage=get_media_store, blank=True, null=True, verbose_name=_("Фото"))
+    # готовые уменьшенные копии image, см. social_media/derivatives.py
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_("Дата создания"))
     hashtags = models.ManyToManyField(Hashtag, blank=True)
     views_count = models.PositiveIntegerField(default=0, verbose_name=_("Количество просмотров"))
+    unique_viewers = models.PositiveIntegerField(default=0, verbose_name=_("Уникальные зрители"))
+    like_count = models.PositiveIntegerField(default=0, verbose_name=_("Количество лайков"))
+    dislike_count = models.PositiveIntegerField(default=0, verbose_name=_("Количество дизлайков"))
+    comments_count = models.PositiveIntegerField(default=0, verbose_name=_("Количество комментариев"))
 
     class Meta:
         verbose_name = _("Пост")
         verbose_name_plural = _("Посты")
+        indexes = [
+            models.Index(fields=['-like_count', '-id'], name='post_like_count_idx'),
+            models.Index(fields=['-dislike_count', '-id'], name='post_dislike_count_idx'),
+            models.Index(fields=['-views_count', '-id'], name='post_views_count_idx'),
+            models.Index(fields=['-created_at', '-id'], name='post_created_at_idx'),
+        ]
 
     def __str__(self):
         return f'Post by {self.user.email} at {self.created_at}'
 
     def increment_views(self, ip_address=None, user=None, session_key=None):
-        if user or ip_address or session_key:
-            self.views_count += 1
-            if ip_address and ip_address not in self.viewed_ips:
-                self.viewed_ips.append(ip_address)
-            self.save()
+        from .view_counter import view_counter
+
+        if user:
+            viewer = f'user:{user.pk}'
+        elif session_key:
+            viewer = f'session:{session_key}'
+        else:
+            viewer = ip_address
+        if viewer:
+            view_counter.add(self.pk, viewer=viewer)
 
 
 class Comment(models.Model):
@@ -46,10 +80,32 @@ class Comment(models.Model):
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     parent_comment = models.ForeignKey('self', related_name='replies', on_delete=models.CASCADE, null=True, blank=True)
+    like_count = models.PositiveIntegerField(default=0)
+    dislike_count = models.PositiveIntegerField(default=0)
+    # материализованный путь от корня ветки: "<id корня>/.../<id>/"
+    path = models.CharField(max_length=PATH_MAX_LENGTH, blank=True, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', 'path'], name='comment_post_path_idx'),
+        ]
 
     def __str__(self):
         return f'Comment by {self.user.name} on {self.post.title}'
 
+    def save(self, *args, **kwargs):
+        # счётчик comments_count у поста обновляется сигналом в той же транзакции
+        if not self.path and self.parent_comment_id and self.parent_comment.depth >= MAX_DEPTH:
+            raise ValidationError(_('Превышена максимальная глубина ответов: %(depth)s') % {'depth': MAX_DEPTH})
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if not self.path:
+                parent_path = self.parent_comment.path if self.parent_comment_id else ''
+                self.path = parent_path + path_segment(self.pk)
+                self.depth = self.path.count('/') - 1
+                Comment.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+
 
 
 class PostReaction(models.Model):
@@ -68,6 +124,16 @@ class PostReaction(models.Model):
     def __str__(self):
         return f'{self.user.username} reacted with {self.reaction_type} to post "{self.post.title}"'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counted = (instance.__dict__.get('post_id'), instance.__dict__.get('reaction_type'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
 class CommentReaction(models.Model):
     REACTION_CHOICES = [
         ('like', 'Like'),
@@ -82,4 +148,22 @@ class CommentReaction(models.Model):
         unique_together = ('user', 'comment')
 
     def __str__(self):
-        return f'{self.user.username} reacted with {self.reaction_type} to comment "{self.comment.content}"'
\ No newline at end of file
+        return f'{self.user.username} reacted with {self.reaction_type} to comment "{self.comment.content}"'
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._counted = (instance.__dict__.get('comment_id'), instance.__dict__.get('reaction_type'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+
+class ResponseMark(models.Model):
+    # Отметка изменения для posts.response_cache (пост или состав списков):
+    # время в нс. Хранится в БД, а не в кеше - кеш может вытеснить отметку, и
+    # устаревший ответ снова прошёл бы проверку.
+    key = models.CharField(max_length=64, primary_key=True)
+    marked_at = models.BigIntegerField()
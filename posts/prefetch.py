@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.db.models import Prefetch, Q, prefetch_related_objects
+
+from .comment_tree import ThreadRoot, after_child, attach_replies, with_sibling_rank
+from .models import Comment, CommentReaction, PostReaction
+
+
+def tree_options(max_depth=None, limit=None):
+    if max_depth is None:
+        max_depth = settings.COMMENT_TREE_MAX_DEPTH
+    if limit is None:
+        limit = settings.COMMENT_TREE_REPLIES_LIMIT
+    return max_depth, limit
+
+
+def comment_prefetches():
+    return [
+        Prefetch('reactions', queryset=CommentReaction.objects.order_by('id'), to_attr='prefetched_reactions'),
+    ]
+
+
+def thread_rows(queryset, max_node_depth, limit):
+    # Одним запросом: узлы не глубже max_node_depth + 1 (чтобы знать, есть ли
+    # ответы дальше) и не больше limit + 1 детей у каждого родителя.
+    queryset = with_sibling_rank(queryset.filter(depth__lte=max_node_depth + 1))
+    return queryset.filter(sibling_rank__lte=limit + 1).order_by('path').prefetch_related(*comment_prefetches())
+
+
+def post_prefetches(max_depth=None, limit=None):
+    max_depth, limit = tree_options(max_depth, limit)
+    return [
+        Prefetch('hashtags', to_attr='prefetched_hashtags'),
+        Prefetch('reactions', queryset=PostReaction.objects.order_by('id'), to_attr='prefetched_reactions'),
+        Prefetch('comments', queryset=thread_rows(Comment.objects.all(), max_depth, limit), to_attr='prefetched_comments'),
+    ]
+
+
+def prepare_posts(posts, max_depth=None, limit=None):
+    max_depth, limit = tree_options(max_depth, limit)
+    for post in posts:
+        if not hasattr(post, 'prefetched_comments'):
+            prefetch_related_objects([post], *post_prefetches(max_depth, limit))
+        root = ThreadRoot()
+        attach_replies([root], post.prefetched_comments, max_depth, limit)
+        post.prefetched_comments = root.prefetched_replies
+    return posts
+
+
+def prepare_comments(comments, max_depth=None, limit=None):
+    max_depth, limit = tree_options(max_depth, limit)
+    comments = list(comments)
+    if not comments:
+        return comments
+
+    # у каждого комментария своя глубина (list_all_comments), уровни ответов
+    # отсчитываются от неё; лишнее по глубине отсекает attach_replies
+    base_depth = min(comment.depth for comment in comments)
+    ceiling = max(comment.depth for comment in comments) + max_depth
+    rows = Comment.objects.filter(post_id__in={comment.post_id for comment in comments}, depth__gt=base_depth)
+    if len(comments) <= 100:
+        subtrees = Q()
+        for comment in comments:
+            subtrees |= Q(path__startswith=comment.path, depth__lte=comment.depth + max_depth + 1)
+        rows = rows.filter(subtrees)
+
+    prefetch_related_objects(comments, *comment_prefetches())
+    attach_replies(comments, thread_rows(rows, ceiling, limit), max_depth, limit)
+    return comments
+
+
+def load_replies(comment, after=0, max_depth=None, limit=None):
+    max_depth, limit = tree_options(max_depth, limit)
+    rows = Comment.objects.filter(
+        post_id=comment.post_id,
+        path__startswith=comment.path,
+        path__gt=after_child(comment.path, after),
+    )
+    attach_replies([comment], thread_rows(rows, comment.depth + max_depth, limit), max_depth, limit)
+    return comment.prefetched_replies, comment.replies_cursor
+
+
+def prefetched(obj, attr, related_name):
+    if hasattr(obj, attr):
+        return getattr(obj, attr)
+    return getattr(obj, related_name).all()
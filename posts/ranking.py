@@ -0,0 +1,148 @@
+import logging
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import Comment, Post, PostReaction
+from .trending import trending
+from .view_counter import view_counter
+from usersmodel import timeline
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WEIGHTS = {
+    'recency': 3.0,
+    'likes': 1.0,
+    'dislikes': 0.5,
+    'views': 0.3,
+    'comment_velocity': 1.5,
+    'affinity': 2.0,
+}
+
+
+def weights():
+    return {**DEFAULT_WEIGHTS, **getattr(settings, 'FEED_RANKING_WEIGHTS', {})}
+
+
+class Timings:
+    # Замеры этапов запроса; отдаются клиенту в заголовке Server-Timing
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages.append((name, (time.perf_counter() - started) * 1000))
+
+    @property
+    def total(self):
+        return sum(duration for _, duration in self.stages)
+
+    def header(self):
+        return ', '.join(f'{name};dur={duration:.2f}' for name, duration in self.stages + [('total', self.total)])
+
+
+def candidate_ids(user_id):
+    # подписки и друзья - из домашней ленты, плюс свежие посты трендовых хештегов
+    limit = getattr(settings, 'FEED_RANKING_CANDIDATES', 5000)
+    ids, _ = timeline.page(user_id, limit=limit)
+    hashtag_ids = [hashtag['id'] for hashtag in trending.top('day', getattr(settings, 'FEED_RANKING_TRENDING_TAGS', 20))]
+    if hashtag_ids and len(ids) < limit:
+        since = timezone.now() - timedelta(days=2)
+        ids = set(ids).union(
+            Post.hashtags.through.objects.filter(hashtag_id__in=hashtag_ids, post__created_at__gte=since)
+            .order_by('-post_id').values_list('post_id', flat=True)[:limit - len(ids)]
+        )
+    return list(ids)
+
+
+def load_features(user_id, post_ids):
+    rows = list(Post.objects.filter(pk__in=post_ids).values_list(
+        'id', 'user_id', 'created_at', 'like_count', 'dislike_count', 'views_count',
+    ))
+    if not rows:
+        return None
+    ids, authors, created, likes, dislikes, views = zip(*rows)
+    now = timezone.now()
+    window = getattr(settings, 'FEED_RANKING_VELOCITY_HOURS', 6)
+    recent_comments = dict(
+        Comment.objects.filter(post_id__in=ids, created_at__gte=now - timedelta(hours=window))
+        .values('post_id').annotate(n=Count('id')).values_list('post_id', 'n')
+    )
+    # близость к автору - по прошлым реакциям пользователя на его посты
+    affinity = {
+        author: liked - disliked
+        for author, liked, disliked in PostReaction.objects.filter(user_id=user_id, post__user_id__in=set(authors))
+        .values('post__user_id').annotate(
+            liked=Count('id', filter=Q(reaction_type='like')),
+            disliked=Count('id', filter=Q(reaction_type='dislike')),
+        ).values_list('post__user_id', 'liked', 'disliked')
+    }
+    pending = view_counter.snapshot()
+    count = len(ids)
+
+    def column(values):
+        return np.fromiter(values, dtype=np.float64, count=count)
+
+    return {
+        'ids': np.fromiter(ids, dtype=np.int64, count=count),
+        'age_hours': column((now - moment).total_seconds() / 3600 for moment in created),
+        'likes': column(likes),
+        'dislikes': column(dislikes),
+        'views': column(views_count + pending.get(post_id, 0) for post_id, views_count in zip(ids, views)),
+        'comment_velocity': column(recent_comments.get(post_id, 0) for post_id in ids) / window,
+        'affinity': column(affinity.get(author, 0) for author in authors),
+    }
+
+
+def score(features, weights):
+    # один проход по массивам признаков; счётчики сжимаем логарифмом,
+    # чтобы один вирусный пост не забивал остальные признаки
+    half_life = getattr(settings, 'FEED_RANKING_HALF_LIFE', 12)
+    recency = np.exp2(-np.maximum(features['age_hours'], 0) / half_life)
+    affinity = features['affinity']
+    return (
+        weights['recency'] * recency
+        + weights['likes'] * np.log1p(features['likes'])
+        - weights['dislikes'] * np.log1p(features['dislikes'])
+        + weights['views'] * np.log1p(features['views'])
+        + weights['comment_velocity'] * np.log1p(features['comment_velocity'])
+        + weights['affinity'] * np.sign(affinity) * np.log1p(np.abs(affinity))
+    )
+
+
+def top(ids, scores, limit, offset=0):
+    # argpartition вместо полной сортировки: нужны только первые offset + limit
+    k = min(offset + limit, len(ids))
+    if k <= 0:
+        return []
+    head = np.argpartition(-scores, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+    # при равном счёте выше более новый пост
+    order = head[np.lexsort((-ids[head], -scores[head]))]
+    return ids[order[offset:]].tolist()
+
+
+def rank(user_id, limit=20, offset=0, timings=None):
+    timings = timings or Timings()
+    with timings.stage('candidates'):
+        post_ids = candidate_ids(user_id)
+    with timings.stage('features'):
+        features = load_features(user_id, post_ids)
+    if features is None:
+        return [], False
+    with timings.stage('score'):
+        scores = score(features, weights())
+        ranked = top(features['ids'], scores, limit + 1, offset)
+    budget = getattr(settings, 'FEED_RANKING_BUDGET_MS', 100)
+    if timings.total > budget:
+        logger.warning('Feed ranking for user %s took %.1f ms (budget %s ms): %s',
+                       user_id, timings.total, budget, timings.header())
+    return ranked[:limit], len(ranked) > limit
@@ -0,0 +1,107 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, urlencode
+
+from .models import ResponseMark
+
+LIST_GENERATION = 'posts:gen:list'
+REACTIONS_GENERATION = 'posts:gen:reactions'
+
+
+def version_key(post_id):
+    return f'posts:v:{post_id}'
+
+
+class PostResponseCache:
+    # Кеш готовых JSON-ответов списка и карточки постов. Запись хранит id
+    # вошедших постов и момент сборки; она действительна, пока ни один из этих
+    # постов (и, для списков, их состав) не менялся позже. Отметки изменений
+    # ставят сигналы, в том числе после коммита, так что собранный раньше ответ
+    # не может пережить изменение. Отметки пишутся в кеш и в ResponseMark: кеш
+    # может их вытеснить, тогда проверка идёт по БД (нет строки - пост не
+    # менялся). Просмотры в закешированном ответе отстают до следующего
+    # изменения поста или истечения записи.
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'POSTS_RESPONSE_CACHE', 'default')]
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'POSTS_RESPONSE_CACHE_TIMEOUT', 60)
+
+    def key(self, request, kind):
+        params = urlencode(sorted(request.query_params.lists()), doseq=True)
+        auth = 'user' if request.user.is_authenticated else 'anon'
+        raw = f'{kind}|{request.path}|{params}|{auth}|{request.accepted_media_type}'
+        return 'posts:response:' + hashlib.sha1(raw.encode()).hexdigest()
+
+    def lookup(self, request, kind):
+        # возвращает (запись или None, токен для store)
+        if self.timeout <= 0 or request.accepted_renderer.format != 'json':
+            return None, None
+        key = self.key(request, kind)
+        token = (key, time.time_ns())
+        entry = self.cache.get(key)
+        if entry is None:
+            return None, token
+        keys = [version_key(post_id) for post_id in entry['post_ids']] + entry['generations']
+        versions = self.cache.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            # отметку вытеснили из кеша - сверяемся с БД. Обратно в кеш не
+            # кладём: так можно затереть более новую отметку параллельного touch
+            versions.update(ResponseMark.objects.filter(key__in=missing).values_list('key', 'marked_at'))
+        if max(versions.values(), default=0) > entry['built_at']:
+            return None, token
+        return entry, token
+
+    def store(self, token, response, post_ids, generations=()):
+        key, built_at = token
+        response.render()
+        etag = '"%s"' % hashlib.blake2b(response.content, digest_size=16).hexdigest()
+        self.cache.set(key, {
+            'built_at': built_at,
+            'post_ids': list(post_ids),
+            'generations': list(generations),
+            'etag': etag,
+            'content_type': response['Content-Type'],
+            'body': response.content,
+        }, self.timeout)
+        response['ETag'] = etag
+        return etag
+
+    def respond(self, request, entry):
+        if self.matches(request, entry['etag']):
+            return HttpResponseNotModified(headers={'ETag': entry['etag']})
+        return HttpResponse(entry['body'], content_type=entry['content_type'], headers={'ETag': entry['etag']})
+
+    def matches(self, request, etag):
+        tags = parse_etags(request.headers.get('If-None-Match', ''))
+        return '*' in tags or etag in tags
+
+    def touch(self, post_ids, generations=()):
+        if not post_ids and not generations:
+            return
+        keys = list(dict.fromkeys([version_key(post_id) for post_id in post_ids] + list(generations)))
+
+        def mark():
+            now = time.time_ns()
+            self.cache.set_many({key: now for key in keys}, None)
+            ResponseMark.objects.bulk_create(
+                [ResponseMark(key=key, marked_at=now) for key in keys],
+                update_conflicts=True, unique_fields=['key'], update_fields=['marked_at'],
+            )
+
+        # сразу - для ответов, собранных внутри этой же транзакции, и ещё раз
+        # после коммита - для собранных другими запросами по старым данным
+        mark()
+        transaction.on_commit(mark)
+
+
+response_cache = PostResponseCache()
@@ -1,6 +1,12 @@
+from django.db import transaction
 from rest_framework import serializers
+from .comment_tree import MAX_DEPTH
 from .models import Post, Comment, Hashtag
 from .models import PostReaction, CommentReaction
+from .prefetch import prefetched, prepare_comments, prepare_posts
+from .trending import attach_hashtags, trending
+from social_media.derivatives import variant_urls
+from .view_counter import view_counter
 class HashtagSerializer(serializers.ModelSerializer):
     class Meta:
         model = Hashtag
@@ -10,65 +16,104 @@ class HashtagSerializer(serializers.ModelSerializer):
 
 
 class PostReactionSerializer(serializers.ModelSerializer):
-    like_count = serializers.SerializerMethodField()
-    dislike_count = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(source='post.like_count', read_only=True)
+    dislike_count = serializers.IntegerField(source='post.dislike_count', read_only=True)
     class Meta:
         model = PostReaction
         fields = ['id', 'post', 'reaction_type','like_count', 'dislike_count']
-    def get_like_count(self, obj):
-        return PostReaction.objects.filter(post=obj.post, reaction_type='like').count()
-
-    def get_dislike_count(self, obj):
-        return PostReaction.objects.filter(post=obj.post, reaction_type='dislike').count()
 
 class CommentReactionSerializer(serializers.ModelSerializer):
-    like_count = serializers.SerializerMethodField()
-    dislike_count = serializers.SerializerMethodField()
+    like_count = serializers.IntegerField(source='comment.like_count', read_only=True)
+    dislike_count = serializers.IntegerField(source='comment.dislike_count', read_only=True)
     class Meta:
         model = CommentReaction
         fields = ['id', 'comment', 'reaction_type','like_count', 'dislike_count']
-    def get_like_count(self, obj):
-        return CommentReaction.objects.filter(comment=obj.comment, reaction_type='like').count()
-
-    def get_dislike_count(self, obj):
-        return CommentReaction.objects.filter(comment=obj.comment, reaction_type='dislike').count()
 class CommentSerializer(serializers.ModelSerializer):
     replies = serializers.SerializerMethodField()
-    reactions = CommentReactionSerializer(many=True, read_only=True)  
+    replies_cursor = serializers.SerializerMethodField()
+    reactions = serializers.SerializerMethodField()
 
     class Meta:
         model = Comment
-        fields = ['id', 'post', 'user', 'content', 'created_at', 'parent_comment', 'replies', 'reactions']  
-        read_only_fields = ['user', 'created_at']
+        fields = ['id', 'post', 'user', 'content', 'created_at', 'parent_comment', 'depth', 'replies', 'replies_cursor', 'reactions', 'like_count', 'dislike_count']  
+        read_only_fields = ['user', 'created_at', 'depth', 'like_count', 'dislike_count']
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if self.instance is not None:
+            # path/depth ветки считаются один раз при создании, перенести
+            # комментарий в другую ветку или пост нельзя
+            fields['parent_comment'].read_only = True
+            fields['post'].read_only = True
+        return fields
+
+    def validate_parent_comment(self, parent):
+        if parent is not None and parent.depth >= MAX_DEPTH:
+            raise serializers.ValidationError(f'Превышена максимальная глубина ответов: {MAX_DEPTH}')
+        return parent
 
     def get_replies(self, obj):
-        replies = obj.replies.all()
-        return CommentSerializer(replies, many=True).data
+        if not hasattr(obj, 'prefetched_replies'):
+            prepare_comments([obj])
+        return CommentSerializer(obj.prefetched_replies, many=True, context=self.context).data
+
+    def get_replies_cursor(self, obj):
+        return getattr(obj, 'replies_cursor', None)
+
+    def get_reactions(self, obj):
+        reactions = prefetched(obj, 'prefetched_reactions', 'reactions')
+        return CommentReactionSerializer(reactions, many=True, context=self.context).data
 class PostSerializer(serializers.ModelSerializer):
-    comments = CommentSerializer(many=True, read_only=True)  
-    reactions = PostReactionSerializer(many=True, read_only=True)  
-    comments_count = serializers.SerializerMethodField()
-    hashtags = serializers.StringRelatedField(many=True)
+    comments = serializers.SerializerMethodField()
+    reactions = serializers.SerializerMethodField()
+    views_count = serializers.SerializerMethodField()
+    hashtags = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
         fields = [
-            'id', 'title', 'user', 'text', 'audio', 'video', 'image',
-            'created_at', 'hashtags', 'views_count', 'comments_count',
-            'comments', 'reactions'  
+            'id', 'title', 'user', 'text', 'audio', 'video', 'image', 'image_variants',
+            'created_at', 'hashtags', 'views_count', 'unique_viewers', 'like_count', 'dislike_count',
+            'comments_count', 'comments', 'reactions'  
         ]
+        read_only_fields = ['unique_viewers', 'like_count', 'dislike_count', 'comments_count']
 
-    def get_comments_count(self, obj):
-        return obj.comments.count()
+    def get_views_count(self, obj):
+        return view_counter.live_count(obj)
 
-    def create(self, validated_data):
-        hashtags_data = validated_data.pop('hashtags', [])
-        post = Post.objects.create(**validated_data)
+    def get_comments(self, obj):
+        if not hasattr(obj, 'prefetched_comments'):
+            prepare_posts([obj])
+        return CommentSerializer(obj.prefetched_comments, many=True, context=self.context).data
 
-        for hashtag_data in hashtags_data:
-            hashtag, created = Hashtag.objects.get_or_create(name=hashtag_data['name'])
-            post.hashtags.add(hashtag)
+    def get_reactions(self, obj):
+        reactions = prefetched(obj, 'prefetched_reactions', 'reactions')
+        return PostReactionSerializer(reactions, many=True, context=self.context).data
 
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants)
+
+    def get_hashtags(self, obj):
+        return [str(hashtag) for hashtag in prefetched(obj, 'prefetched_hashtags', 'hashtags')]
+
+    def create(self, validated_data):
+        with transaction.atomic():
+            post = Post.objects.create(**validated_data)
+            self.record_hashtags(post)
         return post
 
+    def update(self, instance, validated_data):
+        with transaction.atomic():
+            post = super().update(instance, validated_data)
+            self.record_hashtags(post)
+        return post
+
+    def record_hashtags(self, post):
+        # #теги из текста; в тренды попадают только новые привязки и только после коммита
+        added = attach_hashtags(post)
+        if added:
+            post.__dict__.pop('prefetched_hashtags', None)
+            transaction.on_commit(lambda: trending.record(added))
+
 
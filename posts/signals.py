@@ -0,0 +1,108 @@
+from django.db import transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Comment, CommentReaction, Post, PostReaction
+from .response_cache import LIST_GENERATION, REACTIONS_GENERATION, response_cache
+from social_media.derivatives import derivative_pipeline, needs_variants, variants_ready
+
+REACTION_COUNTERS = {
+    'like': 'like_count',
+    'dislike': 'dislike_count',
+}
+
+
+def shift_counter(model, pk, field, delta):
+    model.objects.filter(pk=pk).update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
+def _apply_reaction(instance, target, old, new):
+    target_field = instance._meta.get_field(target)
+    target_model = target_field.related_model
+    if old != new:
+        if old and old[1] in REACTION_COUNTERS:
+            shift_counter(target_model, old[0], REACTION_COUNTERS[old[1]], -1)
+        if new and new[1] in REACTION_COUNTERS:
+            shift_counter(target_model, new[0], REACTION_COUNTERS[new[1]], 1)
+    instance._counted = new
+    # чтобы сериализатор реакции отдал уже обновлённые счётчики
+    if new and target_field.is_cached(instance):
+        getattr(instance, target).refresh_from_db(fields=list(REACTION_COUNTERS.values()))
+
+
+@receiver(post_save, sender=PostReaction)
+def count_post_reaction(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, '_counted', None)
+    _apply_reaction(instance, 'post', old, (instance.post_id, instance.reaction_type))
+
+
+@receiver(post_delete, sender=PostReaction)
+def uncount_post_reaction(sender, instance, **kwargs):
+    _apply_reaction(instance, 'post', (instance.post_id, instance.reaction_type), None)
+
+
+@receiver(post_save, sender=CommentReaction)
+def count_comment_reaction(sender, instance, created, **kwargs):
+    old = None if created else getattr(instance, '_counted', None)
+    _apply_reaction(instance, 'comment', old, (instance.comment_id, instance.reaction_type))
+
+
+@receiver(post_delete, sender=CommentReaction)
+def uncount_comment_reaction(sender, instance, **kwargs):
+    _apply_reaction(instance, 'comment', (instance.comment_id, instance.reaction_type), None)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(Post, instance.post_id, 'comments_count', 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    shift_counter(Post, instance.post_id, 'comments_count', -1)
+
+
+# Сброс закешированных ответов: отметки ставятся после коммита
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def touch_post(sender, instance, **kwargs):
+    response_cache.touch([instance.pk], [LIST_GENERATION])
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def touch_commented_post(sender, instance, **kwargs):
+    response_cache.touch([instance.post_id])
+
+
+@receiver(post_save, sender=PostReaction)
+@receiver(post_delete, sender=PostReaction)
+def touch_reacted_post(sender, instance, **kwargs):
+    response_cache.touch([instance.post_id], [REACTIONS_GENERATION])
+
+
+@receiver(post_save, sender=CommentReaction)
+@receiver(post_delete, sender=CommentReaction)
+def touch_reacted_comment(sender, instance, **kwargs):
+    if sender.comment.field.is_cached(instance):
+        post_id = instance.comment.post_id
+    else:
+        post_id = Comment.objects.filter(pk=instance.comment_id).values_list('post_id', flat=True).first()
+    if post_id is not None:
+        response_cache.touch([post_id])
+
+
+@receiver(variants_ready, sender=Post)
+def touch_post_variants(sender, pk, **kwargs):
+    response_cache.touch([pk])
+
+
+@receiver(post_save, sender=Post)
+def build_post_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance):
+        transaction.on_commit(lambda: derivative_pipeline.schedule(instance))
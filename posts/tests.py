@@ -1,3 +1,388 @@
-from django.test import TestCase
+import os
+import tempfile
+from io import StringIO
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.exceptions import ValidationError
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from usersmodel.models import CustomUser
+from .comment_tree import MAX_DEPTH
+from .models import Comment, CommentReaction, Hashtag, HashtagRollup, Post, PostReaction
+from .prefetch import prepare_comments
+from .response_cache import version_key
+from .trending import TrendingHashtags, attach_hashtags
+
+# Бюджеты запросов на один вызов эндпоинта (с учётом сохранения просмотров и
+# сессии). Они не должны зависеть от глубины веток комментариев и числа реакций.
+POSTS_LIST_QUERY_BUDGET = 10
+POST_DETAIL_QUERY_BUDGET = 17
+COMMENTS_LIST_QUERY_BUDGET = 5
+
+
+@override_settings(POST_VIEWS_FLUSH_INTERVAL=0)
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(email='author@example.com', password='x', name='Author')
+        self.readers = [
+            CustomUser.objects.create_user(email=f'reader{i}@example.com', password='x', name=f'Reader {i}')
+            for i in range(3)
+        ]
+        self.hashtags = [Hashtag.objects.create(name=f'tag{i}') for i in range(3)]
+
+    def make_posts(self, depth, count=8):
+        posts = []
+        for i in range(count):
+            post = Post.objects.create(user=self.author, title=f'Post {i}', text='text')
+            post.hashtags.set(self.hashtags)
+            for reader in self.readers:
+                PostReaction.objects.create(post=post, user=reader, reaction_type='like')
+            parent = None
+            for level in range(depth):
+                parent = Comment.objects.create(post=post, user=self.author, content=f'level {level}', parent_comment=parent)
+                for reader in self.readers:
+                    CommentReaction.objects.create(comment=parent, user=reader, reaction_type='dislike')
+            posts.append(post)
+        return posts
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_posts_list_is_constant_in_thread_depth(self):
+        self.make_posts(depth=2)
+        shallow, _ = self.count_queries('/api/posts/?sortBy=likes')
+        Post.objects.all().delete()
+        self.make_posts(depth=6)
+        deep, data = self.count_queries('/api/posts/?sortBy=likes')
+
+        self.assertEqual(len(data['results']), 8)
+        self.assertEqual(shallow, deep)
+        self.assertLessEqual(deep, POSTS_LIST_QUERY_BUDGET)
+
+    def test_post_detail_is_constant_in_thread_depth(self):
+        shallow_post = self.make_posts(depth=2, count=1)[0]
+        deep_post = self.make_posts(depth=6, count=1)[0]
+        shallow, _ = self.count_queries(f'/api/posts/{shallow_post.pk}/')
+        deep, data = self.count_queries(f'/api/posts/{deep_post.pk}/')
+
+        self.assertEqual(len(data['comments']), 1)
+        self.assertEqual(shallow, deep)
+        self.assertLessEqual(deep, POST_DETAIL_QUERY_BUDGET)
+
+    def test_comments_list_is_constant_in_thread_depth(self):
+        shallow_post = self.make_posts(depth=2, count=1)[0]
+        deep_post = self.make_posts(depth=6, count=1)[0]
+        shallow, _ = self.count_queries(f'/api/posts/{shallow_post.pk}/comments/')
+        deep, data = self.count_queries(f'/api/posts/{deep_post.pk}/comments/')
+
+        self.assertEqual(data['count'], 1)
+        self.assertEqual(shallow, deep)
+        self.assertLessEqual(deep, COMMENTS_LIST_QUERY_BUDGET)
+
+
+@override_settings(POST_VIEWS_FLUSH_INTERVAL=0, COMMENT_TREE_MAX_DEPTH=1, COMMENT_TREE_REPLIES_LIMIT=2)
+class CommentTreeTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+        self.post = Post.objects.create(user=self.user, title='Post', text='text')
+        self.root = Comment.objects.create(post=self.post, user=self.user, content='root')
+        self.children = [
+            Comment.objects.create(post=self.post, user=self.user, content=f'child {i}', parent_comment=self.root)
+            for i in range(3)
+        ]
+        self.grandchild = Comment.objects.create(
+            post=self.post, user=self.user, content='grandchild', parent_comment=self.children[0],
+        )
+
+    def test_thread_is_limited_by_depth_and_children(self):
+        data = APIClient().get(f'/api/posts/{self.post.pk}/comments/').json()
+        root = data['results'][0]
+        self.assertEqual([c['content'] for c in root['replies']], ['child 0', 'child 1'])
+        self.assertEqual(root['replies_cursor'], self.children[1].pk)
+        self.assertEqual(root['replies'][0]['replies'], [])
+        self.assertEqual(root['replies'][0]['replies_cursor'], 0)
+
+    def test_load_more_replies(self):
+        url = f'/api/posts/{self.post.pk}/comments/{self.root.pk}/replies/?after={self.children[1].pk}'
+        data = APIClient().get(url).json()
+        self.assertEqual([c['content'] for c in data['results']], ['child 2'])
+        self.assertIsNone(data['replies_cursor'])
+
+        data = APIClient().get(f'/api/posts/{self.post.pk}/comments/{self.children[0].pk}/replies/').json()
+        self.assertEqual([c['content'] for c in data['results']], ['grandchild'])
+
+    def test_update_keeps_thread_position(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.patch(
+            f'/api/posts/{self.post.pk}/comments/{self.grandchild.pk}/',
+            {'content': 'edited', 'parent_comment': self.children[2].pk}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.grandchild.refresh_from_db()
+        self.assertEqual(self.grandchild.content, 'edited')
+        self.assertEqual(self.grandchild.parent_comment_id, self.children[0].pk)
+        self.assertTrue(self.grandchild.path.startswith(self.children[0].path))
+
+    def test_mixed_depth_list_counts_levels_per_comment(self):
+        comments = prepare_comments(Comment.objects.filter(pk__in=[self.root.pk, self.children[0].pk]).order_by('path'))
+        root, child = comments
+        self.assertEqual([c.content for c in root.prefetched_replies], ['child 0', 'child 1'])
+        self.assertEqual([c.content for c in child.prefetched_replies], ['grandchild'])
+
+    def test_replies_beyond_max_depth_are_rejected(self):
+        parent = self.grandchild
+        while parent.depth < MAX_DEPTH:
+            parent = Comment.objects.create(post=self.post, user=self.user, content='deep', parent_comment=parent)
+        self.assertEqual(len(parent.path), Comment._meta.get_field('path').max_length)
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(
+            f'/api/posts/{self.post.pk}/comments/', {'content': 'too deep', 'parent_comment': parent.pk}, format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('parent_comment', response.json())
+        with self.assertRaises(ValidationError):
+            Comment.objects.create(post=self.post, user=self.user, content='too deep', parent_comment=parent)
+        self.assertFalse(Comment.objects.filter(content='too deep').exists())
+
+
+@override_settings(POST_VIEWS_FLUSH_INTERVAL=0, POSTS_RESPONSE_CACHE_TIMEOUT=0)
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+        posts = [Post.objects.create(user=user, title=f'Post {i}') for i in range(20)]
+        # все в одной миллисекунде, часть - с одинаковым временем
+        moment = timezone.now().replace(microsecond=123000)
+        for i, post in enumerate(posts):
+            Post.objects.filter(pk=post.pk).update(created_at=moment + timedelta(microseconds=i // 3 * 100))
+        self.expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def pages(self, url):
+        ids = []
+        while url:
+            data = APIClient().get(url).json()
+            ids.append([post['id'] for post in data['results']])
+            url = data['next']
+        return ids
+
+    def test_sub_millisecond_ties(self):
+        pages = self.pages('/api/posts/?sortBy=date')
+        self.assertEqual(sum(pages, []), self.expected)
+
+        second = APIClient().get('/api/posts/?sortBy=date').json()['next']
+        data = APIClient().get(APIClient().get(second).json()['previous']).json()
+        self.assertEqual([post['id'] for post in data['results']], pages[0])
+
+
+class MediaServingTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.root.cleanup)
+        self.body = bytes(range(256)) * 4
+        with open(os.path.join(self.root.name, 'file.bin'), 'wb') as f:
+            f.write(self.body)
+        settings = override_settings(MEDIA_ROOT=self.root.name)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def get(self, **headers):
+        response = self.client.get('/media/file.bin', headers=headers)
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, content
+
+    def assertPartial(self, response, content, start, end):
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(content, self.body[start:end + 1])
+        self.assertEqual(response['Content-Length'], str(end - start + 1))
+        self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/{len(self.body)}')
+
+    def test_full_file(self):
+        response, content = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+        self.assertEqual(response['Content-Length'], str(len(self.body)))
+
+    def test_closed_range(self):
+        self.assertPartial(*self.get(range='bytes=0-9'), 0, 9)
+
+    def test_open_ended_range(self):
+        self.assertPartial(*self.get(range='bytes=1000-'), 1000, 1023)
+
+    def test_suffix_range(self):
+        self.assertPartial(*self.get(range='bytes=-4'), 1020, 1023)
+
+    def test_unsatisfiable_range(self):
+        response, content = self.get(range='bytes=5000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.body)}')
+        self.assertEqual(content, b'')
+
+    def test_if_range(self):
+        etag = self.get()[0]['ETag']
+        self.assertPartial(*self.get(range='bytes=10-19', if_range=etag), 10, 19)
+        response, content = self.get(range='bytes=10-19', if_range='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(content, self.body)
+
+
+@override_settings(TRENDING_FLUSH_INTERVAL=0, TRENDING_REFRESH_INTERVAL=3600)
+class TrendingTests(TestCase):
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(email='author@example.com', password='x', name='Author')
+        self.trending = TrendingHashtags()
+        # без фонового потока: пересчёт вызываем руками
+        patcher = mock.patch.object(self.trending._refresher, 'ensure_started')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_mixed_case_tag_is_reused(self):
+        tag = Hashtag.objects.create(name='Django')
+        post = Post.objects.create(user=self.author, title='#django', text='#DJANGO and #orm')
+        added = attach_hashtags(post)
+        self.assertIn(tag.pk, added)
+        self.assertEqual(Hashtag.objects.filter(name__iexact='django').count(), 1)
+        self.assertEqual(set(post.hashtags.values_list('name', flat=True)), {'Django', 'orm'})
+
+    def test_top_reads_snapshot(self):
+        tag, other = Hashtag.objects.create(name='tag'), Hashtag.objects.create(name='other')
+        self.trending.record([tag.pk, tag.pk])
+        self.assertEqual(self.trending.top('day'), [{'id': tag.pk, 'name': 'tag', 'count': 2}])
+
+        # события других процессов видны только после фонового пересчёта
+        HashtagRollup.objects.create(bucket=self.trending.bucket(timezone.now().timestamp()), hashtag=other, count=5)
+        with self.assertNumQueries(0):
+            self.assertEqual([row['id'] for row in self.trending.top('day')], [tag.pk])
+        self.trending.refresh()
+        self.assertEqual([row['id'] for row in self.trending.top('day')], [other.pk, tag.pk])
+
+
+@override_settings(
+    POST_VIEWS_FLUSH_INTERVAL=0,
+    POSTS_RESPONSE_CACHE='responses',
+    POSTS_RESPONSE_CACHE_TIMEOUT=60,
+    CACHES={
+        'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+        'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-shared'},
+        'responses': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-responses'},
+    },
+)
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        caches['responses'].clear()
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+        self.post = Post.objects.create(user=self.user, title='Old title', text='text')
+        self.list_url, self.detail_url = '/api/posts/', f'/api/posts/{self.post.pk}/'
+
+    def titles(self, url):
+        data = APIClient().get(url).json()
+        return [post['title'] for post in data['results']] if 'results' in data else [data['title']]
+
+    def test_if_none_match(self):
+        for url in (self.list_url, self.detail_url):
+            first = APIClient().get(url)
+            self.assertEqual(first.status_code, 200)
+            etag = first['ETag']
+            cached = APIClient().get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(cached.status_code, 304)
+            self.assertEqual(cached['ETag'], etag)
+            self.assertEqual(APIClient().get(url, HTTP_IF_NONE_MATCH='"other"').status_code, 200)
+
+    def test_post_change_invalidates_list_and_detail(self):
+        self.assertEqual(self.titles(self.list_url), ['Old title'])
+        self.assertEqual(self.titles(self.detail_url), ['Old title'])
+        # без сигнала - ответы из кеша
+        Post.objects.filter(pk=self.post.pk).update(title='Silent title')
+        self.assertEqual(self.titles(self.list_url), ['Old title'])
+        self.assertEqual(self.titles(self.detail_url), ['Old title'])
+
+        self.post.title = 'New title'
+        self.post.save()
+        self.assertEqual(self.titles(self.list_url), ['New title'])
+        self.assertEqual(self.titles(self.detail_url), ['New title'])
+
+        Post.objects.create(user=self.user, title='Another', text='text')
+        self.assertEqual(sorted(self.titles(self.list_url)), ['Another', 'New title'])
+
+    def test_mark_survives_cache_eviction(self):
+        self.assertEqual(self.titles(self.detail_url), ['Old title'])
+        self.post.title = 'New title'
+        self.post.save()
+        caches['responses'].delete(version_key(self.post.pk))
+        self.assertEqual(self.titles(self.detail_url), ['New title'])
+
+
+@override_settings(POST_VIEWS_FLUSH_INTERVAL=0)
+class CounterTests(TestCase):
+    def setUp(self):
+        self.users = [
+            CustomUser.objects.create_user(email=f'user{i}@example.com', password='x', name=f'User {i}') for i in range(3)
+        ]
+        self.post = Post.objects.create(user=self.users[0], title='Post', text='text')
+        self.comment = Comment.objects.create(post=self.post, user=self.users[0], content='root')
+
+    def counters(self, obj, *fields):
+        obj.refresh_from_db(fields=fields)
+        return tuple(getattr(obj, field) for field in fields)
+
+    def test_reaction_create_switch_delete(self):
+        for target, model in ((self.post, PostReaction), (self.comment, CommentReaction)):
+            field = target._meta.model_name
+            likes = [model.objects.create(user=user, reaction_type='like', **{field: target}) for user in self.users[:2]]
+            self.assertEqual(self.counters(target, 'like_count', 'dislike_count'), (2, 0))
+
+            reaction = model.objects.get(pk=likes[0].pk)
+            reaction.reaction_type = 'dislike'
+            reaction.save()
+            # повторное сохранение без изменений ничего не сдвигает
+            reaction.save()
+            self.assertEqual(self.counters(target, 'like_count', 'dislike_count'), (1, 1))
+
+            reaction.delete()
+            likes[1].delete()
+            self.assertEqual(self.counters(target, 'like_count', 'dislike_count'), (0, 0))
+
+    def test_comment_create_and_cascade_delete(self):
+        replies = [
+            Comment.objects.create(post=self.post, user=user, content='reply', parent_comment=self.comment) for user in self.users
+        ]
+        Comment.objects.create(post=self.post, user=self.users[0], content='deep', parent_comment=replies[0])
+        self.assertEqual(self.counters(self.post, 'comments_count'), (5,))
+        replies[0].delete()
+        self.assertEqual(self.counters(self.post, 'comments_count'), (3,))
+        self.comment.delete()
+        self.assertEqual(self.counters(self.post, 'comments_count'), (0,))
+
+    def test_reconcile_counters(self):
+        PostReaction.objects.create(post=self.post, user=self.users[1], reaction_type='like')
+        CommentReaction.objects.create(comment=self.comment, user=self.users[1], reaction_type='dislike')
+        Post.objects.filter(pk=self.post.pk).update(like_count=7, comments_count=0)
+        Comment.objects.filter(pk=self.comment.pk).update(dislike_count=3)
+
+        out = StringIO()
+        call_command('reconcile_counters', '--dry-run', stdout=out)
+        self.assertIn('1 drifted', out.getvalue())
+        self.assertEqual(self.counters(self.post, 'like_count', 'comments_count'), (7, 0))
+        self.assertEqual(self.counters(self.comment, 'dislike_count'), (3,))
+
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertEqual(out.getvalue().count('1 repaired'), 2)
+        self.assertEqual(self.counters(self.post, 'like_count', 'dislike_count', 'comments_count'), (1, 0, 1))
+        self.assertEqual(self.counters(self.comment, 'like_count', 'dislike_count'), (0, 1))
+
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertEqual(out.getvalue().count('0 repaired'), 2)
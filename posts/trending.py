@@ -0,0 +1,220 @@
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from social_media.periodic import PeriodicWorker
+
+from .models import Hashtag, HashtagRollup, Post
+
+logger = logging.getLogger(__name__)
+
+HASHTAG_RE = re.compile(r'#(\w{1,100})')
+WINDOWS = {
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400,
+}
+
+
+def extract_hashtags(*texts):
+    names = []
+    for text in texts:
+        for name in HASHTAG_RE.findall(text or ''):
+            name = name.casefold()
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def attach_hashtags(post):
+    # хештеги берутся из заголовка и текста поста; возвращает id новых привязок
+    names = extract_hashtags(post.title, post.text)
+    if not names:
+        return []
+    # теги, созданные до приведения к нижнему регистру (Django), ищем без учёта
+    # регистра, иначе рядом с ними появились бы дубликаты
+    known = {}
+    rows = Hashtag.objects.filter(reduce(or_, (Q(name__iexact=name) for name in names))).order_by('pk')
+    for hashtag_id, name in rows.values_list('id', 'name'):
+        known.setdefault(name.casefold(), hashtag_id)
+    # новые теги по одному: их post_save нужен индексу автодополнения
+    ids = set(known.values()) | {
+        Hashtag.objects.get_or_create(name=name)[0].pk for name in names if name not in known
+    }
+    through = Post.hashtags.through
+    existing = set(through.objects.filter(post=post, hashtag_id__in=ids).values_list('hashtag_id', flat=True))
+    added = sorted(ids - existing)
+    through.objects.bulk_create([through(post_id=post.pk, hashtag_id=hashtag_id) for hashtag_id in added])
+    return added
+
+
+class TrendingHashtags:
+    # Скользящие окна использований хештегов. Процесс копит свои события в
+    # памяти и сбрасывает их в HashtagRollup по корзинам TRENDING_BUCKET секунд;
+    # суммы окон раз в TRENDING_REFRESH_INTERVAL пересчитываются фоновым потоком
+    # по rollup-ам (там уже события всех процессов), между пересчётами к ним
+    # добавляются локальные. Топ каждого окна считается заранее, запрос его
+    # только читает.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = defaultdict(int)
+        self._totals = None
+        self._names = {}
+        self._top = {}
+        self._dirty = False
+        self._flusher = PeriodicWorker('hashtag-rollups-flush', self.flush, lambda: self.flush_interval, on_exit=self.flush)
+        self._refresher = PeriodicWorker('trending-refresh', self.refresh, lambda: self.refresh_interval)
+
+    @property
+    def bucket_size(self):
+        return getattr(settings, 'TRENDING_BUCKET', 300)
+
+    @property
+    def flush_interval(self):
+        return getattr(settings, 'TRENDING_FLUSH_INTERVAL', 10)
+
+    @property
+    def refresh_interval(self):
+        return getattr(settings, 'TRENDING_REFRESH_INTERVAL', 60)
+
+    @property
+    def top_size(self):
+        return getattr(settings, 'TRENDING_TOP_SIZE', 100)
+
+    def bucket(self, timestamp):
+        start = int(timestamp) // self.bucket_size * self.bucket_size
+        return datetime.fromtimestamp(start, tz=dt_timezone.utc)
+
+    def record(self, hashtag_ids, timestamp=None):
+        if not hashtag_ids:
+            return
+        bucket = self.bucket(timestamp or time.time())
+        with self._lock:
+            for hashtag_id in hashtag_ids:
+                self._pending[(bucket, hashtag_id)] += 1
+                if self._totals is not None:
+                    for totals in self._totals.values():
+                        totals[hashtag_id] += 1
+                    self._dirty = True
+        if self.flush_interval <= 0:
+            self.flush()
+        else:
+            self._flusher.ensure_started()
+
+    def top(self, window='day', limit=10):
+        self._ensure_fresh()
+        with self._lock:
+            if self._dirty:
+                self._rank()
+            return self._top[window][:limit]
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(int)
+            if not pending:
+                return 0
+            try:
+                self._write(pending)
+            except Exception:
+                logger.exception('Failed to flush %d hashtag rollups', len(pending))
+                with self._lock:
+                    for key, count in pending.items():
+                        self._pending[key] += count
+                return 0
+            return len(pending)
+
+    def refresh(self):
+        self.flush()
+        self.reload()
+
+    def reload(self):
+        now = time.time()
+        oldest = self.bucket(now - max(WINDOWS.values()))
+        starts = {window: self.bucket(now - seconds) for window, seconds in WINDOWS.items()}
+        totals = {window: Counter() for window in WINDOWS}
+        names = {}
+        # под _flush_lock каждое событие либо уже в rollup-ах, либо ещё в _pending
+        with self._flush_lock:
+            rows = (
+                HashtagRollup.objects.filter(bucket__gte=oldest)
+                .values('hashtag_id', 'hashtag__name', 'bucket').annotate(total=Sum('count'))
+            )
+            for row in rows:
+                names[row['hashtag_id']] = row['hashtag__name']
+                for window, start in starts.items():
+                    if row['bucket'] >= start:
+                        totals[window][row['hashtag_id']] += row['total']
+            with self._lock:
+                for (bucket, hashtag_id), count in self._pending.items():
+                    for window, start in starts.items():
+                        if bucket >= start:
+                            totals[window][hashtag_id] += count
+                self._totals, self._names = totals, names
+                self._rank()
+
+    def prune(self, retention=None):
+        retention = retention or getattr(settings, 'TRENDING_RETENTION', 30 * 86400)
+        deleted, _ = HashtagRollup.objects.filter(bucket__lt=self.bucket(time.time() - retention)).delete()
+        return deleted
+
+    def shutdown(self):
+        self._refresher.shutdown()
+        self._flusher.shutdown()
+
+    def _rank(self):
+        missing = {hashtag_id for totals in self._totals.values() for hashtag_id in totals} - set(self._names)
+        if missing:
+            self._names.update(Hashtag.objects.filter(id__in=missing).values_list('id', 'name'))
+        self._top = {
+            window: [
+                {'id': hashtag_id, 'name': self._names.get(hashtag_id), 'count': count}
+                for hashtag_id, count in heapq.nlargest(
+                    self.top_size, totals.items(), key=lambda item: (item[1], -item[0]),
+                )
+            ]
+            for window, totals in self._totals.items()
+        }
+        self._dirty = False
+
+    def _ensure_fresh(self):
+        if self.refresh_interval > 0:
+            if self._totals is None:
+                # синхронно загружаемся только первый раз в процессе
+                self.refresh()
+            self._refresher.ensure_started()
+        else:
+            # без фонового потока (тесты) - пересчёт при каждом обращении
+            self.refresh()
+
+    def _write(self, pending):
+        keys = list(pending)
+        by_count = defaultdict(list)
+        for (bucket, hashtag_id), count in pending.items():
+            by_count[count].append((bucket, hashtag_id))
+        with transaction.atomic():
+            HashtagRollup.objects.bulk_create(
+                [HashtagRollup(bucket=bucket, hashtag_id=hashtag_id) for bucket, hashtag_id in keys],
+                ignore_conflicts=True,
+            )
+            for count, group in by_count.items():
+                by_bucket = defaultdict(list)
+                for bucket, hashtag_id in group:
+                    by_bucket[bucket].append(hashtag_id)
+                for bucket, hashtag_ids in by_bucket.items():
+                    HashtagRollup.objects.filter(bucket=bucket, hashtag_id__in=hashtag_ids).update(count=F('count') + count)
+
+
+trending = TrendingHashtags()
@@ -0,0 +1,105 @@
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from social_media.periodic import PeriodicWorker
+
+from .hll import HyperLogLog
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+
+class ViewCountBuffer:
+    def __init__(self, flush_interval=None):
+        self._flush_interval = flush_interval
+        self._pending = defaultdict(int)
+        self._sketches = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher = PeriodicWorker('post-views-flush', self.flush, lambda: self.flush_interval, on_exit=self.flush)
+
+    @property
+    def flush_interval(self):
+        if self._flush_interval is not None:
+            return self._flush_interval
+        return getattr(settings, 'POST_VIEWS_FLUSH_INTERVAL', 5)
+
+    def add(self, post_id, count=1, viewer=None):
+        self.add_many([post_id], count, viewer)
+
+    def add_many(self, post_ids, count=1, viewer=None):
+        if not post_ids:
+            return
+        if self.flush_interval <= 0:
+            sketches = {}
+            if viewer:
+                for post_id in post_ids:
+                    sketches[post_id] = HyperLogLog()
+                    sketches[post_id].add(viewer)
+            self._write({post_id: count for post_id in post_ids}, sketches)
+            return
+        with self._lock:
+            for post_id in post_ids:
+                self._pending[post_id] += count
+                if viewer:
+                    self._sketches.setdefault(post_id, HyperLogLog()).add(viewer)
+        self._flusher.ensure_started()
+
+    def pending(self, post_id):
+        with self._lock:
+            return self._pending.get(post_id, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._pending)
+
+    def live_count(self, post):
+        return post.views_count + self.pending(post.pk)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, defaultdict(int)
+                sketches, self._sketches = self._sketches, {}
+            if not pending and not sketches:
+                return 0
+            try:
+                self._write(pending, sketches)
+            except Exception:
+                logger.exception('Failed to flush %d buffered post view counts', len(pending))
+                with self._lock:
+                    for post_id, count in pending.items():
+                        self._pending[post_id] += count
+                    for post_id, sketch in sketches.items():
+                        self._sketches.setdefault(post_id, HyperLogLog()).merge(sketch)
+                return 0
+            return len(pending)
+
+    def shutdown(self):
+        self._flusher.shutdown()
+
+    def _write(self, pending, sketches=None):
+        by_count = defaultdict(list)
+        for post_id, count in pending.items():
+            by_count[count].append(post_id)
+        with transaction.atomic():
+            for count, post_ids in by_count.items():
+                Post.objects.filter(pk__in=post_ids).update(views_count=F('views_count') + count)
+            if sketches:
+                self._merge_sketches(sketches)
+
+    def _merge_sketches(self, sketches):
+        stored = Post.objects.filter(pk__in=list(sketches)).values_list('pk', 'viewers_sketch')
+        posts = []
+        for post_id, data in stored:
+            sketch = HyperLogLog.from_bytes(data).merge(sketches[post_id])
+            posts.append(Post(pk=post_id, viewers_sketch=sketch.to_bytes(), unique_viewers=sketch.count()))
+        Post.objects.bulk_update(posts, ['viewers_sketch', 'unique_viewers'])
+
+
+view_counter = ViewCountBuffer()
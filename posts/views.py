@@ -1,13 +1,41 @@
-from django.db.models import Q, Count, OuterRef, Subquery
-from django.contrib.contenttypes.models import ContentType
-from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponseNotModified
 
-from rest_framework import viewsets, permissions
+from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from .models import Post, Comment, Hashtag, PostReaction, CommentReaction
 from .serializers import CommentSerializer, PostSerializer, HashtagSerializer, PostReactionSerializer, CommentReactionSerializer
+from .pagination import KeysetCursorPagination
+from .prefetch import load_replies, post_prefetches, prepare_comments, prepare_posts, tree_options
+from .ranking import Timings, rank
+from .response_cache import LIST_GENERATION, REACTIONS_GENERATION, response_cache
+from .trending import WINDOWS, trending
+from .view_counter import view_counter
+from search.backends import match_filter
+from usersmodel import timeline
+
+MAX_TREE_DEPTH = 10
+MAX_REPLIES_LIMIT = 50
+TRENDING_LIMIT = 10
+TIMELINE_LIMIT = 20
+MAX_TIMELINE_LIMIT = 100
+
+
+def get_int_param(request, name, default=None, maximum=None):
+    try:
+        value = max(int(request.query_params[name]), 0)
+    except (KeyError, ValueError):
+        return default
+    return min(value, maximum) if maximum is not None else value
+
+
+def get_tree_options(request):
+    return tree_options(
+        get_int_param(request, 'max_depth', maximum=MAX_TREE_DEPTH),
+        get_int_param(request, 'replies_limit', maximum=MAX_REPLIES_LIMIT),
+    )
 
 
 class CommentViewSet(viewsets.ModelViewSet):
@@ -16,9 +44,36 @@ class CommentViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         if 'post_pk' in self.kwargs:
-            return Comment.objects.filter(post=self.kwargs['post_pk']).order_by('-created_at')
+            queryset = Comment.objects.filter(post=self.kwargs['post_pk'])
+            if self.action == 'list':
+                # ответы приходят вложенными в свои ветки
+                queryset = queryset.filter(parent_comment__isnull=True)
+            return queryset.order_by('-created_at')
         return Comment.objects.all().order_by('-created_at')
 
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(prepare_comments(page, *get_tree_options(request)), many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(prepare_comments(queryset, *get_tree_options(request)), many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        comment = prepare_comments([self.get_object()], *get_tree_options(request))[0]
+        serializer = self.get_serializer(comment)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def replies(self, request, *args, **kwargs):
+        comment = self.get_object()
+        after = get_int_param(request, 'after', default=0)
+        replies, cursor = load_replies(comment, after, *get_tree_options(request))
+        serializer = self.get_serializer(replies, many=True)
+        return Response({'replies_cursor': cursor, 'results': serializer.data})
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user, post=self.get_post())
 
@@ -27,9 +82,9 @@ class CommentViewSet(viewsets.ModelViewSet):
         return Post.objects.get(pk=self.kwargs['post_pk'])
 
     @action(detail=False, methods=['get'], url_path='all-comments')
-    def list_all_comments(self, request):
+    def list_all_comments(self, request, *args, **kwargs):
         all_comments = Comment.objects.all().order_by('-created_at')
-        serializer = self.get_serializer(all_comments, many=True)
+        serializer = self.get_serializer(prepare_comments(all_comments, *get_tree_options(request)), many=True)
         return Response(serializer.data)
 
 
@@ -42,7 +97,7 @@ class PostReactionViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
     def get_queryset(self):
-        return self.queryset.order_by('post')
+        return self.queryset.select_related('post').order_by('post')
 
 
 class CommentReactionViewSet(viewsets.ModelViewSet):
@@ -54,7 +109,7 @@ class CommentReactionViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user).order_by('comment')  
+        return self.queryset.filter(user=self.request.user).select_related('comment').order_by('comment')  
 
 
 def get_client_ip(request):
@@ -67,12 +122,13 @@ def get_client_ip(request):
 
 
 class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all().order_by('-created_at')
+    queryset = Post.objects.defer('viewers_sketch').order_by('-created_at')
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    pagination_class = KeysetCursorPagination
    
     def get_queryset(self):
-        queryset = super().get_queryset()  
+        queryset = super().get_queryset().prefetch_related(*post_prefetches(*get_tree_options(self.request)))
     
         user_id = self.request.query_params.get('user')
         hashtag_param = self.request.query_params.get('hashtags')  
@@ -89,48 +145,93 @@ class PostViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(Q(hashtags__id__in=hashtags)).distinct()  
     
         if title_query:
-            queryset = queryset.filter(title__icontains=title_query)
+            # по полнотекстовому индексу вместо title__icontains (полного прохода по таблице)
+            queryset = queryset.filter(match_filter('post', title_query, columns=['title'], prefix=True))
     
     
         if sort_by == 'views':
-            queryset = queryset.order_by('-views_count')  
+            # по сохранённому счётчику (индекс post_views_count_idx); отложенные
+            # просмотры добавляет к показу сериализатор
+            queryset = queryset.order_by('-views_count')
         elif sort_by == 'likes':
-            queryset = queryset.annotate(like_count=Count('reactions', filter=Q(reactions__reaction_type='like'))).order_by('-like_count') 
+            queryset = queryset.order_by('-like_count')
         elif sort_by == 'dislikes':
-            queryset = queryset.annotate(dislike_count=Count('reactions', filter=Q(reactions__reaction_type='dislike'))).order_by('-dislike_count')  
+            queryset = queryset.order_by('-dislike_count')
         return queryset  
     
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        ip_address = get_client_ip(request)
-        viewed_ips_set = {ip for post in queryset for ip in post.viewed_ips}
-        posts_to_update = []
-    
-        for post in queryset:
-            if ip_address and ip_address not in viewed_ips_set:
-                post.increment_views(ip_address=ip_address)
-                posts_to_update.append(post)
-    
-        if posts_to_update:
-            with transaction.atomic():
-                for post in posts_to_update:
-                    post.save()  
-    
+        entry, self.cache_token = response_cache.lookup(request, 'list')
+        if entry is not None:
+            view_counter.add_many(entry['post_ids'], viewer=get_client_ip(request))
+            return response_cache.respond(request, entry)
+
+        queryset = self.filter_queryset(self.get_queryset())
         page = self.paginate_queryset(queryset)
+        posts = prepare_posts(page if page is not None else list(queryset), *get_tree_options(request))
+
+        view_counter.add_many([post.pk for post in posts], viewer=get_client_ip(request))
+        generations = [LIST_GENERATION]
+        if request.query_params.get('sortBy') in ('likes', 'dislikes'):
+            generations.append(REACTIONS_GENERATION)
+        self.cache_entry = ([post.pk for post in posts], generations)
+    
         if page is not None:
-            serializer = self.get_serializer(page, many=True)
+            serializer = self.get_serializer(posts, many=True)
             return self.get_paginated_response(serializer.data)
     
-        serializer = self.get_serializer(queryset, many=True)
+        serializer = self.get_serializer(posts, many=True)
         return Response(serializer.data)
 
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def serialize_ids(self, post_ids):
+        # посты в заданном порядке; удалённые из лент не убираются, просто пропускаем их
+        posts = Post.objects.defer('viewers_sketch').prefetch_related(
+            *post_prefetches(*get_tree_options(self.request))
+        ).in_bulk(post_ids)
+        posts = prepare_posts([posts[post_id] for post_id in post_ids if post_id in posts], *get_tree_options(self.request))
+        view_counter.add_many([post.pk for post in posts], viewer=get_client_ip(self.request))
+        return self.get_serializer(posts, many=True).data
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def timeline(self, request):
+        # домашняя лента: ?before=<id поста>&limit=
+        limit = get_int_param(request, 'limit', TIMELINE_LIMIT, MAX_TIMELINE_LIMIT) or TIMELINE_LIMIT
+        post_ids, has_more = timeline.page(request.user.pk, get_int_param(request, 'before'), limit)
+        return Response({
+            'results': self.serialize_ids(post_ids),
+            'has_more': has_more,
+            'before': post_ids[-1] if post_ids else None,
+        })
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def feed(self, request):
+        # ранжированная лента: ?limit=&offset=; длительность этапов - в Server-Timing
+        timings = Timings()
+        limit = get_int_param(request, 'limit', TIMELINE_LIMIT, MAX_TIMELINE_LIMIT) or TIMELINE_LIMIT
+        offset = get_int_param(request, 'offset', 0)
+        post_ids, has_more = rank(request.user.pk, limit, offset, timings)
+        with timings.stage('serialize'):
+            data = self.serialize_ids(post_ids)
+        response = Response({'results': data, 'has_more': has_more, 'offset': offset + len(post_ids)})
+        response['Server-Timing'] = timings.header()
+        return response
+
     def retrieve(self, request, *args, **kwargs):
-        post = self.get_object()
-    
+        entry, self.cache_token = response_cache.lookup(request, 'detail')
+        if entry is not None:
+            self.count_view(request, Post(pk=entry['post_ids'][0]))
+            return response_cache.respond(request, entry)
+
+        post = prepare_posts([self.get_object()], *get_tree_options(request))[0]
+        self.count_view(request, post)
+        self.cache_entry = ([post.pk], [])
+        serializer = self.get_serializer(post)
+        return Response(serializer.data)
+
+    def count_view(self, request, post):
         session_key = request.session.session_key
         if not session_key:
             request.session.create() 
@@ -144,12 +245,27 @@ class PostViewSet(viewsets.ModelViewSet):
             post.increment_views(session_key=session_key)
         elif ip_address:
             post.increment_views(ip_address=ip_address)
-    
-        serializer = self.get_serializer(post)
-        return Response(serializer.data)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        entry = getattr(self, 'cache_entry', None)
+        if entry is not None and self.cache_token is not None and response.status_code == 200:
+            etag = response_cache.store(self.cache_token, response, *entry)
+            if response_cache.matches(request, etag):
+                return HttpResponseNotModified(headers={'ETag': etag})
+        return response
 
 
 class HashtagViewSet(viewsets.ModelViewSet):
     queryset = Hashtag.objects.all()
     serializer_class = HashtagSerializer
-    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
\ No newline at end of file
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        # ?window=hour|day|week&limit= - готовый топ из памяти, без скана posts_post_hashtags
+        window = request.query_params.get('window', 'day')
+        if window not in WINDOWS:
+            return Response({'detail': f"window: {', '.join(WINDOWS)}"}, status=status.HTTP_400_BAD_REQUEST)
+        limit = get_int_param(request, 'limit', TRENDING_LIMIT, trending.top_size) or TRENDING_LIMIT
+        return Response({'window': window, 'results': trending.top(window, limit)})
\ No newline at end of file
@@ -0,0 +1,340 @@
+import atexit
+import bisect
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from functools import lru_cache
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from posts.models import Hashtag as PostHashtag
+from usersmodel.models import CustomUser, Hashtag as UserHashtag
+
+from social_media.periodic import PeriodicWorker
+
+from .backends import WORD_RE, normalize
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+# минимальная доля общих триграмм для нечёткого совпадения
+MIN_SIMILARITY = 0.3
+# сколько записей с общими триграммами проверять на опечатку, не больше
+FUZZY_CANDIDATES = 2000
+
+SOURCES = {
+    'users': (CustomUser, ('name', 'surname')),
+    'hashtags': (PostHashtag, ('name',)),
+    'user_hashtags': (UserHashtag, ('name',)),
+}
+MODELS = {model: namespace for namespace, (model, _) in SOURCES.items()}
+
+
+# имена и теги сильно повторяются: нормализация и триграммы слова
+# считаются один раз и при сборке, и при проверке кандидатов на опечатку
+@lru_cache(maxsize=200000)
+def trigrams(word):
+    padded = f'  {word} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+normalize_word = lru_cache(maxsize=200000)(normalize)
+
+
+def entry_tokens(fields):
+    return sorted({normalize_word(word) for value in fields.values() for word in WORD_RE.findall(value or '')})
+
+
+class Namespace:
+    def __init__(self):
+        self.entries = {}
+        self.terms = []
+        self.grams = defaultdict(set)
+
+    @classmethod
+    def build(cls, rows):
+        # сборка целиком: термы сортируются один раз, а не вставкой по одному
+        space = cls()
+        for entry_id, fields in rows:
+            tokens = entry_tokens(fields)
+            space.entries[entry_id] = (fields, tokens)
+            for token in tokens:
+                space.terms.append((token, entry_id))
+                for gram in trigrams(token):
+                    space.grams[gram].add(entry_id)
+        space.terms.sort()
+        return space
+
+    def add(self, entry_id, fields):
+        self.remove(entry_id)
+        tokens = entry_tokens(fields)
+        self.entries[entry_id] = (fields, tokens)
+        for token in tokens:
+            bisect.insort(self.terms, (token, entry_id))
+            for gram in trigrams(token):
+                self.grams[gram].add(entry_id)
+
+    def remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return
+        for token in entry[1]:
+            position = bisect.bisect_left(self.terms, (token, entry_id))
+            if position < len(self.terms) and self.terms[position] == (token, entry_id):
+                del self.terms[position]
+            for gram in trigrams(token):
+                ids = self.grams.get(gram)
+                if ids is not None:
+                    ids.discard(entry_id)
+                    if not ids:
+                        del self.grams[gram]
+
+    def prefixed(self, prefix):
+        # без среза terms[start:] - он копировал бы весь хвост списка
+        position = bisect.bisect_left(self.terms, (prefix,))
+        ids = set()
+        while position < len(self.terms) and self.terms[position][0].startswith(prefix):
+            ids.add(self.terms[position][1])
+            position += 1
+        return ids
+
+    def query(self, text, limit):
+        words = [normalize_word(word) for word in WORD_RE.findall(text or '')]
+        if not words:
+            return []
+
+        # все слова запроса - префиксы слов записи
+        exact = None
+        for word in words:
+            ids = self.prefixed(word)
+            exact = ids if exact is None else exact & ids
+            if not exact:
+                break
+        ranked = sorted(exact or (), key=lambda entry_id: (len(self.entries[entry_id][1]), entry_id))
+        if len(ranked) >= limit:
+            return ranked[:limit]
+
+        # опечатки: похожесть последнего слова по триграммам. Для похожести
+        # MIN_SIMILARITY нужно не меньше needed общих триграмм, значит запись
+        # есть хотя бы в одном из len - needed + 1 самых коротких списков -
+        # кандидатов берём только из них и не больше FUZZY_CANDIDATES
+        query_grams = trigrams(words[-1])
+        needed = max(1, int(MIN_SIMILARITY * len(query_grams)))
+        postings = sorted((self.grams.get(gram, ()) for gram in query_grams), key=len)
+        candidates = set(islice(chain.from_iterable(postings[:len(postings) - needed + 1]), FUZZY_CANDIDATES))
+        wanted = limit - len(ranked)
+        counts = sorted(
+            ((sum(entry_id in ids for ids in postings), entry_id) for entry_id in candidates.difference(ranked)),
+            key=lambda item: -item[0],
+        )
+        best_matches = []
+        for count, entry_id in counts:
+            # похожесть слова записи не больше count / len(query_grams): дальше
+            # кандидаты, которые уже не попадут в выдачу
+            bound = count / len(query_grams)
+            if bound < MIN_SIMILARITY:
+                break
+            if len(best_matches) == wanted and bound < best_matches[0][0]:
+                break
+            best = max((count / len(query_grams | trigrams(token)) for token in self.entries[entry_id][1]), default=0)
+            if best >= MIN_SIMILARITY:
+                heapq.heappush(best_matches, (best, -entry_id))
+                if len(best_matches) > wanted:
+                    heapq.heappop(best_matches)
+        return ranked + [-entry_id for _, entry_id in sorted(best_matches, reverse=True)]
+
+
+class AutocompleteIndex:
+    # Индекс автодополнения в памяти процесса. Обновляется сигналами моделей,
+    # при старте поднимается из снимка на диске, если тот не устарел. Сверка
+    # с БД и пересборка идут в фоновом потоке, запрос только читает индекс.
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._namespaces = None
+        self._fingerprints = {}
+        self._checked_at = 0.0
+        self._built_at = 0.0
+        self._dirty = False
+        self._rebuild_lock = threading.Lock()
+        self._journal = None
+        self._refresher = PeriodicWorker('autocomplete-refresh', self.refresh, lambda: self.refresh_interval)
+        atexit.register(self.save_if_dirty)
+
+    @property
+    def snapshot_path(self):
+        return str(getattr(settings, 'AUTOCOMPLETE_SNAPSHOT', os.path.join(settings.BASE_DIR, 'autocomplete.json')))
+
+    @property
+    def refresh_interval(self):
+        return getattr(settings, 'AUTOCOMPLETE_REFRESH_INTERVAL', 60)
+
+    @property
+    def rebuild_interval(self):
+        return getattr(settings, 'AUTOCOMPLETE_REBUILD_INTERVAL', 900)
+
+    def fingerprint(self, namespace):
+        model = SOURCES[namespace][0]
+        stats = model.objects.aggregate(count=Count('pk'), last=Max('pk'))
+        return [stats['count'], stats['last']]
+
+    def query(self, namespace, text, limit=10):
+        self._ensure_fresh()
+        with self._lock:
+            space = self._namespaces[namespace]
+            return [(entry_id, space.entries[entry_id][0]) for entry_id in space.query(text, limit)]
+
+    def ids(self, namespace, text, limit=1000):
+        return [entry_id for entry_id, _ in self.query(namespace, text, limit)]
+
+    def size(self, namespace):
+        self._ensure_fresh()
+        return len(self._namespaces[namespace].entries)
+
+    def update(self, instance):
+        namespace = MODELS[type(instance)]
+        with self._lock:
+            if self._namespaces is None:
+                return
+            fields = {name: getattr(instance, name) or '' for name in SOURCES[namespace][1]}
+            self._apply(self._namespaces, ('add', namespace, instance.pk, fields))
+            self._fingerprints[namespace] = None
+            self._dirty = True
+
+    def remove(self, model, pk):
+        namespace = MODELS[model]
+        with self._lock:
+            if self._namespaces is None:
+                return
+            self._apply(self._namespaces, ('remove', namespace, pk, None))
+            self._fingerprints[namespace] = None
+            self._dirty = True
+
+    def refresh(self):
+        # сигналы обновляют только свой процесс: сверяем (count, max id) с БД,
+        # чтобы подхватить записи из других воркеров. Переименования отпечаток
+        # не меняют, поэтому раз в rebuild_interval индекс собирается заново
+        with self._lock:
+            self._checked_at = time.time()
+            fingerprints = dict(self._fingerprints)
+            expired = 0 < self.rebuild_interval <= self._checked_at - self._built_at
+        if expired:
+            self.rebuild()
+            return
+        current = {namespace: self.fingerprint(namespace) for namespace in SOURCES}
+        stale = [
+            namespace for namespace in SOURCES
+            if fingerprints.get(namespace) is not None and fingerprints[namespace] != current[namespace]
+        ]
+        if stale:
+            self.rebuild()
+            return
+        with self._lock:
+            for namespace in SOURCES:
+                if self._fingerprints.get(namespace) is None:
+                    self._fingerprints[namespace] = current[namespace]
+
+    def rebuild(self):
+        # индекс собирается без блокировки чтения; правки, пришедшие за это
+        # время, записываются в журнал и применяются к новому индексу
+        with self._rebuild_lock:
+            with self._lock:
+                self._journal = []
+            try:
+                namespaces, fingerprints = {}, {}
+                for namespace, (model, fields) in SOURCES.items():
+                    fingerprints[namespace] = self.fingerprint(namespace)
+                    rows = model.objects.values('pk', *fields).iterator(chunk_size=5000)
+                    namespaces[namespace] = Namespace.build(
+                        (row.pop('pk'), {name: value or '' for name, value in row.items()}) for row in rows
+                    )
+            except BaseException:
+                with self._lock:
+                    self._journal = None
+                raise
+            with self._lock:
+                for change in self._journal:
+                    self._apply(namespaces, change)
+                    fingerprints[change[1]] = None
+                self._journal = None
+                self._namespaces, self._fingerprints = namespaces, fingerprints
+                self._built_at = self._checked_at = time.time()
+        self.save_snapshot()
+
+    def save_if_dirty(self):
+        # правки имён не меняют (count, max id), поэтому снимок с ними
+        # сохраняем при выходе, иначе следующий старт их не увидит
+        if self._dirty and self._namespaces is not None:
+            self.save_snapshot()
+
+    def save_snapshot(self):
+        with self._lock:
+            self._dirty = False
+            data = {
+                'version': SNAPSHOT_VERSION,
+                'built_at': self._built_at,
+                'fingerprints': self._fingerprints,
+                'namespaces': {
+                    namespace: [[entry_id, fields] for entry_id, (fields, _) in space.entries.items()]
+                    for namespace, space in self._namespaces.items()
+                },
+            }
+        path = self.snapshot_path
+        try:
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            logger.warning('Could not write autocomplete snapshot to %s', path, exc_info=True)
+
+    def load_snapshot(self):
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if data.get('version') != SNAPSHOT_VERSION or set(data.get('namespaces', {})) != set(SOURCES):
+            return False
+        if time.time() - data['built_at'] > getattr(settings, 'AUTOCOMPLETE_SNAPSHOT_MAX_AGE', 3600):
+            return False
+        if any(data['fingerprints'].get(namespace) != self.fingerprint(namespace) for namespace in SOURCES):
+            return False
+        namespaces = {
+            namespace: Namespace.build(entries) for namespace, entries in data['namespaces'].items()
+        }
+        with self._lock:
+            self._namespaces, self._fingerprints = namespaces, data['fingerprints']
+            self._built_at = data['built_at']
+            self._checked_at = time.time()
+        return True
+
+    def _apply(self, namespaces, change):
+        action, namespace, entry_id, fields = change
+        if self._journal is not None and namespaces is self._namespaces:
+            self._journal.append(change)
+        if action == 'add':
+            namespaces[namespace].add(entry_id, fields)
+        else:
+            namespaces[namespace].remove(entry_id)
+
+    def _ensure_fresh(self):
+        if self._namespaces is None:
+            # синхронно загружаемся только первый раз в процессе
+            with self._rebuild_lock:
+                loaded = self._namespaces is not None or self.load_snapshot()
+            if not loaded:
+                self.rebuild()
+        if self.refresh_interval > 0:
+            self._refresher.ensure_started()
+        else:
+            # без фонового потока (тесты) - сверка при каждом обращении
+            self.refresh()
+
+
+autocomplete = AutocompleteIndex()
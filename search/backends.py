@@ -0,0 +1,285 @@
+import html
+import math
+import re
+import unicodedata
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from .documents import KIND_NAMES, KINDS, document, model_for
+from .models import SearchToken
+
+FTS_TABLE = 'search_fts'
+MAX_TERMS = 8
+# границы совпадений: служебные символы, после экранирования HTML они станут <mark>
+MARK = ('\x02', '\x03')
+# вес совпадения в заголовке относительно текста
+TITLE_WEIGHT = 10.0
+
+WORD_RE = re.compile(r'\w+')
+QUERY_RE = re.compile(r'(\w+)(\*?)')
+
+
+def normalize(word):
+    # то же, что unicode61 remove_diacritics: регистр и диакритика не важны (ё = е)
+    decomposed = unicodedata.normalize('NFKD', word.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    return [normalize(word)[:64] for word in WORD_RE.findall(text or '')]
+
+
+def parse_query(query, prefix=False):
+    # "слово*" - поиск по префиксу; prefix=True делает префиксными все слова
+    terms = []
+    for word, star in QUERY_RE.findall(query or ''):
+        term = normalize(word)
+        if term:
+            terms.append((term, bool(star) or prefix))
+    return terms[:MAX_TERMS]
+
+
+def matches(word, terms):
+    word = normalize(word)
+    return any(word.startswith(term) if is_prefix else word == term for term, is_prefix in terms)
+
+
+def highlight(text, terms, window=None):
+    text = text or ''
+    spans = [m.span() for m in WORD_RE.finditer(text) if matches(m.group(), terms)]
+    start, end = 0, len(text)
+    if window and len(WORD_RE.findall(text)) > window:
+        words = list(WORD_RE.finditer(text))
+        first = next((i for i, m in enumerate(words) if spans and m.start() == spans[0][0]), 0)
+        lo = max(first - window // 2, 0)
+        hi = min(lo + window, len(words)) - 1
+        start, end = words[lo].start(), words[hi].end()
+    parts, position = [], start
+    for span_start, span_end in spans:
+        if span_start < start or span_end > end:
+            continue
+        parts += [text[position:span_start], MARK[0], text[span_start:span_end], MARK[1]]
+        position = span_end
+    parts.append(text[position:end])
+    result = ''.join(parts)
+    if start > 0:
+        result = '…' + result
+    if end < len(text):
+        result += '…'
+    return result
+
+
+def render(fragment):
+    return html.escape(fragment or '').replace(MARK[0], '<mark>').replace(MARK[1], '</mark>')
+
+
+def rowid(kind, object_id):
+    # у каждого вида документов своя «полоса» rowid, младшие 2 бита - вид
+    return object_id * 4 + kind
+
+
+def fts_row(doc):
+    # FTS5 (unicode61) не приравнивает ё к е, поэтому индексируем уже
+    # нормализованные токены, а исходный текст храним рядом для подсветки
+    title, body = doc.title or '', doc.body or ''
+    return (
+        rowid(doc.kind, doc.object_id), doc.chat_id,
+        ' '.join(tokenize(title)), ' '.join(tokenize(body)), title, body,
+    )
+
+
+def fts_expression(terms, columns=None):
+    expression = ' '.join('"%s"%s' % (term, '*' if is_prefix else '') for term, is_prefix in terms)
+    if columns:
+        expression = '{%s} : (%s)' % (' '.join(columns), expression)
+    return expression
+
+
+class FTS5Backend:
+    name = 'fts5'
+
+    def index(self, documents):
+        documents = [doc for doc in documents if doc is not None]
+        if not documents:
+            return
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(rowid(doc.kind, doc.object_id),) for doc in documents],
+            )
+            cursor.executemany(
+                f'INSERT INTO {FTS_TABLE} (rowid, chat_id, title, body, raw_title, raw_body) '
+                f'VALUES (%s, %s, %s, %s, %s, %s)',
+                [fts_row(doc) for doc in documents],
+            )
+
+    def remove(self, kind, object_ids):
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s',
+                [(rowid(kind, object_id),) for object_id in object_ids],
+            )
+
+    def clear(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def match_filter(self, terms, kind, columns=None):
+        return Q(pk__in=RawSQL(
+            f'SELECT rowid >> 2 FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s AND (rowid & 3) = %s',
+            (fts_expression(terms, columns), kind),
+        ))
+
+    def search(self, terms, kinds, chat_ids=(), columns=None, limit=20, offset=0):
+        where, params = [f'{FTS_TABLE} MATCH %s'], [fts_expression(terms, columns)]
+        where.append('(rowid & 3) IN (%s)' % ', '.join(['%s'] * len(kinds)))
+        params += kinds
+        if KINDS['message'] in kinds:
+            # сообщения - только из чатов, где состоит пользователь
+            scope = ', '.join(['%s'] * len(chat_ids)) or 'NULL'
+            where.append(f'((rowid & 3) != %s OR chat_id IN ({scope}))')
+            params += [KINDS['message'], *chat_ids]
+
+        sql = (
+            f"SELECT rowid, bm25({FTS_TABLE}, 0, {TITLE_WEIGHT}, 1.0, 0, 0) AS score, raw_title, raw_body "
+            f"FROM {FTS_TABLE} WHERE {' AND '.join(where)} ORDER BY score LIMIT %s OFFSET %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params + [limit, offset])
+            rows = cursor.fetchall()
+        return [
+            {
+                'type': KIND_NAMES[row_id & 3],
+                'id': row_id >> 2,
+                # bm25 в SQLite отрицательный: чем меньше, тем лучше
+                'score': round(-score, 6),
+                'title': render(highlight(title, terms)),
+                'body': render(highlight(body, terms, window=24)),
+            }
+            for row_id, score, title, body in rows
+        ]
+
+
+class TokenBackend:
+    name = 'tokens'
+
+    def index(self, documents):
+        documents = [doc for doc in documents if doc is not None]
+        if not documents:
+            return
+        by_kind = defaultdict(list)
+        for doc in documents:
+            by_kind[doc.kind].append(doc.object_id)
+        for kind, object_ids in by_kind.items():
+            self.remove(kind, object_ids)
+        rows = []
+        for doc in documents:
+            for field, text in ((0, doc.title), (1, doc.body)):
+                for token, tf in Counter(tokenize(text)).items():
+                    rows.append(SearchToken(
+                        token=token, kind=doc.kind, object_id=doc.object_id,
+                        chat_id=doc.chat_id, field=field, tf=tf,
+                    ))
+        SearchToken.objects.bulk_create(rows, batch_size=1000)
+
+    def remove(self, kind, object_ids):
+        SearchToken.objects.filter(kind=kind, object_id__in=list(object_ids)).delete()
+
+    def clear(self):
+        SearchToken.objects.all().delete()
+
+    def match_filter(self, terms, kind, columns=None):
+        tokens = SearchToken.objects.filter(kind=kind)
+        if columns:
+            tokens = tokens.filter(field__in=[0 if column == 'title' else 1 for column in columns])
+        condition = Q()
+        for term, is_prefix in terms:
+            lookup = {'token__startswith': term} if is_prefix else {'token': term}
+            condition &= Q(pk__in=tokens.filter(**lookup).values('object_id'))
+        return condition
+
+    def search(self, terms, kinds, chat_ids=(), columns=None, limit=20, offset=0):
+        tokens = SearchToken.objects.filter(kind__in=kinds)
+        if KINDS['message'] in kinds:
+            # сообщения - только из чатов, где состоит пользователь
+            tokens = tokens.filter(~Q(kind=KINDS['message']) | Q(chat_id__in=list(chat_ids)))
+        if columns:
+            tokens = tokens.filter(field__in=[0 if column == 'title' else 1 for column in columns])
+
+        scores = None
+        for term, is_prefix in terms:
+            lookup = {'token__startswith': term} if is_prefix else {'token': term}
+            rows = list(tokens.filter(**lookup).values_list('kind', 'object_id', 'field', 'tf'))
+            documents = {(kind, object_id) for kind, object_id, _, _ in rows}
+            # простая tf-idf: редкие слова весят больше
+            idf = 1.0 / math.log(2 + len(documents))
+            term_scores = defaultdict(float)
+            for kind, object_id, field, tf in rows:
+                term_scores[(kind, object_id)] += tf * idf * (TITLE_WEIGHT if field == 0 else 1.0)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))[offset:offset + limit]
+        texts = {}
+        for kind in {kind for (kind, _), _ in ranked}:
+            model = model_for(kind)
+            ids = [object_id for (k, object_id), _ in ranked if k == kind]
+            for instance in model.objects.filter(pk__in=ids):
+                texts[(kind, instance.pk)] = document(instance)
+        results = []
+        for (kind, object_id), score in ranked:
+            doc = texts.get((kind, object_id))
+            results.append({
+                'type': KIND_NAMES[kind],
+                'id': object_id,
+                'score': round(score, 6),
+                'title': render(highlight(doc.title, terms)) if doc else '',
+                'body': render(highlight(doc.body, terms, window=24)) if doc else '',
+            })
+        return results
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'SEARCH_BACKEND', 'auto')
+        if name == 'auto':
+            name = 'fts5' if FTS_TABLE in connection.introspection.table_names() else 'tokens'
+        _backend = FTS5Backend() if name == 'fts5' else TokenBackend()
+    return _backend
+
+
+def search(query, types=None, chat_ids=(), columns=None, prefix=False, limit=20, offset=0):
+    terms = parse_query(query, prefix=prefix)
+    kinds = [KINDS[name] for name in (types or KINDS) if name in KINDS]
+    if not terms or not kinds:
+        return []
+    return get_backend().search(terms, kinds, list(chat_ids), columns, limit, offset)
+
+
+def match_filter(type_name, query, columns=None, prefix=False):
+    # Условие для filter() модели вида type_name: все совпадения подзапросом, без
+    # ранжирования и лимита search(). Сообщения не ограничиваются чатами.
+    terms = parse_query(query, prefix=prefix)
+    if not terms:
+        return Q(pk__in=[])
+    return get_backend().match_filter(terms, KINDS[type_name], columns)
+
+
+def index_instances(instances):
+    get_backend().index([document(instance) for instance in instances])
+
+
+def remove_instance(kind, object_id):
+    get_backend().remove(kind, [object_id])
@@ -0,0 +1,39 @@
+from collections import namedtuple
+
+from posts.models import Comment, Post
+from usersmodel.models import Message
+
+Document = namedtuple('Document', 'kind object_id chat_id title body')
+
+KINDS = {'post': 1, 'comment': 2, 'message': 3}
+KIND_NAMES = {code: name for name, code in KINDS.items()}
+MODELS = {Post: 'post', Comment: 'comment', Message: 'message'}
+
+
+def kind_of(instance):
+    return KINDS[MODELS[type(instance)]]
+
+
+def document(instance):
+    kind = MODELS[type(instance)]
+    if kind == 'post':
+        return Document(KINDS[kind], instance.pk, None, instance.title or '', instance.text or '')
+    if kind == 'comment':
+        return Document(KINDS[kind], instance.pk, None, '', instance.content or '')
+    if instance.is_deleted:
+        return None
+    return Document(KINDS[kind], instance.pk, instance.chat_id, '', instance.content or '')
+
+
+def model_for(kind):
+    return next(model for model, name in MODELS.items() if KINDS[name] == kind)
+
+
+def iter_instances(kind, chunk_size=2000):
+    model = model_for(kind)
+    fields = {
+        Post: ('id', 'title', 'text'),
+        Comment: ('id', 'content'),
+        Message: ('id', 'chat_id', 'content', 'is_deleted'),
+    }[model]
+    return model.objects.only(*fields).iterator(chunk_size=chunk_size)
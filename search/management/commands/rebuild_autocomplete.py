@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from search.autocomplete import SOURCES, autocomplete
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает индекс автодополнения из БД и сохраняет его снимок'
+
+    def handle(self, *args, **options):
+        autocomplete.rebuild()
+        for namespace in SOURCES:
+            self.stdout.write(f'{namespace}: {autocomplete.size(namespace)} indexed')
+        self.stdout.write(f'snapshot: {autocomplete.snapshot_path}')
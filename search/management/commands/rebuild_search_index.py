@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from search.backends import get_backend
+from search.documents import KINDS, document, iter_instances
+
+
+class Command(BaseCommand):
+    help = 'Полностью перестраивает поисковый индекс постов, комментариев и сообщений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            backend.clear()
+            for name, kind in KINDS.items():
+                batch, total = [], 0
+                for instance in iter_instances(kind, batch_size):
+                    batch.append(document(instance))
+                    if len(batch) >= batch_size:
+                        backend.index(batch)
+                        total += len(batch)
+                        batch = []
+                backend.index(batch)
+                total += len(batch)
+                self.stdout.write(f'{name}: {total} indexed ({backend.name})')
@@ -0,0 +1,101 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:30
+
+import re
+import unicodedata
+from collections import Counter
+
+from django.db import migrations, models
+
+# Копия токенизатора search.backends на момент миграции: миграция не должна
+# меняться вместе с живым кодом
+WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    tokens = []
+    for word in WORD_RE.findall(text or ''):
+        decomposed = unicodedata.normalize('NFKD', word.casefold())
+        tokens.append(''.join(c for c in decomposed if not unicodedata.combining(c))[:64])
+    return tokens
+
+
+def fts_row(kind, object_id, chat_id, title, body):
+    title, body = title or '', body or ''
+    return (object_id * 4 + kind, chat_id, ' '.join(tokenize(title)), ' '.join(tokenize(body)), title, body)
+
+
+def fts5_available(connection):
+    if connection.vendor != 'sqlite':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA compile_options')
+        return any(row[0] == 'ENABLE_FTS5' for row in cursor.fetchall())
+
+
+def build_index(apps, schema_editor):
+    empty = models.Value('')
+    no_chat = models.Value(None, output_field=models.BigIntegerField())
+    sources = [
+        (1, apps.get_model('posts', 'Post').objects.values_list('id', no_chat, 'title', 'text')),
+        (2, apps.get_model('posts', 'Comment').objects.values_list('id', no_chat, empty, 'content')),
+        (3, apps.get_model('usersmodel', 'Message').objects.filter(is_deleted=False).values_list('id', 'chat_id', empty, 'content')),
+    ]
+
+    if fts5_available(schema_editor.connection):
+        # rowid = id * 4 + вид документа (1 - пост, 2 - комментарий, 3 - сообщение);
+        # title/body - нормализованные токены, raw_* - исходный текст для подсветки
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE search_fts USING fts5("
+            "chat_id UNINDEXED, title, body, raw_title UNINDEXED, raw_body UNINDEXED, "
+            "tokenize='unicode61', prefix='2 3')"
+        )
+        with schema_editor.connection.cursor() as cursor:
+            for kind, rows in sources:
+                cursor.executemany(
+                    'INSERT INTO search_fts (rowid, chat_id, title, body, raw_title, raw_body) VALUES (%s, %s, %s, %s, %s, %s)',
+                    [fts_row(kind, *row) for row in rows.iterator()],
+                )
+        return
+
+    SearchToken = apps.get_model('search', 'SearchToken')
+    for kind, rows in sources:
+        tokens = []
+        for object_id, chat_id, title, body in rows.iterator():
+            for field, text in ((0, title), (1, body)):
+                for token, tf in Counter(tokenize(text)).items():
+                    tokens.append(SearchToken(token=token, kind=kind, object_id=object_id, chat_id=chat_id, field=field, tf=tf))
+        SearchToken.objects.bulk_create(tokens, batch_size=1000)
+
+
+def drop_index(apps, schema_editor):
+    if fts5_available(schema_editor.connection):
+        schema_editor.execute('DROP TABLE IF EXISTS search_fts')
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('posts', '0006_comment_path'),
+        ('usersmodel', '0006_chatreadmarker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('kind', models.PositiveSmallIntegerField(choices=[(1, 'Post'), (2, 'Comment'), (3, 'Message')])),
+                ('object_id', models.BigIntegerField()),
+                ('chat_id', models.BigIntegerField(blank=True, null=True)),
+                ('field', models.PositiveSmallIntegerField(choices=[(0, 'Title'), (1, 'Body')])),
+                ('tf', models.PositiveIntegerField(default=1)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'kind'], name='search_token_idx'), models.Index(fields=['kind', 'object_id'], name='search_token_doc_idx')],
+            },
+        ),
+        migrations.RunPython(build_index, drop_index),
+    ]
@@ -0,0 +1,31 @@
+from django.db import models
+
+
+class SearchToken(models.Model):
+    # Инвертированный индекс для баз без FTS5: одна строка на (документ, поле, токен).
+    # На SQLite поиск идёт через виртуальную таблицу search_fts, эта таблица пуста.
+    KIND_CHOICES = [
+        (1, 'Post'),
+        (2, 'Comment'),
+        (3, 'Message'),
+    ]
+    FIELD_CHOICES = [
+        (0, 'Title'),
+        (1, 'Body'),
+    ]
+
+    token = models.CharField(max_length=64)
+    kind = models.PositiveSmallIntegerField(choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    chat_id = models.BigIntegerField(null=True, blank=True)
+    field = models.PositiveSmallIntegerField(choices=FIELD_CHOICES)
+    tf = models.PositiveIntegerField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['token', 'kind'], name='search_token_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_token_doc_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.token} -> {self.get_kind_display()} {self.object_id}'
@@ -0,0 +1,61 @@
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from posts.models import Comment, Hashtag as PostHashtag, Post
+from usersmodel.chat_writer import messages_created
+from usersmodel.models import CustomUser, Hashtag as UserHashtag, Message
+
+from . import backends
+from .autocomplete import autocomplete
+from .backends import get_backend, index_instances
+from .documents import document, kind_of
+
+# Индекс обновляется в той же транзакции, что и сам объект
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_save, sender=Message)
+def index_on_save(sender, instance, **kwargs):
+    doc = document(instance)
+    if doc is None:
+        get_backend().remove(kind_of(instance), [instance.pk])
+    else:
+        get_backend().index([doc])
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=Message)
+def remove_on_delete(sender, instance, **kwargs):
+    get_backend().remove(kind_of(instance), [instance.pk])
+
+
+@receiver(messages_created)
+def index_created_messages(sender, messages, **kwargs):
+    index_instances(messages)
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    if setting == 'SEARCH_BACKEND':
+        backends._backend = None
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_save, sender=PostHashtag)
+@receiver(post_save, sender=UserHashtag)
+def autocomplete_on_save(sender, instance, **kwargs):
+    # индекс в памяти не откатывается вместе с транзакцией
+    transaction.on_commit(lambda: autocomplete.update(instance))
+
+
+@receiver(post_delete, sender=CustomUser)
+@receiver(post_delete, sender=PostHashtag)
+@receiver(post_delete, sender=UserHashtag)
+def autocomplete_on_delete(sender, instance, **kwargs):
+    # после delete() у объекта уже pk = None
+    pk = instance.pk
+    transaction.on_commit(lambda: autocomplete.remove(sender, pk))
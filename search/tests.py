@@ -0,0 +1,92 @@
+import tempfile
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+
+from posts.models import Hashtag, Post
+from usersmodel.models import Chat, CustomUser, Message
+from .autocomplete import AutocompleteIndex
+from .backends import FTS_TABLE, get_backend
+
+
+@override_settings(AUTOCOMPLETE_REFRESH_INTERVAL=0, AUTOCOMPLETE_REBUILD_INTERVAL=900)
+class AutocompleteRefreshTests(TestCase):
+    def setUp(self):
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        settings = override_settings(AUTOCOMPLETE_SNAPSHOT=f'{snapshot_dir.name}/autocomplete.json')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # отдельный индекс не получает сигналов - как индекс другого воркера
+        self.index = AutocompleteIndex()
+
+    def test_rename_in_other_worker_is_picked_up_by_rebuild(self):
+        tag = Hashtag.objects.create(name='django')
+        self.assertEqual(self.index.ids('hashtags', 'djan'), [tag.pk])
+        Hashtag.objects.filter(pk=tag.pk).update(name='flask')
+        # (count, max id) не изменились - до пересборки индекс прежний
+        self.assertEqual(self.index.ids('hashtags', 'flas'), [])
+        self.index._built_at -= 901
+        self.assertEqual(self.index.ids('hashtags', 'flas'), [tag.pk])
+        self.assertEqual(self.index.ids('hashtags', 'djan'), [])
+
+    def test_new_rows_are_picked_up_by_fingerprint(self):
+        self.assertEqual(self.index.ids('hashtags', 'orm'), [])
+        Hashtag.objects.bulk_create([Hashtag(name='orm')])
+        self.assertEqual(len(self.index.ids('hashtags', 'orm')), 1)
+
+
+class SearchTestsMixin:
+    backend = None
+
+    def setUp(self):
+        settings = override_settings(SEARCH_BACKEND=self.backend)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.assertEqual(get_backend().name, self.backend)
+
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+        self.other = CustomUser.objects.create_user(email='other@example.com', password='x', name='Other')
+        self.mine, self.theirs = Chat.objects.create(), Chat.objects.create()
+        self.mine.users.add(self.user, self.other)
+        self.theirs.users.add(self.other)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def search(self, q, **params):
+        response = self.client.get('/api/search/', dict(params, q=q))
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_messages_only_from_callers_chats(self):
+        visible = Message.objects.create(chat=self.mine, sender=self.other, content='secret plans')
+        Message.objects.create(chat=self.theirs, sender=self.other, content='secret plans')
+        results = self.search('secret', type='message')
+        self.assertEqual([(r['type'], r['id']) for r in results], [('message', visible.pk)])
+
+        self.client.force_authenticate(None)
+        self.assertEqual(self.search('secret'), [])
+
+    def test_prefix_match_and_highlight(self):
+        post = Post.objects.create(user=self.user, title='Ёлка <b>', text='Зимний праздник и праздничный стол')
+        self.assertEqual(self.search('праздн', type='post'), [])
+        [result] = self.search('праздн*', type='post')
+        self.assertEqual(result['id'], post.pk)
+        self.assertEqual(result['body'], 'Зимний <mark>праздник</mark> и <mark>праздничный</mark> стол')
+        # регистр и ё не важны, HTML экранируется
+        [result] = self.search('ЕЛКА', type='post')
+        self.assertEqual(result['title'], '<mark>Ёлка</mark> &lt;b&gt;')
+
+
+class FTS5SearchTests(SearchTestsMixin, TestCase):
+    backend = 'fts5'
+
+    def setUp(self):
+        if FTS_TABLE not in connection.introspection.table_names():
+            self.skipTest('SQLite without FTS5')
+        super().setUp()
+
+
+class TokenSearchTests(SearchTestsMixin, TestCase):
+    backend = 'tokens'
@@ -0,0 +1,47 @@
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from posts.views import get_int_param
+
+from .autocomplete import SOURCES, autocomplete
+from .backends import search
+from .documents import KINDS
+
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+
+class SearchView(APIView):
+    # ?q=<запрос>&type=post,comment,message&limit=&offset=
+    # "слово*" - поиск по префиксу; сообщения ищутся только в чатах пользователя
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        types = [t for t in request.query_params.get('type', ','.join(KINDS)).split(',') if t in KINDS]
+        limit = get_int_param(request, 'limit', SEARCH_LIMIT, MAX_SEARCH_LIMIT) or SEARCH_LIMIT
+        offset = get_int_param(request, 'offset', 0)
+
+        chat_ids = []
+        if request.user.is_authenticated:
+            chat_ids = list(request.user.chats.values_list('id', flat=True))
+        elif 'message' in types:
+            types.remove('message')
+
+        results = search(query, types, chat_ids=chat_ids, limit=limit, offset=offset)
+        return Response({'query': query, 'results': results})
+
+
+class AutocompleteView(APIView):
+    # ?q=<начало слова>&type=users,hashtags,user_hashtags&limit=
+    # отвечает из индекса в памяти, без запросов к БД
+
+    def get(self, request):
+        query = request.query_params.get('q', '')
+        types = [t for t in request.query_params.get('type', ','.join(SOURCES)).split(',') if t in SOURCES]
+        limit = get_int_param(request, 'limit', AUTOCOMPLETE_LIMIT, MAX_AUTOCOMPLETE_LIMIT) or AUTOCOMPLETE_LIMIT
+        return Response({
+            namespace: [dict(fields, id=entry_id) for entry_id, fields in autocomplete.query(namespace, query, limit)]
+            for namespace in types
+        })
@@ -5,10 +5,11 @@ from channels.auth import AuthMiddlewareStack
 from channels.layers import get_channel_layer
 import usersmodel.routing
 from usersmodel.middleware import JWTAuthMiddleware
+from social_media.media_serving import MediaApp
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'social_media.settings')
 
 application = ProtocolTypeRouter({
-    'http': get_asgi_application(),
+    'http': MediaApp(get_asgi_application()),
     'websocket': JWTAuthMiddleware(
         URLRouter(
             usersmodel.routing.websocket_urlpatterns
@@ -0,0 +1,472 @@
+import asyncio
+import fcntl
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import socket
+import stat
+import string
+import struct
+import subprocess
+import sys
+import threading
+import time
+import weakref
+from collections import deque
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('!I')
+SOCKET_NAME = 'social_media-channels.sock'
+PEERCRED = struct.Struct('3i')
+
+
+def default_path():
+    # Не общий /tmp: там любой локальный пользователь мог бы заранее занять
+    # сокет и читать или подменять сообщения групп
+    from django.conf import settings
+    directory = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(settings.BASE_DIR, 'run')
+    return os.path.join(directory, SOCKET_NAME)
+
+
+def ensure_private_dir(path):
+    # каталог сокета и lock-файла создаётся с 0700; чужой или открытый на
+    # запись другим каталог не принимаем
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f'{directory} must belong to the current user and not be writable by others')
+
+
+def peer_uid(writer):
+    # uid процесса на другом конце Unix-сокета; None, если ОС не сообщает
+    sock = writer.get_extra_info('socket')
+    if sock is None or not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    return PEERCRED.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, PEERCRED.size))[1]
+
+
+async def read_frame(reader):
+    (size,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(size))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern):
+    return re.compile(pattern)
+
+
+def write_frame(writer, data):
+    payload = json.dumps(data, separators=(',', ':')).encode()
+    writer.write(HEADER.pack(len(payload)) + payload)
+
+
+class Broker:
+    # Отдельный процесс на хост (см. run_broker), хранит очереди каналов и
+    # состав групп. Сроки и ёмкость приходят в каждом запросе от клиента.
+
+    def __init__(self):
+        self.channels = {}
+        self.waiters = {}
+        self.groups = {}
+
+    def send(self, channel, message, expiry, capacity):
+        waiters = self.waiters.get(channel)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(message)
+                return
+        queue = self._queue(channel)
+        if len(queue) >= capacity:
+            raise ChannelFull(channel)
+        queue.append((time.monotonic() + expiry, message))
+
+    async def receive(self, channel):
+        queue = self._queue(channel)
+        if queue:
+            return queue.popleft()[1]
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(channel, deque()).append(waiter)
+        try:
+            return await waiter
+        finally:
+            waiters = self.waiters.get(channel)
+            if waiters is not None and not waiters:
+                del self.waiters[channel]
+
+    def group_add(self, group, channel, expiry):
+        self.groups.setdefault(group, {})[channel] = time.monotonic() + expiry
+
+    def group_discard(self, group, channel):
+        members = self.groups.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del self.groups[group]
+
+    def group_send(self, group, message, expiry, capacity, channel_capacity=()):
+        now = time.monotonic()
+        members = self.groups.get(group, {})
+        for channel, expires_at in list(members.items()):
+            if expires_at < now:
+                del members[channel]
+                continue
+            try:
+                self.send(channel, message, expiry, self.capacity_for(channel, capacity, channel_capacity))
+            except ChannelFull:
+                # как и у остальных бэкендов: переполненный канал просто пропускаем
+                pass
+        if not members:
+            self.groups.pop(group, None)
+
+    def capacity_for(self, channel, capacity, channel_capacity):
+        # channel_capacity: [[regex, ёмкость], ...] из compile_capacities клиента
+        for pattern, value in channel_capacity:
+            if compile_pattern(pattern).match(channel):
+                return value
+        return capacity
+
+    def flush(self):
+        self.channels.clear()
+        self.groups.clear()
+
+    def _queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = deque()
+        now = time.monotonic()
+        while queue and queue[0][0] < now:
+            queue.popleft()
+        return queue
+
+    def _expire(self):
+        now = time.monotonic()
+        for channel, queue in list(self.channels.items()):
+            while queue and queue[0][0] < now:
+                queue.popleft()
+            if not queue:
+                del self.channels[channel]
+        for group, members in list(self.groups.items()):
+            for channel, expires_at in list(members.items()):
+                if expires_at < now:
+                    del members[channel]
+            if not members:
+                del self.groups[group]
+
+    async def handle(self, reader, writer):
+        tasks = set()
+        try:
+            while True:
+                request = await read_frame(reader)
+                task = asyncio.ensure_future(self.dispatch(request, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            # ожидающие receive отключившегося клиента не должны забирать сообщения
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def dispatch(self, request, writer):
+        op = request['op']
+        reply = {'id': request['id']}
+        try:
+            if op == 'send':
+                self.send(request['channel'], request['message'], request['expiry'], request['capacity'])
+            elif op == 'receive':
+                reply['result'] = await self.receive(request['channel'])
+            elif op == 'group_add':
+                self.group_add(request['group'], request['channel'], request['expiry'])
+            elif op == 'group_discard':
+                self.group_discard(request['group'], request['channel'])
+            elif op == 'group_send':
+                self.group_send(
+                    request['group'], request['message'], request['expiry'], request['capacity'],
+                    request.get('channel_capacity', ()),
+                )
+            elif op == 'flush':
+                self.flush()
+            else:
+                raise ValueError(f'Unknown operation {op!r}')
+        except ChannelFull:
+            reply['error'] = 'full'
+        except Exception as exc:
+            logger.exception('Channel layer broker failed on %s', op)
+            reply['error'] = str(exc)
+        if not writer.is_closing():
+            write_frame(writer, reply)
+
+    async def run(self, path, idle_timeout):
+        if os.path.exists(path):
+            os.unlink(path)
+        self.clients = 0
+        server = await asyncio.start_unix_server(self._track(self.handle), path=path)
+        os.chmod(path, 0o600)
+        idle_since = time.monotonic()
+        async with server:
+            while True:
+                await asyncio.sleep(min(5, idle_timeout))
+                self._expire()
+                if self.clients:
+                    idle_since = time.monotonic()
+                elif time.monotonic() - idle_since >= idle_timeout:
+                    break
+        if os.path.exists(path):
+            os.unlink(path)
+
+    def _track(self, handler):
+        async def wrapper(reader, writer):
+            if peer_uid(writer) not in (None, os.getuid()):
+                writer.close()
+                return
+            self.clients += 1
+            try:
+                await handler(reader, writer)
+            finally:
+                self.clients -= 1
+        return wrapper
+
+
+def run_broker(path, idle_timeout=300):
+    # Выборы брокера: работает тот процесс, которому достался flock на
+    # <path>.lock. Остальные претенденты сразу выходят.
+    ensure_private_dir(path)
+    fd = os.open(path + '.lock', os.O_CREAT | os.O_RDWR, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return False
+    asyncio.run(Broker().run(path, idle_timeout))
+    return True
+
+
+def spawn_broker(path, idle_timeout):
+    # Брокер - отдельный процесс, чтобы не зависеть от жизни ASGI-воркера
+    # или management-команды, которая первой обратилась к слою.
+    subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), path, str(idle_timeout)],
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        start_new_session=True, close_fds=True,
+    )
+
+
+class _Connection:
+    def __init__(self, layer):
+        self.layer = layer
+        self.reader = None
+        self.writer = None
+        self.pending = {}
+        self.ids = itertools.count()
+        self.lock = asyncio.Lock()
+        # соединение уже было и оборвалось: брокер мог перезапуститься
+        self.established = False
+
+    @property
+    def connected(self):
+        return self.writer is not None and not self.writer.is_closing()
+
+    async def call(self, op, **params):
+        deadline = time.monotonic() + self.layer.connect_timeout
+        while True:
+            try:
+                await self.connect()
+                return await self._request(op, params)
+            except ConnectionError:
+                # брокер перезапускается: подключаемся к новому и повторяем
+                if time.monotonic() > deadline:
+                    raise
+                await asyncio.sleep(0.05)
+
+    async def connect(self):
+        if self.connected:
+            return
+        async with self.lock:
+            if self.connected:
+                return
+            deadline = time.monotonic() + self.layer.connect_timeout
+            spawned = False
+            ensure_private_dir(self.layer.path)
+            while True:
+                try:
+                    reader, writer = await asyncio.open_unix_connection(self.layer.path)
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if time.monotonic() > deadline:
+                        raise
+                    if not spawned:
+                        spawn_broker(self.layer.path, self.layer.broker_idle_timeout)
+                        spawned = True
+                    await asyncio.sleep(0.05)
+            if peer_uid(writer) not in (None, os.getuid()):
+                writer.close()
+                raise PermissionError(f'Channel layer broker at {self.layer.path} belongs to another user')
+            self.reader, self.writer = reader, writer
+            asyncio.ensure_future(self._read_loop(reader))
+            if self.established:
+                # переподключение: новый брокер ничего не знает о наших группах.
+                # Первое соединение нового цикла событий ничего не повторяет -
+                # брокер тот же, что у остальных соединений процесса.
+                for group, channel, remaining in self.layer.live_memberships():
+                    await self._request('group_add', {'group': group, 'channel': channel, 'expiry': remaining})
+            self.established = True
+
+    async def _request(self, op, params):
+        request_id = next(self.ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            write_frame(self.writer, dict(params, op=op, id=request_id))
+            reply = await future
+        finally:
+            self.pending.pop(request_id, None)
+        error = reply.get('error')
+        if error == 'full':
+            raise ChannelFull(params.get('channel'))
+        if error:
+            raise RuntimeError(error)
+        return reply.get('result')
+
+    async def _read_loop(self, reader):
+        try:
+            while True:
+                reply = await read_frame(reader)
+                future = self.pending.get(reply['id'])
+                if future is not None and not future.done():
+                    future.set_result(reply)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if self.reader is reader:
+                self.writer.close()
+                self.reader = self.writer = None
+            for future in list(self.pending.values()):
+                if not future.done():
+                    future.set_exception(ConnectionResetError('Channel layer broker went away'))
+
+    async def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+    # Канальный слой для нескольких ASGI-процессов одного хоста без Redis:
+    # процессы общаются с брокером через Unix-сокет. Сообщения должны
+    # сериализоваться в JSON.
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path=None, expiry=60, group_expiry=86400, capacity=100,
+                 channel_capacity=None, connect_timeout=5, broker_idle_timeout=300, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.path = str(path or default_path())
+        self.group_expiry = group_expiry
+        self.connect_timeout = connect_timeout
+        self.broker_idle_timeout = broker_idle_timeout
+        # {группа: {канал: monotonic-время истечения}} - для повтора group_add после перезапуска брокера
+        self.memberships = {}
+        self._pruned_at = time.monotonic()
+        self.client_prefix = ''.join(random.choices(string.ascii_letters, k=8))
+        self._capacity_patterns = [[pattern.pattern, value] for pattern, value in self.channel_capacity]
+        self._connections = weakref.WeakKeyDictionary()
+        self._sync_loop = None
+        self._sync_lock = threading.Lock()
+
+    def _connection(self):
+        # asyncio-соединение привязано к циклу событий, поэтому у каждого цикла своё
+        loop = asyncio.get_running_loop()
+        connection = self._connections.get(loop)
+        if connection is None:
+            connection = self._connections[loop] = _Connection(self)
+        return connection
+
+    def run_sync(self, func, *args, **kwargs):
+        # Для синхронного кода вместо async_to_sync: тот на каждый вызов создаёт
+        # новый цикл событий, а значит и новое соединение с брокером. Здесь все
+        # синхронные вызовы идут через один фоновый цикл и одно соединение.
+        with self._sync_lock:
+            if self._sync_loop is None:
+                self._sync_loop = asyncio.new_event_loop()
+                threading.Thread(target=self._sync_loop.run_forever, name='channel-layer-sync', daemon=True).start()
+        return asyncio.run_coroutine_threadsafe(func(*args, **kwargs), self._sync_loop).result()
+
+    def live_memberships(self):
+        # [(группа, канал, сколько секунд осталось)], истёкшие членства выбрасываются
+        now = time.monotonic()
+        live = []
+        for group, channels in list(self.memberships.items()):
+            for channel, expires_at in list(channels.items()):
+                if expires_at <= now:
+                    del channels[channel]
+                else:
+                    live.append((group, channel, expires_at - now))
+            if not channels:
+                del self.memberships[group]
+        self._pruned_at = now
+        return live
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        await self._connection().call(
+            'send', channel=channel, message=message,
+            expiry=self.expiry, capacity=self.get_capacity(channel),
+        )
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        return await self._connection().call('receive', channel=channel)
+
+    async def new_channel(self, prefix='specific'):
+        suffix = ''.join(random.choices(string.ascii_letters, k=12))
+        return f'{prefix}.{self.client_prefix}!{suffix}'
+
+    async def flush(self):
+        self.memberships.clear()
+        await self._connection().call('flush')
+
+    async def close(self):
+        for connection in list(self._connections.values()):
+            await connection.close()
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        if time.monotonic() - self._pruned_at > 60:
+            self.live_memberships()
+        self.memberships.setdefault(group, {})[channel] = time.monotonic() + self.group_expiry
+        await self._connection().call('group_add', group=group, channel=channel, expiry=self.group_expiry)
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        channels = self.memberships.get(group)
+        if channels is not None:
+            channels.pop(channel, None)
+            if not channels:
+                del self.memberships[group]
+        await self._connection().call('group_discard', group=group, channel=channel)
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await self._connection().call(
+            'group_send', group=group, message=message,
+            expiry=self.expiry, capacity=self.capacity, channel_capacity=self._capacity_patterns,
+        )
+
+
+if __name__ == '__main__':
+    run_broker(sys.argv[1], float(sys.argv[2]) if len(sys.argv) > 2 else 300)
@@ -0,0 +1,59 @@
+import contextvars
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connections
+
+# в этом контексте (запросе, потоке) уже писали в default
+_pinned = contextvars.ContextVar('db_pinned', default=False)
+
+
+class ReadWriteRouter:
+    # Профиль SQLITE_PROFILE=production: чтения идут в 'replica' - отдельные
+    # соединения с query_only к тому же файлу, которые в режиме WAL не ждут
+    # писателя; запись - только в 'default'. После записи, а также внутри
+    # транзакции на default, чтения этого контекста остаются на default: так
+    # запрос видит свои изменения, в том числе ещё не закоммиченные.
+
+    def db_for_read(self, model, **hints):
+        if _pinned.get() or connections['default'].in_atomic_block:
+            return 'default'
+        return 'replica'
+
+    def db_for_write(self, model, **hints):
+        _pinned.set(True)
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica - тот же файл, объекты из обоих соединений совместимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == 'default'
+
+
+class ReadYourWritesMiddleware:
+    # Каждый запрос начинает читать с replica; привязка к default после
+    # записи не переживает запрос.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = _pinned.set(False)
+        try:
+            return self.get_response(request)
+        finally:
+            _pinned.reset(token)
+
+    async def __acall__(self, request):
+        token = _pinned.set(False)
+        try:
+            return await self.get_response(request)
+        finally:
+            _pinned.reset(token)
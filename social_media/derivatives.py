@@ -0,0 +1,117 @@
+import logging
+import multiprocessing
+import os
+import posixpath
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.dispatch import Signal
+
+from .imaging import render_variants
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = {'thumb': 160, 'feed': 720, 'full': 2048}
+DERIVATIVES_DIR = 'derivatives'
+
+# варианты готовы и записаны в image_variants (update() не шлёт post_save)
+variants_ready = Signal()
+
+
+def sizes():
+    return getattr(settings, 'IMAGE_DERIVATIVE_SIZES', DEFAULT_SIZES)
+
+
+def target_name(name):
+    # post_images/photo.jpg -> post_images/derivatives/photo.jpg/
+    directory, filename = posixpath.split(name)
+    return posixpath.join(directory, DERIVATIVES_DIR, filename)
+
+
+def is_derivative(name):
+    # в отличие от исходных файлов, перегенерируются под тем же именем
+    return DERIVATIVES_DIR in name.split('/')[:-1]
+
+
+def variant_urls(variants):
+    # для сериализаторов: None, пока варианты не готовы
+    if not variants or 'sizes' not in variants:
+        return None
+    base = target_name(variants['source'])
+    return {
+        name: {
+            key: default_storage.url(posixpath.join(base, value)) if key not in ('width', 'height') else value
+            for key, value in variant.items()
+        }
+        for name, variant in variants['sizes'].items()
+    }
+
+
+def needs_variants(instance, field='image'):
+    name = getattr(instance, field).name
+    return bool(name) and (instance.image_variants or {}).get('source') != name
+
+
+class DerivativePipeline:
+    # Пережатие картинок в пуле процессов вне запроса. Результат пишется
+    # условным update(): если картинку успели заменить, он не применяется.
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                workers = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', None) or min(2, os.cpu_count() or 1)
+                # spawn: форк процесса с потоками и соединениями БД небезопасен
+                self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def schedule(self, instance, field='image'):
+        if not needs_variants(instance, field):
+            return
+        name = getattr(instance, field).name
+        args = (default_storage.path(name), default_storage.path(target_name(name)), sizes())
+        model, pk = type(instance), instance.pk
+        if not getattr(settings, 'IMAGE_DERIVATIVE_ASYNC', True):
+            try:
+                result = render_variants(*args)
+            except Exception:
+                logger.exception('Could not build derivatives for %s', name)
+                result = None
+            self.save(model, pk, field, name, result)
+            return
+        future = self.executor.submit(render_variants, *args)
+        future.add_done_callback(lambda done: self._finished(done, model, pk, field, name))
+
+    def _finished(self, future, model, pk, field, name):
+        try:
+            result = future.result()
+        except Exception:
+            logger.exception('Could not build derivatives for %s', name)
+            result = None
+        try:
+            self.save(model, pk, field, name, result)
+        finally:
+            close_old_connections()
+
+    def save(self, model, pk, field, name, result):
+        # failed - чтобы не пытаться заново на каждом сохранении
+        variants = {'source': name, 'sizes': result} if result is not None else {'source': name, 'failed': True}
+        updated = model.objects.filter(pk=pk, **{field: name}).update(image_variants=variants)
+        if updated:
+            variants_ready.send(sender=model, pk=pk, variants=variants)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+derivative_pipeline = DerivativePipeline()
@@ -0,0 +1,44 @@
+import os
+
+from PIL import Image, ImageOps
+
+# Выполняется в процессах пула (см. derivatives.py), поэтому без Django:
+# только пути к файлам на входе и простые данные на выходе.
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def flatten(image):
+    # у JPEG нет прозрачности: кладём картинку на белый фон
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def render_variants(source, target_dir, sizes):
+    # sizes: {имя: наибольшая сторона}. Возвращает {имя: {'width', 'height', формат: имя файла}}.
+    # EXIF не переносится: save() без exif=, ориентация применяется заранее.
+    os.makedirs(target_dir, exist_ok=True)
+    with Image.open(source) as original:
+        original.seek(0)
+        image = flatten(ImageOps.exif_transpose(original))
+    variants = {}
+    for name, edge in sorted(sizes.items(), key=lambda item: item[1]):
+        resized = image.copy()
+        # не увеличиваем: маленький оригинал даёт варианты своего размера
+        resized.thumbnail((edge, edge), Image.LANCZOS)
+        variant = {'width': resized.width, 'height': resized.height}
+        for extension, (pillow_format, options) in FORMATS.items():
+            filename = f'{name}.{extension}'
+            path = os.path.join(target_dir, filename)
+            resized.save(path + '.tmp', pillow_format, **options)
+            os.replace(path + '.tmp', path)
+            variant[extension] = filename
+        variants[name] = variant
+    return variants
@@ -0,0 +1,223 @@
+import asyncio
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+from .derivatives import is_derivative
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 256 * 1024
+
+
+def serving_enabled():
+    # в продакшене media отдаёт фронтовой сервер, см. SERVE_MEDIA в settings.py
+    return getattr(settings, 'SERVE_MEDIA', settings.DEBUG)
+
+
+class MediaFile:
+    # Разбор запроса к файлу из MEDIA_ROOT: условные заголовки и Range.
+    # Общий для Django-представления и ASGI-приложения.
+
+    def __init__(self, path, headers):
+        try:
+            self.path = safe_join(settings.MEDIA_ROOT, path)
+        except (SuspiciousFileOperation, ValueError):
+            raise Http404(path)
+        try:
+            info = os.stat(self.path)
+        except (FileNotFoundError, NotADirectoryError):
+            raise Http404(path)
+        if not stat.S_ISREG(info.st_mode):
+            raise Http404(path)
+        self.name = path
+        self.size = info.st_size
+        self.mtime = info.st_mtime
+        # перегенерированная уменьшенная копия получает новый mtime
+        self.etag = '"%x-%x"' % (info.st_mtime_ns, info.st_size)
+        self.content_type = mimetypes.guess_type(self.path)[0] or 'application/octet-stream'
+        self.status, self.start, self.length = self._evaluate(headers)
+
+    def _evaluate(self, headers):
+        if_none_match = headers.get('if-none-match')
+        if if_none_match:
+            tags = parse_etags(if_none_match)
+            if '*' in tags or self.etag in tags:
+                return 304, 0, 0
+        else:
+            since = parse_http_date_safe(headers.get('if-modified-since') or '')
+            if since is not None and int(self.mtime) <= since:
+                return 304, 0, 0
+
+        byte_range = headers.get('range')
+        if not byte_range or not self._if_range(headers.get('if-range')):
+            return 200, 0, self.size
+        match = RANGE_RE.match(byte_range.strip())
+        if match is None:
+            # несколько диапазонов и прочие формы не поддерживаем: отдаём целиком
+            return 200, 0, self.size
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return 200, 0, self.size
+            # bytes=-N: последние N байт
+            length = min(int(last), self.size)
+            return (206, self.size - length, length) if length else (416, 0, 0)
+        start = int(first)
+        if start >= self.size:
+            return 416, 0, 0
+        end = min(int(last), self.size - 1) if last else self.size - 1
+        if end < start:
+            return 200, 0, self.size
+        return 206, start, end - start + 1
+
+    def _if_range(self, value):
+        if not value:
+            return True
+        value = value.strip()
+        if value.startswith('"') or value.startswith('W/'):
+            # If-Range сравнивается только строго
+            return value == self.etag
+        since = parse_http_date_safe(value)
+        return since is not None and int(self.mtime) == since
+
+    def headers(self):
+        headers = {
+            'ETag': self.etag,
+            'Last-Modified': http_date(self.mtime),
+            'Accept-Ranges': 'bytes',
+            'Cache-Control': self.cache_control(),
+        }
+        if self.status == 416:
+            headers['Content-Range'] = f'bytes */{self.size}'
+        elif self.status != 304:
+            headers['Content-Type'] = self.content_type
+            headers['Content-Length'] = str(self.length)
+        if self.status == 206:
+            headers['Content-Range'] = f'bytes {self.start}-{self.start + self.length - 1}/{self.size}'
+        return headers
+
+    def cache_control(self):
+        if is_derivative(self.name):
+            # уменьшенные копии пересобираются по тому же адресу
+            return 'public, max-age=%d' % getattr(settings, 'MEDIA_DERIVATIVE_CACHE_MAX_AGE', 3600)
+        return 'public, max-age=%d, immutable' % getattr(settings, 'MEDIA_CACHE_MAX_AGE', 31536000)
+
+    def open(self):
+        return FileRange(open(self.path, 'rb'), self.start, self.length)
+
+
+class FileRange:
+    # Файл, из которого читается только [start, start + length). Наружу не
+    # отдаёт ни fileno(), ни позицию: иначе FileResponse посчитал бы
+    # Content-Length по размеру файла, а sendfile сервера отправил бы его до конца.
+
+    def __init__(self, file, start, length):
+        self.file = file
+        self.file.seek(start)
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def __iter__(self):
+        try:
+            while self.remaining > 0:
+                chunk = self.read(BLOCK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        self.file.close()
+
+
+def serve_media(request, path):
+    media = MediaFile(path, {key.lower(): value for key, value in request.headers.items()})
+    headers = media.headers()
+    if media.status == 304:
+        return HttpResponseNotModified(headers=headers)
+    if media.status == 416:
+        return HttpResponse(status=416, headers=headers)
+    if request.method == 'HEAD':
+        return HttpResponse(status=media.status, headers=headers)
+    if media.status == 206:
+        return StreamingHttpResponse(media.open(), status=206, headers=headers)
+    # файл целиком: wsgi.file_wrapper может отправить его через sendfile
+    response = FileResponse(open(media.path, 'rb'), headers=headers)
+    response.block_size = BLOCK_SIZE
+    return response
+
+
+class MediaApp:
+    # ASGI, только при SERVE_MEDIA: запросы к MEDIA_URL отдаются мимо Django
+    # (и его middleware), без проверки доступа; если сервер умеет
+    # http.response.zerocopysend, байты идут через sendfile, иначе - блоками
+    # по BLOCK_SIZE, читаемыми в пуле потоков.
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        prefix = settings.MEDIA_URL
+        if (
+            scope['type'] != 'http' or not scope['path'].startswith(prefix)
+            or scope['method'] not in ('GET', 'HEAD') or not serving_enabled()
+        ):
+            return await self.application(scope, receive, send)
+
+        headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+        try:
+            media = MediaFile(scope['path'][len(prefix):], headers)
+        except Http404:
+            return await self._send_empty(send, 404, {'Content-Length': '0'})
+        response_headers = media.headers()
+        if media.status in (304, 416) or scope['method'] == 'HEAD':
+            if media.status == 416:
+                response_headers['Content-Length'] = '0'
+            return await self._send_empty(send, media.status, response_headers)
+
+        await send({
+            'type': 'http.response.start',
+            'status': media.status,
+            'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in response_headers.items()],
+        })
+        loop = asyncio.get_running_loop()
+        body = await loop.run_in_executor(None, media.open)
+        try:
+            if 'http.response.zerocopysend' in scope.get('extensions', {}):
+                await send({
+                    'type': 'http.response.zerocopysend',
+                    'file': body.file,
+                    'offset': media.start,
+                    'count': media.length,
+                })
+                return
+            while True:
+                chunk = await loop.run_in_executor(None, body.read, BLOCK_SIZE)
+                more = body.remaining > 0 and bool(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': more})
+                if not more:
+                    break
+        finally:
+            body.close()
+
+    async def _send_empty(self, send, status, headers):
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(key.lower().encode('latin-1'), value.encode('latin-1')) for key, value in headers.items()],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
@@ -0,0 +1,54 @@
+import atexit
+import logging
+import threading
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicWorker:
+    # Фоновый поток, который раз в interval() секунд вызывает task(). Поток
+    # запускается лениво первым ensure_started() и перезапускается, если умер;
+    # при выходе процесса останавливается и вызывает on_exit (последний сброс
+    # буфера). interval() читается на каждом шаге, чтобы работали настройки
+    # тестов; при interval() <= 0 поток не запускается.
+
+    def __init__(self, name, task, interval, on_exit=None):
+        self.name = name
+        self.task = task
+        self.interval = interval
+        self.on_exit = on_exit
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._atexit_registered = False
+
+    def ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        if self.interval() <= 0:
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.shutdown)
+                self._atexit_registered = True
+
+    def shutdown(self):
+        self._stopped.set()
+        if self.on_exit is not None:
+            self.on_exit()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval()):
+            try:
+                self.task()
+            except Exception:
+                logger.exception('Periodic task %s failed', self.name)
+            finally:
+                close_old_connections()
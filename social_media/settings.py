@@ -56,6 +56,8 @@ INSTALLED_APPS = [
     'allauth',
     'usersmodel',
     'posts',
+    'search',
+    'mediastore',
 
 ]
 SITE_ID = 1
@@ -85,7 +87,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',  
     ],
      'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'usersmodel.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ),
@@ -211,6 +213,34 @@ DATABASES = {
     }
 }
 
+# Продакшен-профиль SQLite (SQLITE_PROFILE=production): WAL, чтобы чтения не
+# ждали запись; synchronous=NORMAL (в WAL не теряет целостность); ожидание
+# блокировки вместо ошибки "database is locked"; mmap и кеш страниц на
+# соединение. Соединения постоянные. Пишет только 'default' (BEGIN IMMEDIATE -
+# блокировка на запись берётся сразу), читают соединения 'replica' с
+# query_only, см. social_media/db_router.py
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode=WAL;'
+    'PRAGMA synchronous=NORMAL;'
+    'PRAGMA busy_timeout=20000;'
+    'PRAGMA mmap_size=268435456;'
+    'PRAGMA cache_size=-65536;'
+    'PRAGMA temp_store=MEMORY;'
+)
+if os.getenv('SQLITE_PROFILE') == 'production':
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 600,
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'init_command': SQLITE_PRAGMAS, 'transaction_mode': 'IMMEDIATE'},
+    })
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'OPTIONS': {'init_command': SQLITE_PRAGMAS + 'PRAGMA query_only=ON;'},
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_ROUTERS = ['social_media.db_router.ReadWriteRouter']
+    MIDDLEWARE.insert(0, 'social_media.db_router.ReadYourWritesMiddleware')
+
 
 
 
@@ -228,11 +258,103 @@ AUTH_PASSWORD_VALIDATORS = [
         'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
     },
 ]
+# Общий для всех ASGI-процессов хоста слой: брокер на Unix-сокете поднимается сам.
+# Сокет по умолчанию - в $XDG_RUNTIME_DIR или run/ проекта; каталог сокета должен
+# принадлежать пользователю сервиса и быть закрыт на запись для остальных
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        'BACKEND': 'social_media.channel_layer.UnixSocketChannelLayer',
+        'CONFIG': {
+            'path': os.getenv('CHANNEL_LAYER_SOCKET'),
+            'expiry': 60,
+            'group_expiry': 86400,
+            'capacity': 100,
+        },
+    },
+}
+# Как часто (в секундах) накопленные просмотры постов сбрасываются в БД; 0 - писать сразу
+POST_VIEWS_FLUSH_INTERVAL = 5
+# Уменьшенные копии картинок постов и чатов: наибольшая сторона каждого варианта,
+# число процессов пула и фоновый режим (False - пережимать сразу, в том же процессе)
+IMAGE_DERIVATIVE_SIZES = {'thumb': 160, 'feed': 720, 'full': 2048}
+IMAGE_DERIVATIVE_WORKERS = 2
+IMAGE_DERIVATIVE_ASYNC = True
+# Загрузка файлов частями: куда складываются недокачанные файлы (та же ФС, что и
+# MEDIA_ROOT, чтобы готовый файл переносился без копирования), предельный размер
+# части и файла, через сколько секунд брошенная сессия удаляется
+CHUNKED_UPLOAD_DIR = os.path.join(BASE_DIR, 'upload_chunks')
+CHUNKED_UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_SIZE = 2 * 1024 ** 3
+CHUNKED_UPLOAD_EXPIRY = 24 * 60 * 60
+# Хранилище файлов постов и сообщений по содержимому (mediastore): как часто
+# фоновый сборщик удаляет файлы без ссылок и сколько секунд файл без ссылок ещё хранится
+MEDIASTORE_SWEEP_INTERVAL = 60 * 60
+MEDIASTORE_ORPHAN_GRACE = 60 * 60
+# Сколько уровней ответов и сколько ответов на узел отдавать в дереве комментариев
+COMMENT_TREE_MAX_DEPTH = 3
+COMMENT_TREE_REPLIES_LIMIT = 5
+# Тренды хештегов: размер корзины rollup-а, период сброса и пересчёта окон (сек),
+# сколько позиций топа держать готовыми и сколько хранить rollup-ы
+TRENDING_BUCKET = 300
+TRENDING_FLUSH_INTERVAL = 10
+TRENDING_REFRESH_INTERVAL = 60
+TRENDING_TOP_SIZE = 100
+TRENDING_RETENTION = 30 * 86400
+# Рассылка уведомлений о новом посте: размер партии bulk_create и фоновый режим
+NOTIFICATION_FANOUT_BATCH_SIZE = 1000
+NOTIFICATION_FANOUT_ASYNC = True
+# Домашняя лента: сколько id постов хранить на пользователя и с какого числа
+# подписчиков посты автора не раскладываются по лентам, а подмешиваются при чтении
+HOME_TIMELINE_LENGTH = 800
+HOME_TIMELINE_PULL_THRESHOLD = 10000
+# Ранжирование ленты: веса признаков (см. posts/ranking.py DEFAULT_WEIGHTS),
+# период полураспада свежести и окно скорости комментариев (часы), размер
+# набора кандидатов и бюджет времени ранжирования (мс), сверх которого пишем в лог
+FEED_RANKING_WEIGHTS = {}
+FEED_RANKING_HALF_LIFE = 12
+FEED_RANKING_VELOCITY_HOURS = 6
+FEED_RANKING_CANDIDATES = 5000
+FEED_RANKING_BUDGET_MS = 100
+# Окно (сек), за которое уведомления пользователю собираются в один websocket-кадр
+NOTIFICATION_PUSH_WINDOW = 0.25
+# Групповой коммит сообщений чата: максимум сообщений в одном bulk_create и
+# максимальная задержка (сек) записи первого сообщения партии
+CHAT_WRITE_BATCH_SIZE = 200
+CHAT_WRITE_MAX_DELAY = 0.01
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # общий для всех процессов хоста: готовые ответы постов и пользователи для
+    # JWT. При MAX_ENTRIES файлов удаляется случайная 1/CULL_FREQUENCY часть,
+    # поэтому здесь только то, что можно пересобрать; отметки изменений постов
+    # хранятся в БД (posts.ResponseMark)
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('SHARED_CACHE_DIR', os.path.join(BASE_DIR, 'shared_cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('SHARED_CACHE_MAX_ENTRIES', 20000)),
+            'CULL_FREQUENCY': 10,
+        },
     },
 }
+# Кеш ответов списка и карточки постов: алиас из CACHES и время жизни записи (сек), 0 - выключен
+POSTS_RESPONSE_CACHE = 'shared'
+POSTS_RESPONSE_CACHE_TIMEOUT = 60
+# Кеш пользователей для JWT-аутентификации (REST и websocket): алиас из CACHES и TTL в секундах.
+# Должен быть общим для всех процессов, иначе деактивация и отзыв доступа видны только одному
+AUTH_PRINCIPAL_CACHE = 'shared'
+AUTH_PRINCIPAL_CACHE_TTL = 60
+# Поиск: 'auto' - FTS5 на SQLite, иначе собственный индекс токенов ('fts5' / 'tokens')
+SEARCH_BACKEND = 'auto'
+# Автодополнение: снимок индекса для быстрого старта, его максимальный возраст и
+# период сверки с БД (сек) - изменения из других процессов подхватываются с этой задержкой
+AUTOCOMPLETE_SNAPSHOT = BASE_DIR / 'autocomplete.json'
+AUTOCOMPLETE_SNAPSHOT_MAX_AGE = 3600
+AUTOCOMPLETE_REFRESH_INTERVAL = 60
+# переименования в других процессах не меняют (count, max id) - их подхватывает
+# полная пересборка не реже раза в этот период (сек)
+AUTOCOMPLETE_REBUILD_INTERVAL = 900
 from django.utils.log import DEFAULT_LOGGING
 
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
@@ -326,6 +448,16 @@ LOCALE_PATHS = [
 LANGUAGE_CODE = 'en-us'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Отдавать MEDIA_ROOT самим приложением (serve_media / MediaApp) - только для
+# разработки: весь каталог публичен и обходит middleware. В продакшене файлы
+# отдаёт фронтовой сервер, например nginx:
+#   location ~ ^/media/(.+/derivatives/.+)$ { alias <MEDIA_ROOT>/$1; expires 1h; }
+#   location /media/ { alias <MEDIA_ROOT>/; expires max; add_header Cache-Control immutable; }
+SERVE_MEDIA = DEBUG
+# Файлы media не перезаписываются под тем же именем, поэтому кешируются надолго
+# (immutable); уменьшенные копии пересобираются по тому же адресу - недолго
+MEDIA_CACHE_MAX_AGE = 60 * 60 * 24 * 365
+MEDIA_DERIVATIVE_CACHE_MAX_AGE = 60 * 60
 TIME_ZONE = 'UTC'
 
 USE_I18N = True
@@ -2,14 +2,20 @@
 from django.contrib import admin
 from django.urls import path
 from django.conf import settings
-from django.conf.urls.static import static
-from django.urls import path,include
+from django.urls import path,include,re_path
+from social_media.media_serving import serve_media, serving_enabled
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/search/', include('search.urls')),
     path('api/', include('posts.urls')),
     path('chat/', include('usersmodel.urls')),  
     path('rosetta/', include('rosetta.urls')),
     path('auth/', include('djoser.urls')),
     path('auth/', include('djoser.urls.jwt')),  
 ]
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Range/If-Range и долгий кеш; под ASGI media отдаёт MediaApp из asgi.py.
+# Только при SERVE_MEDIA, иначе файлы отдаёт фронтовой сервер
+if serving_enabled():
+    urlpatterns += [
+        re_path(r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'), serve_media),
+    ]
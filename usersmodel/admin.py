@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import CustomUser, Hashtag, Notification, Friendship, Follower, Chat, Message
+from .models import CustomUser, Hashtag, Notification, NotificationFanout, Friendship, Follower, Chat, Message
 
 @admin.register(CustomUser)
 class CustomUserAdmin(admin.ModelAdmin):
@@ -21,6 +21,12 @@ class NotificationAdmin(admin.ModelAdmin):
     search_fields = ('message',)
     ordering = ('-created_at',)
 
+@admin.register(NotificationFanout)
+class NotificationFanoutAdmin(admin.ModelAdmin):
+    list_display = ('post', 'sender', 'status', 'processed', 'total', 'created_at', 'updated_at')
+    list_filter = ('status', 'created_at')
+    ordering = ('-created_at',)
+
 @admin.register(Friendship)
 class FriendshipAdmin(admin.ModelAdmin):
     list_display = ('user', 'friend', 'is_accepted', 'created_at')
@@ -0,0 +1,124 @@
+import threading
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import checks
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+MISSING = 'missing'
+# только то, что читают аутентификация, права и чат; пароль и личные данные
+# в кеш (он на диске) не попадают - их догружает CustomUser.refresh_from_db
+PRINCIPAL_FIELDS = ('id', 'is_active', 'is_staff', 'is_superuser', 'email', 'username', 'name')
+# кеши, которые не видят инвалидацию из других процессов
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+class PrincipalCache:
+    # Кеш пользователей для JWT-аутентификации REST и websocket. Хранятся
+    # PRINCIPAL_FIELDS и токен отзыва - md5 от хеша пароля, как в claim
+    # токена simplejwt; каждый вызов получает свой экземпляр. Кеш должен быть
+    # общим для процессов: деактивацию пользователя сбрасывает только
+    # процесс, сохранивший его.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'AUTH_PRINCIPAL_CACHE', 'shared')]
+
+    @property
+    def ttl(self):
+        return getattr(settings, 'AUTH_PRINCIPAL_CACHE_TTL', 60)
+
+    def key(self, user_id):
+        return f'auth:principal:{user_id}'
+
+    def get(self, user_id):
+        values = self.cache.get(self.key(user_id))
+        if values is None:
+            self._count('misses')
+            values = self.load(user_id)
+        else:
+            self._count('hits')
+        return self.build(values)
+
+    async def aget(self, user_id):
+        # при попадании - без перехода в поток и запроса к БД
+        values = await self.cache.aget(self.key(user_id))
+        if values is None:
+            self._count('misses')
+            values = await database_sync_to_async(self.load)(user_id)
+        else:
+            self._count('hits')
+        return self.build(values)
+
+    @property
+    def fields(self):
+        # from_db ждёт значения в порядке полей модели
+        return [f.attname for f in get_user_model()._meta.concrete_fields if f.attname in PRINCIPAL_FIELDS]
+
+    def load(self, user_id):
+        User = get_user_model()
+        row = User.objects.filter(pk=user_id).values_list('password', *self.fields).first()
+        # отсутствующих пользователей тоже кешируем, чтобы не долбить БД мёртвыми токенами
+        values = MISSING if row is None else [get_md5_hash_password(row[0]), list(row[1:])]
+        self.cache.set(self.key(user_id), values, self.ttl)
+        return values
+
+    def build(self, values):
+        if values == MISSING:
+            return None
+        revoke_token, values = values
+        user = get_user_model().from_db(DEFAULT_DB_ALIAS, self.fields, values)
+        user._revoke_token = revoke_token
+        return user
+
+    def revoke_token(self, user):
+        # для пользователя не из кеша - как в JWTAuthentication
+        token = getattr(user, '_revoke_token', None)
+        return token if token is not None else get_md5_hash_password(user.password)
+
+    def invalidate(self, user_id):
+        self._count('invalidations')
+        self.cache.delete(self.key(user_id))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            }
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+
+principal_cache = PrincipalCache()
+
+
+@checks.register(checks.Tags.caches)
+def check_principal_cache(app_configs, **kwargs):
+    alias = getattr(settings, 'AUTH_PRINCIPAL_CACHE', 'shared')
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES:
+        return [checks.Warning(
+            f'AUTH_PRINCIPAL_CACHE={alias!r} is process-local ({backend}): deactivated users stay '
+            'authenticated in other workers until the cache entry expires.',
+            hint='Point AUTH_PRINCIPAL_CACHE at a cache shared by all workers.',
+            id='usersmodel.W001',
+        )]
+    return []
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.dispatch import Signal
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# bulk_create не шлёт post_save: подписчикам (например, поиску) отправляем это
+messages_created = Signal()
+
+
+class MessageWriteQueue:
+    # Групповой коммит сообщений чата: сообщения всех соединений процесса
+    # копятся и пишутся одним bulk_create. submit() возвращает сохранённое
+    # сообщение только после коммита его партии.
+
+    def __init__(self, batch_size=None, max_delay=None):
+        self._batch_size = batch_size
+        self._max_delay = max_delay
+        self._queues = weakref.WeakKeyDictionary()
+
+    @property
+    def batch_size(self):
+        return self._batch_size or getattr(settings, 'CHAT_WRITE_BATCH_SIZE', 200)
+
+    @property
+    def max_delay(self):
+        if self._max_delay is not None:
+            return self._max_delay
+        return getattr(settings, 'CHAT_WRITE_MAX_DELAY', 0.01)
+
+    async def submit(self, chat_id, sender_id, content, media=None):
+        loop = asyncio.get_running_loop()
+        state = self._queues.get(loop)
+        if state is None:
+            state = self._queues[loop] = _LoopQueue(self)
+        return await state.submit(Message(chat_id=chat_id, sender_id=sender_id, content=content, media=media))
+
+
+class _LoopQueue:
+    def __init__(self, writer):
+        self.writer = writer
+        self.items = []
+        self.arrived = asyncio.Event()
+        self.full = asyncio.Event()
+        self.task = None
+
+    async def submit(self, message):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.items.append((message, future, loop.time()))
+        self.arrived.set()
+        if len(self.items) >= self.writer.batch_size:
+            self.full.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self._run())
+        return await future
+
+    async def _run(self):
+        try:
+            while True:
+                await self.arrived.wait()
+                # ждём добора партии, но не дольше max_delay от самого старого сообщения
+                delay = self.items[0][2] + self.writer.max_delay - asyncio.get_running_loop().time()
+                if len(self.items) < self.writer.batch_size and delay > 0:
+                    try:
+                        await asyncio.wait_for(self.full.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                await self._write(self._take())
+        except asyncio.CancelledError:
+            # цикл событий останавливается: накопленное дописываем, а не теряем
+            while self.items:
+                await self._write(self._take())
+            raise
+
+    def _take(self):
+        batch = self.items[:self.writer.batch_size]
+        del self.items[:self.writer.batch_size]
+        if len(self.items) < self.writer.batch_size:
+            self.full.clear()
+        if not self.items:
+            self.arrived.clear()
+        return batch
+
+    async def _write(self, batch):
+        try:
+            saved = await database_sync_to_async(write_batch)([message for message, _, _ in batch])
+        except Exception as exc:
+            logger.exception('Failed to write %d chat messages', len(batch))
+            saved = [exc] * len(batch)
+        for (_, future, _), result in zip(batch, saved):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+def write_batch(messages):
+    try:
+        with transaction.atomic():
+            messages = Message.objects.bulk_create(messages)
+            messages_created.send(sender=Message, messages=messages)
+            return messages
+    except IntegrityError:
+        # например, чат удалён: одно плохое сообщение не должно ронять всю партию
+        results = []
+        for message in messages:
+            message.pk = None
+            try:
+                with transaction.atomic():
+                    message.save(force_insert=True)
+                results.append(message)
+            except IntegrityError as exc:
+                results.append(exc)
+        return results
+
+
+message_writer = MessageWriteQueue()
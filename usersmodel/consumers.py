@@ -3,41 +3,34 @@ import json
 from .models import Chat, Message,Notification
 from channels.db import database_sync_to_async
 from channels.exceptions import DenyConnection
+from django.db.models import Exists, OuterRef
+from .push import chat_group, notification_group, publish_chat_membership
+from .chat_writer import message_writer
 
 class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.chat_id = self.scope['url_route']['kwargs']['chat_id']
-        self.chat_group_name = f'chat_{self.chat_id}'
+        self.chat_group_name = chat_group(self.chat_id)
         self.user = self.scope['user']
 
         
-        chat = await self.get_chat(self.chat_id)
-        
-    
-        already_connected = False
-
-        if chat.is_group:
+        # чат, его тип и членство кешируются на всё соединение; изменения
+        # состава приходят событием chat_membership
+        chat = await self.get_chat_access(self.chat_id, self.user.id)
+        if chat is None:
+            raise DenyConnection("Chat not found")
+        self.is_group = chat.is_group
+        self.is_member = chat.is_member
+
+        if not self.is_member and chat.is_group:
             invite_link = self.scope['url_route']['kwargs'].get('invite_link')
             if invite_link and await self.is_invited_to_chat(chat, invite_link):
                 await self.add_user_to_chat(chat, self.user)
-                already_connected = True  
-            else:
-                
-                if await self.is_user_in_chat(chat, self.user.id):
-                    already_connected = True 
-                else:
-                    raise DenyConnection("Access denied")
-        else:
-         
-            if await self.is_user_in_chat(chat, self.user.id):
-                already_connected = True 
-            else:
-                raise DenyConnection("Access denied")
-
-     
-        if not already_connected:
-            await self.accept()
-        
+                self.is_member = True
+
+        if not self.is_member:
+            raise DenyConnection("Access denied")
+
         # Добавляем пользователя в группу
         await self.channel_layer.group_add(
             self.chat_group_name,
@@ -46,6 +39,15 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         await self.accept()
 
+    async def disconnect(self, close_code):
+        # иначе закрытый сокет навсегда остаётся в группе чата
+        if not hasattr(self, 'chat_group_name'):
+            return
+        await self.channel_layer.group_discard(
+            self.chat_group_name,
+            self.channel_name
+        )
+
     async def receive(self, text_data):
         data = json.loads(text_data)
         message = data.get('message')
@@ -54,9 +56,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
         user = self.scope['user']
 
         # Handle actions
+        if not self.is_member:
+            await self.close()
+            return
+
         if action == 'send':
-            chat = await self.get_chat(self.chat_id)
-            new_message = await self.save_message(chat, user, message, media)
+            # рассылаем только после коммита партии, в которую попало сообщение
+            new_message = await message_writer.submit(self.chat_id, user.id, message, media)
             await self.channel_layer.group_send(
                 self.chat_group_name,
                 {
@@ -112,17 +118,27 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'message_id': event['message_id'],
         }))
 
+    async def chat_membership(self, event):
+        if self.user.id in event['user_ids']:
+            self.is_member = event['is_member']
+            if not self.is_member:
+                await self.close()
+
     @database_sync_to_async
-    def get_chat(self, chat_id):
-        return Chat.objects.get(pk=chat_id)
+    def get_chat_access(self, chat_id, user_id):
+        # одним запросом: сам чат и членство пользователя
+        return Chat.objects.annotate(
+            is_member=Exists(Chat.users.through.objects.filter(chat_id=OuterRef('pk'), customuser_id=user_id))
+        ).filter(pk=chat_id).first()
 
     @database_sync_to_async
-    def is_user_in_chat(self, chat, user_id):
-        return chat.users.filter(id=user_id).exists()
+    def is_invited_to_chat(self, chat, invite_link):
+        return str(chat.invite_link) == str(invite_link)
 
     @database_sync_to_async
-    def save_message(self, chat, user, message, media=None):
-        return Message.objects.create(chat=chat, sender=user, content=message, media=media)
+    def add_user_to_chat(self, chat, user):
+        chat.users.add(user)
+        publish_chat_membership(chat.id, [user.id])
 
     @database_sync_to_async
     def update_message_content(self, message_id, updated_content):
@@ -141,7 +157,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user_id = self.scope['url_route']['kwargs']['user_id']
-        self.room_group_name = f'notifications_{self.user_id}'
+        self.room_group_name = notification_group(self.user_id)
+
+        # чужие уведомления не отдаём
+        user = self.scope.get('user')
+        if not user or not user.is_authenticated or str(user.id) != str(self.user_id):
+            await self.close()
+            return
 
 
         await self.channel_layer.group_add(
@@ -152,7 +174,8 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         await self.accept()
 
     async def disconnect(self, close_code):
-  
+        if not hasattr(self, 'room_group_name'):
+            return
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
@@ -173,3 +196,9 @@ class NotificationConsumer(AsyncWebsocketConsumer):
         await self.send(text_data=json.dumps({
             'notification': notification
         }))
+
+    async def send_notifications(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'notifications',
+            'notifications': event['notifications'],
+        }))
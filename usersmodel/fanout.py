@@ -0,0 +1,123 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Follower, Notification, NotificationFanout
+from .push import notification_publisher
+from . import timeline
+
+logger = logging.getLogger(__name__)
+
+
+def schedule_post_fanout(post):
+    job = NotificationFanout.objects.create(
+        post=post,
+        sender=post.user,
+        message=f'{post.user.name} has posted a new update.',
+    )
+    transaction.on_commit(fanout_worker.wake)
+    return job
+
+
+def process_batch(job, batch_size=None, push_timelines=True):
+    batch_size = batch_size or settings.NOTIFICATION_FANOUT_BATCH_SIZE
+    with transaction.atomic():
+        followers = list(
+            Follower.objects.filter(user_id=job.sender_id, id__gt=job.cursor)
+            .order_by('id')
+            .values_list('id', 'follower_id')[:batch_size]
+        )
+        if not followers:
+            NotificationFanout.objects.filter(pk=job.pk, cursor=job.cursor).update(status='done', updated_at=timezone.now())
+            job.status = 'done'
+            return False
+
+        last_id = followers[-1][0]
+        # курсор двигаем условно: если задачу параллельно взял другой процесс,
+        # партия откатится и уведомления не задублируются
+        claimed = NotificationFanout.objects.filter(pk=job.pk, cursor=job.cursor).update(
+            cursor=last_id,
+            processed=F('processed') + len(followers),
+            status='running',
+            updated_at=timezone.now(),
+        )
+        if not claimed:
+            job.refresh_from_db()
+            return job.status != 'done'
+
+        # bulk_create не шлёт post_save, поэтому публикуем партию сами
+        notification_publisher.publish(Notification.objects.bulk_create([
+            Notification(
+                user_id=follower_id,
+                sender_id=job.sender_id,
+                message=job.message,
+                notification_type='new_post',
+                post_id=job.post_id,
+            )
+            for _, follower_id in followers
+        ]))
+        if push_timelines:
+            timeline.push(job.post_id, [follower_id for _, follower_id in followers])
+
+    job.cursor = last_id
+    job.processed += len(followers)
+    job.status = 'running'
+    logger.info('Notification fan-out %s: %s/%s', job.pk, job.processed, job.total)
+    return True
+
+
+def run_job(job, batch_size=None):
+    if job.total is None:
+        job.total = Follower.objects.filter(user_id=job.sender_id).count()
+        NotificationFanout.objects.filter(pk=job.pk).update(total=job.total)
+    # себе и друзьям - всегда; подписчикам - только если автор ниже порога,
+    # иначе его посты подмешиваются в ленту при чтении
+    timeline.push(job.post_id, {job.sender_id} | timeline.friend_ids(job.sender_id))
+    push_timelines = job.total < timeline.pull_threshold()
+    while process_batch(job, batch_size, push_timelines):
+        pass
+    logger.info('Notification fan-out %s finished: %s notifications', job.pk, job.processed)
+    return job
+
+
+def run_pending(batch_size=None):
+    done = 0
+    for job in NotificationFanout.objects.exclude(status='done').order_by('id'):
+        run_job(job, batch_size)
+        done += 1
+    return done
+
+
+class FanoutWorker:
+    def __init__(self):
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def wake(self):
+        if not getattr(settings, 'NOTIFICATION_FANOUT_ASYNC', True):
+            run_pending()
+            return
+        self._wakeup.set()
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-fanout', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            try:
+                run_pending()
+            except Exception:
+                logger.exception('Notification fan-out failed, will retry on next wake-up')
+            finally:
+                close_old_connections()
+
+
+fanout_worker = FanoutWorker()
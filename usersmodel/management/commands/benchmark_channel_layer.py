@@ -0,0 +1,64 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+from social_media.channel_layer import UnixSocketChannelLayer
+
+
+async def roundtrip_latency(layer, count):
+    channel = await layer.new_channel()
+    timings = []
+    for i in range(count):
+        started = time.perf_counter()
+        await layer.send(channel, {'type': 'bench.message', 'n': i})
+        await layer.receive(channel)
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+async def group_throughput(layer, count, members):
+    channels = [await layer.new_channel() for _ in range(members)]
+    for channel in channels:
+        await layer.group_add('bench', channel)
+
+    async def drain(channel):
+        for _ in range(count):
+            await layer.receive(channel)
+
+    started = time.perf_counter()
+    receivers = asyncio.gather(*(drain(channel) for channel in channels))
+    for i in range(count):
+        await layer.group_send('bench', {'type': 'bench.message', 'n': i})
+    await receivers
+    elapsed = time.perf_counter() - started
+    return count * members / elapsed
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает задержку и пропускную способность UnixSocketChannelLayer и InMemoryChannelLayer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000)
+        parser.add_argument('--members', type=int, default=10, help='Сколько каналов в группе для group_send')
+
+    def handle(self, *args, **options):
+        count = options['messages']
+        members = options['members']
+        with tempfile.TemporaryDirectory() as tmp:
+            layers = [
+                ('in-memory', InMemoryChannelLayer(capacity=count)),
+                ('unix-socket', UnixSocketChannelLayer(path=os.path.join(tmp, 'bench.sock'), capacity=count, broker_idle_timeout=1)),
+            ]
+            for name, layer in layers:
+                p50, p99 = asyncio.run(roundtrip_latency(layer, count))
+                rate = asyncio.run(group_throughput(layer, count, members))
+                self.stdout.write(
+                    f'{name:12} send+receive p50 {p50 * 1e6:8.1f} us  p99 {p99 * 1e6:8.1f} us  '
+                    f'group_send x{members}: {rate:10.0f} msg/s'
+                )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from usersmodel.fanout import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Дорабатывает незавершённые рассылки уведомлений о новых постах (например, после падения процесса)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        jobs = run_pending(options['batch_size'])
+        self.stdout.write(f'Processed {jobs} fan-out job(s)')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from usersmodel.uploads import purge_stale
+
+
+class Command(BaseCommand):
+    help = 'Удаляет брошенные сессии загрузки частями вместе с недокачанными файлами'
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Removed {purge_stale()} upload session(s)')
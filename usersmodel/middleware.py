@@ -1,6 +1,5 @@
 import jwt
 from urllib.parse import parse_qs
-from channels.db import database_sync_to_async
 from channels.middleware import BaseMiddleware
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from django.contrib.auth.models import AnonymousUser
@@ -8,14 +7,15 @@ from django.contrib.auth import get_user_model
 from django.conf import settings
 from django.db import close_old_connections
 
+from .auth_cache import principal_cache
+
 User = get_user_model()
 
-@database_sync_to_async
-def get_user(user_id):
-    try:
-        return User.objects.get(id=user_id)
-    except User.DoesNotExist:
+async def get_user(user_id):
+    user = await principal_cache.aget(user_id)
+    if user is None or not user.is_active:
         return AnonymousUser()
+    return user
 
 class JWTAuthMiddleware(BaseMiddleware):
     async def __call__(self, scope, receive, send):
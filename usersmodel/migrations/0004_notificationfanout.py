@@ -0,0 +1,31 @@
+# Generated by Django 5.1.1 on 2026-10-18 12:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_comment_path'),
+        ('usersmodel', '0003_alter_customuser_managers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationFanout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('message', models.CharField(max_length=255)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done')], db_index=True, default='pending', max_length=10)),
+                ('cursor', models.BigIntegerField(default=0)),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='Отправлено')),
+                ('total', models.PositiveIntegerField(blank=True, null=True, verbose_name='Всего подписчиков')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_fanouts', to='posts.post')),
+                ('sender', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_fanouts', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
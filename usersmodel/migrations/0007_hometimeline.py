@@ -0,0 +1,37 @@
+# Generated by Django 5.1.1 on 2026-10-18 14:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_followers_count(apps, schema_editor):
+    # счётчик раньше не поддерживался, а по нему теперь выбираются авторы,
+    # чьи посты подмешиваются в ленту при чтении
+    CustomUser = apps.get_model('usersmodel', 'CustomUser')
+    Follower = apps.get_model('usersmodel', 'Follower')
+    rows = Follower.objects.filter(user=OuterRef('pk')).order_by().values('user')
+    CustomUser.objects.update(
+        followers_count=Coalesce(Subquery(rows.annotate(c=Count('pk')).values('c')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usersmodel', '0006_chatreadmarker'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HomeTimeline',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='home_timeline', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('post_ids', models.BinaryField(default=bytes)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_followers_count, migrations.RunPython.noop),
+    ]
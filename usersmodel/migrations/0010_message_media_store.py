@@ -0,0 +1,29 @@
+# Generated by Django 5.1.1 on 2026-10-18 19:40
+
+import mediastore.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('usersmodel', '0009_chunkedupload'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='message',
+            name='audio',
+            field=models.FileField(blank=True, null=True, storage=mediastore.storage.get_media_store, upload_to='chat_audio/'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=mediastore.storage.get_media_store, upload_to='chat_images/'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='video',
+            field=models.FileField(blank=True, null=True, storage=mediastore.storage.get_media_store, upload_to='chat_videos/'),
+        ),
+    ]
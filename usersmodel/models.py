@@ -2,6 +2,7 @@ from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.db import models
 from django.utils.translation import gettext as _
 from posts.models import Post
+from mediastore.storage import get_media_store
 import uuid
 
 
@@ -61,6 +62,15 @@ class CustomUser(AbstractUser):
         
         super().save(*args, **kwargs)
 
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        # пользователь из principal_cache загружен не полностью: первое
+        # обращение к отложенному полю догружает их все одним запросом
+        if fields is not None:
+            deferred = self.get_deferred_fields()
+            if deferred.intersection(fields):
+                fields = set(fields) | deferred
+        super().refresh_from_db(using, fields, **kwargs)
+
 
 
 class Notification(models.Model):
@@ -84,6 +94,34 @@ class Notification(models.Model):
         return f'Notification for {self.user.username}: {self.message}'
 
 
+class NotificationFanout(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+    ]
+
+    post = models.ForeignKey('posts.Post', on_delete=models.CASCADE, related_name='notification_fanouts')
+    sender = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='notification_fanouts')
+    message = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', db_index=True)
+    # id последней обработанной записи Follower: с него продолжаем после падения
+    cursor = models.BigIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0, verbose_name=_("Отправлено"))
+    total = models.PositiveIntegerField(null=True, blank=True, verbose_name=_("Всего подписчиков"))
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Fan-out of post {self.post_id}: {self.processed}/{self.total if self.total is not None else "?"}'
+
+    @property
+    def progress(self):
+        if not self.total:
+            return 1.0 if self.status == 'done' else 0.0
+        return min(self.processed / self.total, 1.0)
+
+
 class Friendship(models.Model):
     user = models.ForeignKey(CustomUser, related_name='friendships', on_delete=models.CASCADE)
     friend = models.ForeignKey(CustomUser, related_name='friends', on_delete=models.CASCADE)
@@ -120,20 +158,70 @@ class Message(models.Model):
     sender = models.ForeignKey(CustomUser, related_name="messages", on_delete=models.CASCADE)
     content = models.TextField(blank=True, null=True)  
     media = models.URLField(null=True, blank=True)
-    image = models.ImageField(upload_to='chat_images/', blank=True, null=True)
-    video = models.FileField(upload_to='chat_videos/', blank=True, null=True)
-    audio = models.FileField(upload_to='chat_audio/', blank=True, null=True)
+    image = models.ImageField(upload_to='chat_images/', storage=get_media_store, blank=True, null=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    video = models.FileField(upload_to='chat_videos/', storage=get_media_store, blank=True, null=True)
+    audio = models.FileField(upload_to='chat_audio/', storage=get_media_store, blank=True, null=True)
     is_edited = models.BooleanField(default=False)
     is_deleted = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # история чата листается по (timestamp, id) в пределах одного чата
+            models.Index(fields=['chat', 'timestamp', 'id'], name='message_chat_ts_idx'),
+        ]
+
     def save(self, *args, **kwargs):
         if self.pk is not None:  
             self.is_edited = True
         super().save(*args, **kwargs)
 
 
+class ChatReadMarker(models.Model):
+    chat = models.ForeignKey(Chat, related_name="read_markers", on_delete=models.CASCADE)
+    user = models.ForeignKey(CustomUser, related_name="chat_read_markers", on_delete=models.CASCADE)
+    # id последнего прочитанного сообщения; непрочитанные - всё, что новее
+    last_read_message_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('chat', 'user')
+
+    def __str__(self):
+        return f'{self.user_id} read chat {self.chat_id} up to {self.last_read_message_id}'
+
+
+class HomeTimeline(models.Model):
+    # id постов ленты, новые первыми: упакованный array('q'), см. timeline.py
+    user = models.OneToOneField(CustomUser, related_name='home_timeline', on_delete=models.CASCADE, primary_key=True)
+    post_ids = models.BinaryField(default=bytes)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Home timeline of {self.user_id}'
+
+
+class ChunkedUpload(models.Model):
+    # сессия загрузки файла частями; принятые байты лежат в CHUNKED_UPLOAD_DIR, см. uploads.py
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(CustomUser, related_name='chunked_uploads', on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    # ожидаемый sha256 всего файла (hex), проверяется при завершении
+    sha256 = models.CharField(max_length=64, blank=True)
+    # {'message': id} или {'post': id} после завершения
+    result = models.JSONField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Upload {self.id} of {self.filename}: {self.offset}/{self.size}'
+
+
 class BugReport(models.Model):
     user = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True)
     title = models.CharField(max_length=255)
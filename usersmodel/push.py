@@ -0,0 +1,128 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def notification_group(user_id):
+    return f'notifications_{user_id}'
+
+
+def chat_group(chat_id):
+    return f'chat_{chat_id}'
+
+
+def run_on_layer(channel_layer, func, *args):
+    # у UnixSocketChannelLayer для синхронного кода есть постоянный цикл событий
+    # и одно соединение; async_to_sync открывал бы их заново на каждый вызов
+    run_sync = getattr(channel_layer, 'run_sync', None)
+    if run_sync is not None:
+        return run_sync(func, *args)
+    return async_to_sync(func)(*args)
+
+
+def publish_chat_membership(chat_id, user_ids, is_member=True):
+    # ChatConsumer кеширует членство на всё соединение, это событие его обновляет
+    event = {'type': 'chat_membership', 'user_ids': list(user_ids), 'is_member': is_member}
+
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            run_on_layer(channel_layer, channel_layer.group_send, chat_group(chat_id), event)
+
+    transaction.on_commit(send)
+
+
+def notification_event(notification):
+    return {
+        'id': notification.pk,
+        'type': notification.notification_type,
+        'message': notification.message,
+        'sender': notification.sender_id,
+        'post': notification.post_id,
+        'created_at': notification.created_at.isoformat() if notification.created_at else None,
+        'is_read': notification.is_read,
+    }
+
+
+class NotificationPublisher:
+    def __init__(self, window=None):
+        self._window = window
+        self._pending = defaultdict(list)
+        self._deadline = None
+        self._cond = threading.Condition()
+        self._thread = None
+
+    @property
+    def window(self):
+        if self._window is not None:
+            return self._window
+        return getattr(settings, 'NOTIFICATION_PUSH_WINDOW', 0.25)
+
+    def publish(self, notifications):
+        events = [(n.user_id, notification_event(n)) for n in notifications]
+        if events:
+            # клиенту уходят только закоммиченные уведомления
+            transaction.on_commit(lambda: self._enqueue(events))
+
+    def _enqueue(self, events):
+        if self.window <= 0:
+            batches = defaultdict(list)
+            for user_id, event in events:
+                batches[user_id].append(event)
+            self._send(batches)
+            return
+        with self._cond:
+            for user_id, event in events:
+                self._pending[user_id].append(event)
+            if self._deadline is None:
+                self._deadline = time.monotonic() + self.window
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='notification-push', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def flush(self):
+        with self._cond:
+            batches, self._pending = self._pending, defaultdict(list)
+            self._deadline = None
+        if batches:
+            self._send(batches)
+        return len(batches)
+
+    def _send(self, batches):
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            # вся пачка - одним синхронным вызовом
+            run_on_layer(channel_layer, self._send_all, channel_layer, batches)
+
+    async def _send_all(self, channel_layer, batches):
+        for user_id, events in batches.items():
+            try:
+                await channel_layer.group_send(notification_group(user_id), {
+                    'type': 'send_notifications',
+                    'notifications': events,
+                })
+            except Exception:
+                logger.exception('Failed to push %d notifications to user %s', len(events), user_id)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._deadline is None:
+                    self._cond.wait()
+                delay = self._deadline - time.monotonic()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+            self.flush()
+
+
+notification_publisher = NotificationPublisher()
@@ -5,6 +5,7 @@ from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer,
 
 from .models import CustomUser, Friendship, Follower, Hashtag, Message, Chat, BugReport, Feedback, Notification
 from posts.serializers import PostSerializer
+from social_media.derivatives import variant_urls
 
 class BugReportSerializer(serializers.ModelSerializer):
     class Meta:
@@ -69,10 +70,14 @@ class UserSerializer(serializers.ModelSerializer):
 
 class MessageSerializer(serializers.ModelSerializer):
     sender = UserSerializer(read_only=True)
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Message
-        fields = ['id', 'chat', 'sender', 'content', 'image', 'video', 'audio', 'is_edited', 'is_deleted', 'timestamp', 'updated_at']
+        fields = ['id', 'chat', 'sender', 'content', 'image', 'image_variants', 'video', 'audio', 'is_edited', 'is_deleted', 'timestamp', 'updated_at']
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants)
 
     def create(self, validated_data):
         request = self.context.get('request', None)
@@ -81,6 +86,37 @@ class MessageSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
+class ChatSenderSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ('id', 'username', 'name', 'surname', 'photo')
+
+
+class ChatHistoryMessageSerializer(serializers.ModelSerializer):
+    # отправитель - id, сами пользователи отдаются один раз в таблице users
+    sender = serializers.IntegerField(source='sender_id', read_only=True)
+    image_variants = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Message
+        fields = ['id', 'chat', 'sender', 'content', 'media', 'image', 'image_variants', 'video', 'audio', 'is_edited', 'is_deleted', 'timestamp', 'updated_at']
+
+    def get_image_variants(self, obj):
+        return variant_urls(obj.image_variants)
+
+
+class InboxChatSerializer(serializers.ModelSerializer):
+    # last_message и participants подставляет ChatViewSet.list пачкой на всю страницу
+    last_message = ChatHistoryMessageSerializer(read_only=True, allow_null=True)
+    participants = ChatSenderSerializer(many=True, read_only=True)
+    participants_count = serializers.IntegerField(read_only=True)
+    unread_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Chat
+        fields = ['id', 'is_group', 'created_at', 'last_message', 'participants', 'participants_count', 'unread_count']
+
+
 class ChatSerializer(serializers.ModelSerializer):
     users = UserSerializer(many=True, read_only=True)
     messages = MessageSerializer(many=True, read_only=True)
@@ -1,8 +1,26 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import Notification, Friendship, Follower
+from .models import CustomUser, Notification, Friendship, Follower, Message
+from .chat_writer import messages_created
+from .auth_cache import principal_cache
+from .fanout import schedule_post_fanout
+from .push import notification_publisher
+from . import timeline
 from posts.models import PostReaction, CommentReaction, Post
+from posts.signals import shift_counter
+from social_media.derivatives import derivative_pipeline, needs_variants
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_principal(sender, instance, **kwargs):
+    principal_cache.invalidate(instance.pk)
+
+@receiver(post_save, sender=Notification)
+def push_notification(sender, instance, created, **kwargs):
+    if created:
+        notification_publisher.publish([instance])
 
 @receiver(post_save, sender=PostReaction)
 def send_post_reaction_notification(sender, instance, created, **kwargs):
@@ -40,15 +58,8 @@ def send_comment_reaction_notification(sender, instance, created, **kwargs):
 @receiver(post_save, sender=Post)
 def send_new_post_notification(sender, instance, created, **kwargs):
     if created:
-        followers = instance.user.followers.all()  
-        for follower in followers:
-            Notification.objects.create(
-                user=follower.follower,  
-                sender=instance.user, 
-                message=f'{instance.user.name} has posted a new update.',
-                notification_type='new_post',
-                post=instance  
-            )
+        # рассылка подписчикам идёт партиями вне запроса, см. fanout.py
+        schedule_post_fanout(instance)
 
 @receiver(post_save, sender=Friendship)
 def send_friend_request_notification(sender, instance, created, **kwargs):
@@ -69,3 +80,36 @@ def send_follow_notification(sender, instance, created, **kwargs):
             message=f'{instance.follower.name} started following you.',
             notification_type='follow'
         )
+
+@receiver(post_save, sender=Follower)
+def follow_timeline(sender, instance, created, **kwargs):
+    if created:
+        shift_counter(CustomUser, instance.user_id, 'followers_count', 1)
+        if not timeline.is_pulled(instance.user_id):
+            timeline.backfill(instance.follower_id, instance.user_id)
+
+@receiver(post_delete, sender=Follower)
+def unfollow_timeline(sender, instance, **kwargs):
+    shift_counter(CustomUser, instance.user_id, 'followers_count', -1)
+    timeline.remove_author(instance.follower_id, instance.user_id)
+
+@receiver(post_save, sender=Friendship)
+def friendship_timeline(sender, instance, **kwargs):
+    if instance.is_accepted:
+        timeline.backfill(instance.user_id, instance.friend_id)
+        timeline.backfill(instance.friend_id, instance.user_id)
+
+@receiver(post_delete, sender=Friendship)
+def unfriend_timeline(sender, instance, **kwargs):
+    timeline.remove_author(instance.user_id, instance.friend_id)
+    timeline.remove_author(instance.friend_id, instance.user_id)
+
+@receiver(post_save, sender=Message)
+def build_message_image_variants(sender, instance, **kwargs):
+    if needs_variants(instance):
+        transaction.on_commit(lambda: derivative_pipeline.schedule(instance))
+
+@receiver(messages_created)
+def build_created_message_variants(sender, messages, **kwargs):
+    for message in messages:
+        build_message_image_variants(Message, message)
@@ -1,3 +1,410 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import os
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.exceptions import ChannelFull
+from django.core.cache import caches
+from django.db import IntegrityError, connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from posts.models import Post
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from social_media.channel_layer import Broker, ensure_private_dir
+from . import chat_writer, fanout, timeline, uploads
+from .auth_cache import principal_cache
+from .middleware import get_user
+from .models import (
+    Chat, ChunkedUpload, CustomUser, Follower, HomeTimeline, Message, Notification, NotificationFanout,
+)
+
+LOCAL_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'tests-shared'},
+}
+
+
+class BrokerTests(SimpleTestCase):
+    def setUp(self):
+        self.broker = Broker()
+        self.now = 1000.0
+        clock = mock.patch('social_media.channel_layer.time.monotonic', lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+
+    def receive(self, channel):
+        # часы подменены и для цикла событий, поэтому очередь без ожидания
+        queue = self.broker._queue(channel)
+        return queue.popleft()[1] if queue else None
+
+    def test_message_expiry(self):
+        self.broker.send('chan', {'n': 1}, expiry=10, capacity=5)
+        self.broker.send('chan', {'n': 2}, expiry=30, capacity=5)
+        self.now += 20
+        self.assertEqual(self.receive('chan'), {'n': 2})
+        self.assertIsNone(self.receive('chan'))
+
+    def test_channel_capacity(self):
+        for n in range(2):
+            self.broker.send('chan', {'n': n}, expiry=60, capacity=2)
+        with self.assertRaises(ChannelFull):
+            self.broker.send('chan', {'n': 2}, expiry=60, capacity=2)
+        # истёкшие сообщения место не занимают
+        self.now += 61
+        self.broker.send('chan', {'n': 3}, expiry=60, capacity=2)
+        self.assertEqual(self.receive('chan'), {'n': 3})
+
+    def test_group_send_uses_channel_capacity(self):
+        self.broker.group_add('room', 'small.1', expiry=60)
+        self.broker.group_add('room', 'big.1', expiry=60)
+        for n in range(3):
+            self.broker.group_send('room', {'n': n}, expiry=60, capacity=100, channel_capacity=[[r'^small\.', 1]])
+        self.assertEqual(len(self.broker.channels['small.1']), 1)
+        self.assertEqual(len(self.broker.channels['big.1']), 3)
+
+    def test_group_membership_ttl(self):
+        self.broker.group_add('room', 'old', expiry=10)
+        self.broker.group_add('room', 'new', expiry=100)
+        self.now += 50
+        self.broker.group_send('room', {'n': 1}, expiry=60, capacity=10)
+        self.assertEqual(set(self.broker.groups['room']), {'new'})
+        self.assertNotIn('old', self.broker.channels)
+        self.now += 100
+        self.broker._expire()
+        self.assertNotIn('room', self.broker.groups)
+
+    def test_socket_directory_must_be_private(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            ensure_private_dir(os.path.join(tmp, 'run', 'layer.sock'))
+            self.assertEqual(os.stat(os.path.join(tmp, 'run')).st_mode & 0o777, 0o700)
+            os.chmod(tmp, 0o777)
+            with self.assertRaises(PermissionError):
+                ensure_private_dir(os.path.join(tmp, 'layer.sock'))
+
+
+@override_settings(CACHES=LOCAL_CACHES)
+class PrincipalCacheTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.user = CustomUser.objects.create_user(
+            email='user@example.com', password='secret', name='User', phone='+100', address='Street 1',
+        )
+        principal_cache.invalidate(self.user.pk)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'JWT {AccessToken.for_user(user)}')
+        return client
+
+    def test_cache_holds_no_password_or_profile(self):
+        principal_cache.get(self.user.pk)
+        cached = repr(caches['shared'].get(principal_cache.key(self.user.pk)))
+        for secret in (self.user.password, '+100', 'Street 1'):
+            self.assertNotIn(secret, cached)
+
+    def test_me_with_warm_cache(self):
+        client = self.client_for(self.user)
+        client.get('/auth/users/me/')
+        with CaptureQueriesContext(connection) as queries:
+            data = client.get('/auth/users/me/').json()
+        self.assertEqual(data['email'], 'user@example.com')
+        # остальные поля профиля - одним запросом, а не по запросу на поле,
+        # плюс хештеги пользователя
+        self.assertEqual(len(queries), 2)
+        self.assertIn('"phone"', queries[0]['sql'])
+
+    def test_password_change_revokes_tokens(self):
+        # reload_api_settings подменяет объект, а модули держат старый
+        with mock.patch.object(api_settings, 'CHECK_REVOKE_TOKEN', True):
+            token = AccessToken.for_user(self.user)
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'JWT {token}')
+            self.assertEqual(client.get('/auth/users/me/').status_code, 200)
+            self.user.set_password('changed')
+            self.user.save()
+            self.assertEqual(client.get('/auth/users/me/').status_code, 401)
+
+    def test_websocket_miss_is_counted_once(self):
+        before = principal_cache.stats()
+        self.assertEqual(async_to_sync(get_user)(self.user.pk).pk, self.user.pk)
+        self.assertEqual(async_to_sync(get_user)(self.user.pk).pk, self.user.pk)
+        after = principal_cache.stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+
+class MessageWriteQueueTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+        self.chat = Chat.objects.create()
+        self.chat.users.add(self.user)
+        self.write_batch = mock.patch.object(chat_writer, 'write_batch', wraps=chat_writer.write_batch)
+        self.batches = self.write_batch.start()
+        self.addCleanup(self.write_batch.stop)
+
+    def submit_all(self, writer, contents):
+        async def scenario():
+            return await asyncio.gather(
+                *(writer.submit(self.chat.pk, self.user.pk, content) for content in contents), return_exceptions=True,
+            )
+        return async_to_sync(scenario)()
+
+    def test_messages_are_written_in_batches(self):
+        writer = chat_writer.MessageWriteQueue(batch_size=3, max_delay=0.2)
+        saved = self.submit_all(writer, [f'm{i}' for i in range(5)])
+        self.assertEqual([message.content for message in saved], [f'm{i}' for i in range(5)])
+        self.assertTrue(all(message.pk for message in saved))
+        # полная партия уходит сразу, остаток - через max_delay
+        self.assertEqual([len(call.args[0]) for call in self.batches.call_args_list], [3, 2])
+
+    def test_pending_messages_are_flushed_on_loop_shutdown(self):
+        writer = chat_writer.MessageWriteQueue(batch_size=100, max_delay=60)
+
+        async def scenario():
+            # соединение закрывается, не дождавшись записи
+            asyncio.ensure_future(writer.submit(self.chat.pk, self.user.pk, 'last words'))
+            await asyncio.sleep(0)
+
+        async_to_sync(scenario)()
+        self.assertTrue(Message.objects.filter(chat=self.chat, content='last words').exists())
+
+    def test_errors_reach_the_awaiting_consumer(self):
+        writer = chat_writer.MessageWriteQueue(batch_size=2, max_delay=0.2)
+        error = IntegrityError('chat deleted')
+        self.batches.side_effect = lambda messages: [messages[0], error]
+        ok, failed = self.submit_all(writer, ['ok', 'bad'])
+        self.assertEqual(ok.content, 'ok')
+        self.assertIs(failed, error)
+
+        self.batches.side_effect = RuntimeError('database is gone')
+        with self.assertLogs('usersmodel.chat_writer', 'ERROR'):
+            results = self.submit_all(writer, ['a', 'b'])
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+        self.stranger = CustomUser.objects.create_user(email='stranger@example.com', password='x', name='Stranger')
+        self.chat = Chat.objects.create()
+        self.chat.users.add(self.user)
+        self.messages = [Message.objects.create(chat=self.chat, sender=self.user, content=f'm{i}') for i in range(5)]
+        # у m1..m3 одинаковое время: порядок внутри задаёт id
+        Message.objects.filter(pk__in=[m.pk for m in self.messages[1:4]]).update(timestamp=self.messages[1].timestamp)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = f'/chat/api/chat/{self.chat.pk}/history/'
+
+    def page(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [m['content'] for m in data['results']], data
+
+    def test_before_cursor_walks_back_through_equal_timestamps(self):
+        contents, data = self.page(limit=2)
+        self.assertEqual(contents, ['m4', 'm3'])
+        self.assertTrue(data['has_more'])
+        contents, data = self.page(limit=2, before=data['before'])
+        self.assertEqual(contents, ['m2', 'm1'])
+        contents, data = self.page(limit=2, before=data['before'])
+        self.assertEqual(contents, ['m0'])
+        self.assertFalse(data['has_more'])
+
+    def test_after_cursor_walks_forward(self):
+        contents, data = self.page(limit=2, after=self.messages[0].pk)
+        self.assertEqual(contents, ['m2', 'm1'])
+        self.assertTrue(data['has_more'])
+        contents, data = self.page(limit=2, after=data['after'])
+        self.assertEqual(contents, ['m4', 'm3'])
+        self.assertFalse(data['has_more'])
+
+    def test_access(self):
+        self.client.force_authenticate(self.stranger)
+        self.assertEqual(self.client.get(self.url).status_code, 403)
+        self.assertEqual(self.client.get('/chat/api/chat/999999/history/').status_code, 404)
+
+        other = Chat.objects.create()
+        foreign = Message.objects.create(chat=other, sender=self.stranger, content='foreign')
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(self.url, {'before': foreign.pk}).status_code, 400)
+
+
+class InboxTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+        self.friend = CustomUser.objects.create_user(email='friend@example.com', password='x', name='Friend')
+        self.quiet, self.busy = Chat.objects.create(), Chat.objects.create()
+        for chat in (self.quiet, self.busy):
+            chat.users.add(self.user, self.friend)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def send(self, chat, sender, count=1):
+        return [Message.objects.create(chat=chat, sender=sender, content='hi') for _ in range(count)]
+
+    def inbox(self):
+        response = self.client.get('/chat/chats/')
+        self.assertEqual(response.status_code, 200)
+        return {chat['id']: chat for chat in response.json()['results']}, [chat['id'] for chat in response.json()['results']]
+
+    def read(self, chat, message_id=None):
+        data = {} if message_id is None else {'message_id': message_id}
+        response = self.client.post(f'/chat/chats/{chat.pk}/read/', data, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['last_read_message_id']
+
+    def test_unread_counts_and_order(self):
+        self.send(self.busy, self.friend, 3)
+        self.send(self.busy, self.user)
+        last = self.send(self.quiet, self.friend, 2)[-1]
+        chats, order = self.inbox()
+        # свои сообщения непрочитанными не считаются
+        self.assertEqual(chats[self.busy.pk]['unread_count'], 3)
+        self.assertEqual(chats[self.quiet.pk]['unread_count'], 2)
+        self.assertEqual(order, [self.quiet.pk, self.busy.pk])
+        self.assertEqual(chats[self.quiet.pk]['last_message']['id'], last.pk)
+
+        self.send(self.busy, self.friend)
+        self.read(self.quiet)
+        chats, order = self.inbox()
+        self.assertEqual(order, [self.busy.pk, self.quiet.pk])
+        self.assertEqual(chats[self.busy.pk]['unread_count'], 4)
+        self.assertEqual(chats[self.quiet.pk]['unread_count'], 0)
+
+    def test_read_marker_only_moves_forward(self):
+        first, second, third = self.send(self.busy, self.friend, 3)
+        self.assertEqual(self.read(self.busy, second.pk), second.pk)
+        self.assertEqual(self.read(self.busy, first.pk), second.pk)
+        self.assertEqual(self.inbox()[0][self.busy.pk]['unread_count'], 1)
+        self.assertEqual(self.read(self.busy), third.pk)
+        self.assertEqual(self.inbox()[0][self.busy.pk]['unread_count'], 0)
+
+    def test_only_members_can_mark_read(self):
+        outsider = Chat.objects.create()
+        outsider.users.add(self.friend)
+        response = self.client.post(f'/chat/chats/{outsider.pk}/read/', {}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertNotIn(outsider.pk, self.inbox()[0])
+
+
+class ChunkedUploadTests(TestCase):
+    body = b'0123456789'
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        settings = override_settings(
+            MEDIA_ROOT=os.path.join(root.name, 'media'), CHUNKED_UPLOAD_DIR=os.path.join(root.name, 'chunks'),
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = CustomUser.objects.create_user(email='user@example.com', password='x', name='User')
+        self.chat = Chat.objects.create()
+        self.chat.users.add(self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        response = self.client.post('/chat/uploads/', {
+            'filename': 'voice.mp3', 'content_type': 'audio/mpeg', 'size': len(self.body),
+            'sha256': hashlib.sha256(self.body).hexdigest(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.upload = ChunkedUpload.objects.get(pk=response.json()['id'])
+
+    def put(self, first, last, checksum=None):
+        headers = {'HTTP_CONTENT_RANGE': f'bytes {first}-{last}/{len(self.body)}'}
+        if checksum:
+            headers['HTTP_X_CHUNK_SHA256'] = checksum
+        return self.client.put(
+            f'/chat/uploads/{self.upload.pk}/', self.body[first:last + 1],
+            content_type='application/octet-stream', **headers,
+        )
+
+    def complete(self):
+        return self.client.post(
+            f'/chat/uploads/{self.upload.pk}/complete/', {'chat_id': self.chat.pk, 'content': 'voice'}, format='json',
+        )
+
+    def test_wrong_offset_is_rejected(self):
+        self.assertEqual(self.put(0, 4).json()['offset'], 5)
+        for first, last in ((0, 4), (7, 9)):
+            response = self.put(first, last)
+            self.assertEqual(response.status_code, 409)
+            self.assertEqual(response['Upload-Offset'], '5')
+
+    def test_checksum_mismatch_rolls_the_chunk_back(self):
+        self.put(0, 4)
+        response = self.put(5, 9, checksum='0' * 64)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['offset'], 5)
+        self.assertEqual(os.path.getsize(uploads.partial_path(self.upload)), 5)
+
+        response = self.put(5, 9, checksum=hashlib.sha256(self.body[5:]).hexdigest())
+        self.assertEqual(response.json()['offset'], 10)
+
+    def test_complete_is_idempotent(self):
+        self.put(0, 9)
+        first = self.complete()
+        self.assertEqual(first.status_code, 201)
+        message = Message.objects.get(pk=first.json()['result']['message'])
+        with message.audio.open('rb') as file:
+            self.assertEqual(file.read(), self.body)
+
+        second = self.complete()
+        self.assertEqual(second.json()['result'], first.json()['result'])
+        self.assertEqual(Message.objects.filter(chat=self.chat).count(), 1)
+
+    def test_purge_stale(self):
+        fresh = uploads.start(self.user, 'other.mp3', 'audio/mpeg', 3)
+        ChunkedUpload.objects.filter(pk=self.upload.pk).update(updated_at=timezone.now() - timezone.timedelta(days=2))
+        self.assertEqual(uploads.purge_stale(), 1)
+        self.assertFalse(ChunkedUpload.objects.filter(pk=self.upload.pk).exists())
+        self.assertFalse(os.path.exists(uploads.partial_path(self.upload)))
+        self.assertTrue(os.path.exists(uploads.partial_path(fresh)))
+
+
+class FanoutResumeTests(TestCase):
+    def setUp(self):
+        self.author = CustomUser.objects.create_user(email='author@example.com', password='x', name='Author')
+        self.followers = [
+            CustomUser.objects.create_user(email=f'follower{i}@example.com', password='x', name=f'Follower {i}')
+            for i in range(7)
+        ]
+        for follower in self.followers:
+            Follower.objects.create(user=self.author, follower=follower)
+            HomeTimeline.objects.create(user=follower)
+        # рассылку ставит сигнал, а запускает on_commit - в TestCase его нет
+        self.post = Post.objects.create(user=self.author, title='Post', text='text')
+        self.job = NotificationFanout.objects.get(post=self.post)
+
+    def test_interrupted_job_resumes_without_gaps_or_duplicates(self):
+        real_push, calls = timeline.push, []
+
+        def crash_on_second_batch(post_id, user_ids):
+            calls.append(post_id)
+            # 1 - автор и друзья, 2 - первая партия, 3 - вторая
+            if len(calls) == 3:
+                raise RuntimeError('worker killed')
+            real_push(post_id, user_ids)
+
+        with mock.patch.object(fanout.timeline, 'push', crash_on_second_batch):
+            with self.assertRaises(RuntimeError):
+                fanout.run_job(self.job, batch_size=3)
+        job = NotificationFanout.objects.get(pk=self.job.pk)
+        self.assertEqual((job.processed, job.status), (3, 'running'))
+
+        self.assertEqual(fanout.run_pending(batch_size=3), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.processed, job.total, job.status), (7, 7, 'done'))
+        notified = list(Notification.objects.filter(post=self.post).values_list('user_id', flat=True))
+        self.assertEqual(sorted(notified), [follower.pk for follower in self.followers])
+        for row in HomeTimeline.objects.filter(user__in=self.followers):
+            self.assertEqual(list(timeline.unpack(row.post_ids)), [self.post.pk])
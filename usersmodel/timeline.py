@@ -0,0 +1,136 @@
+import sys
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from posts.models import Post
+from .models import CustomUser, Follower, Friendship, HomeTimeline
+
+# Домашняя лента: посты подписок и друзей раскладываются по лентам читателей
+# при публикации (см. fanout.py), а посты авторов с большим числом подписчиков
+# не раскладываются и подмешиваются при чтении.
+
+
+def timeline_length():
+    return getattr(settings, 'HOME_TIMELINE_LENGTH', 800)
+
+
+def pull_threshold():
+    return getattr(settings, 'HOME_TIMELINE_PULL_THRESHOLD', 10000)
+
+
+def pack(post_ids):
+    data = array('q', post_ids)
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data.tobytes()
+
+
+def unpack(blob):
+    data = array('q')
+    data.frombytes(bytes(blob or b''))
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+
+def merge(post_ids, new_ids):
+    # обе последовательности - id по убыванию; результат обрезается до длины ленты
+    length = timeline_length()
+    if len(new_ids) == 1 and (not post_ids or new_ids[0] > post_ids[0]):
+        return array('q', new_ids) + post_ids[:length - 1]
+    return array('q', sorted(set(post_ids).union(new_ids), reverse=True)[:length])
+
+
+def is_pulled(author_id):
+    return CustomUser.objects.filter(pk=author_id, followers_count__gte=pull_threshold()).exists()
+
+
+def friend_ids(user_id):
+    rows = Friendship.objects.filter(Q(user_id=user_id) | Q(friend_id=user_id), is_accepted=True)
+    return {friend if user == user_id else user for user, friend in rows.values_list('user_id', 'friend_id')}
+
+
+def pushed_authors(user_id):
+    # чьи посты лежат в ленте: свои, друзей и подписок ниже порога
+    followed = Follower.objects.filter(follower_id=user_id, user__followers_count__lt=pull_threshold())
+    return {user_id} | friend_ids(user_id) | set(followed.values_list('user_id', flat=True))
+
+
+def _rewrite(user_id, change):
+    with transaction.atomic():
+        timeline = HomeTimeline.objects.select_for_update().filter(user_id=user_id).first()
+        if timeline is None:
+            return
+        post_ids = unpack(timeline.post_ids)
+        changed = change(post_ids)
+        if changed is not None:
+            timeline.post_ids = pack(changed)
+            timeline.save(update_fields=['post_ids', 'updated_at'])
+
+
+def push(post_id, user_ids):
+    # Повторный вызов ничего не меняет, поэтому прерванную рассылку можно
+    # продолжать. Пользователям без ленты ничего не пишем: она соберётся
+    # целиком при первом чтении.
+    with transaction.atomic():
+        timelines = list(HomeTimeline.objects.select_for_update().filter(user_id__in=list(user_ids)))
+        changed, now = [], timezone.now()
+        for timeline in timelines:
+            post_ids = unpack(timeline.post_ids)
+            if post_id not in post_ids:
+                timeline.post_ids = pack(merge(post_ids, [post_id]))
+                timeline.updated_at = now
+                changed.append(timeline)
+        HomeTimeline.objects.bulk_update(changed, ['post_ids', 'updated_at'])
+    return len(changed)
+
+
+def backfill(user_id, author_id):
+    recent = list(Post.objects.filter(user_id=author_id).order_by('-id').values_list('id', flat=True)[:timeline_length()])
+    if recent:
+        _rewrite(user_id, lambda post_ids: merge(post_ids, recent))
+
+
+def remove_author(user_id, author_id):
+    if author_id in pushed_authors(user_id):
+        return
+
+    def change(post_ids):
+        gone = set(Post.objects.filter(user_id=author_id, id__in=list(post_ids)).values_list('id', flat=True))
+        return array('q', [post_id for post_id in post_ids if post_id not in gone]) if gone else None
+
+    _rewrite(user_id, change)
+
+
+def build(user_id):
+    post_ids = array('q', Post.objects.filter(user_id__in=pushed_authors(user_id))
+                     .order_by('-id').values_list('id', flat=True)[:timeline_length()])
+    HomeTimeline.objects.bulk_create([HomeTimeline(user_id=user_id, post_ids=pack(post_ids))], ignore_conflicts=True)
+    return post_ids
+
+
+def page(user_id, before=None, limit=20):
+    # Возвращает (id постов, есть ли ещё). Стоимость - чтение одной строки ленты
+    # и один запрос постов «тяжёлых» авторов, сколько бы подписок ни было.
+    blob = HomeTimeline.objects.filter(user_id=user_id).values_list('post_ids', flat=True).first()
+    post_ids = build(user_id) if blob is None else unpack(blob)
+    pushed = []
+    for post_id in post_ids:
+        if before is None or post_id < before:
+            pushed.append(post_id)
+            if len(pushed) > limit:
+                break
+
+    pulled = Post.objects.filter(user__in=Follower.objects.filter(
+        follower_id=user_id, user__followers_count__gte=pull_threshold(),
+    ).values('user'))
+    if before is not None:
+        pulled = pulled.filter(id__lt=before)
+    pulled = pulled.order_by('-id').values_list('id', flat=True)[:limit + 1]
+
+    merged = sorted(set(pushed).union(pulled), reverse=True)
+    return merged[:limit], len(merged) > limit
@@ -0,0 +1,185 @@
+import hashlib
+import os
+import re
+from datetime import timedelta
+
+try:
+    import fcntl
+except ImportError:
+    # не POSIX (Windows): части одной загрузки защищает только условный
+    # UPDATE offset, параллельные PUT могут перемешать байты в файле
+    fcntl = None
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .models import ChunkedUpload
+
+CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+READ_BLOCK = 64 * 1024
+# поле модели по типу содержимого, как в MessageViewSet.upload_media
+MEDIA_FIELDS = (('image/', 'image'), ('video/', 'video'), ('audio/', 'audio'))
+
+
+class UploadError(Exception):
+    def __init__(self, detail, status=400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status = status
+
+
+class UploadedChunks(File):
+    # собранный файл уже на диске: хранилище переместит его, а не скопирует
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def chunk_dir():
+    return getattr(settings, 'CHUNKED_UPLOAD_DIR', os.path.join(settings.BASE_DIR, 'upload_chunks'))
+
+
+def partial_path(upload):
+    return os.path.join(chunk_dir(), f'{upload.pk}.part')
+
+
+def max_chunk_size():
+    return getattr(settings, 'CHUNKED_UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+
+
+def media_field(content_type):
+    for prefix, field in MEDIA_FIELDS:
+        if content_type.startswith(prefix):
+            return field
+    return None
+
+
+def start(user, filename, content_type, size, sha256=''):
+    if media_field(content_type) is None:
+        raise UploadError('Поддерживаются только изображения, видео и аудио.')
+    if size <= 0 or size > getattr(settings, 'CHUNKED_UPLOAD_MAX_SIZE', 2 * 1024 ** 3):
+        raise UploadError('Недопустимый размер файла.', 413 if size > 0 else 400)
+    upload = ChunkedUpload.objects.create(
+        user=user, filename=os.path.basename(filename)[:255], content_type=content_type,
+        size=size, sha256=sha256.lower(),
+    )
+    os.makedirs(chunk_dir(), exist_ok=True)
+    open(partial_path(upload), 'wb').close()
+    return upload
+
+
+def parse_content_range(header, upload):
+    match = CONTENT_RANGE_RE.match(header or '')
+    if match is None:
+        raise UploadError('Нужен заголовок Content-Range: bytes start-end/size.')
+    first, last, total = map(int, match.groups())
+    if total != upload.size or last < first or last >= upload.size:
+        raise UploadError('Content-Range не соответствует загрузке.', 416)
+    return first, last - first + 1
+
+
+def write_chunk(upload, stream, content_range, checksum=None):
+    # Принимает часть [first, first + length) прямо из потока запроса. Части
+    # идут строго по порядку: при first != offset клиент получает 409 и текущий
+    # offset. Без контрольной суммы оборванная часть засчитывается в объёме
+    # дошедших байт; с суммой она либо совпала целиком, либо отброшена.
+    if upload.result is not None:
+        raise UploadError('Загрузка уже завершена.', 409)
+    first, length = parse_content_range(content_range, upload)
+    if length > max_chunk_size():
+        raise UploadError(f'Часть больше {max_chunk_size()} байт.', 413)
+    try:
+        file = open(partial_path(upload), 'r+b')
+    except FileNotFoundError:
+        raise UploadError('Загрузка не найдена.', 404)
+    with file:
+        try:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError('Эта загрузка уже принимает другую часть.', 409)
+        # offset мог сдвинуть запрос, державший блокировку до нас
+        upload.refresh_from_db(fields=['offset', 'result'])
+        if first != upload.offset:
+            raise UploadError('Часть не с текущей позиции.', 409)
+        digest = hashlib.sha256()
+        received = 0
+        file.seek(first)
+        while received < length:
+            block = stream.read(min(READ_BLOCK, length - received)) if stream is not None else b''
+            if not block:
+                break
+            file.write(block)
+            digest.update(block)
+            received += len(block)
+        if checksum and (received != length or digest.hexdigest() != checksum.lower()):
+            received = 0
+        # хвост от прошлой оборванной попытки не должен остаться в файле
+        file.truncate(first + received)
+        if received:
+            ChunkedUpload.objects.filter(pk=upload.pk, offset=first).update(offset=first + received, updated_at=timezone.now())
+            upload.offset = first + received
+    if checksum and not received:
+        raise UploadError('Контрольная сумма части не совпала.')
+    if received < length:
+        raise UploadError('Часть получена не полностью.')
+    return upload
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def complete(upload, model, attach):
+    # attach(field, name) создаёт объект model с уже лежащим в хранилище файлом
+    # и возвращает {'message': id} или {'post': id}. Файл переносится в
+    # хранилище поля переименованием; если создать объект не удалось, на месте
+    # частичной загрузки остаётся жёсткая ссылка на него, и complete можно повторить.
+    with transaction.atomic():
+        upload = ChunkedUpload.objects.select_for_update().get(pk=upload.pk)
+        if upload.result is not None:
+            # повтор после оборванного ответа: тот же результат
+            return upload.result
+        if upload.offset != upload.size:
+            raise UploadError(f'Получено {upload.offset} из {upload.size} байт.', 409)
+        path = partial_path(upload)
+        if upload.sha256 and file_sha256(path) != upload.sha256:
+            raise UploadError('Контрольная сумма файла не совпала.')
+        field = media_field(upload.content_type)
+        storage = model._meta.get_field(field).storage
+        with open(path, 'rb') as file:
+            name = storage.save(
+                model._meta.get_field(field).generate_filename(None, upload.filename),
+                UploadedChunks(file, name=upload.filename),
+            )
+        try:
+            upload.result = attach(field, name)
+            upload.save(update_fields=['result', 'updated_at'])
+        except Exception:
+            # файл мог совпасть с уже хранимым: возвращаем копию-ссылку, а не сам файл
+            if not os.path.exists(path):
+                os.link(storage.path(name), path)
+            raise
+    return upload.result
+
+
+def discard(upload):
+    try:
+        os.remove(partial_path(upload))
+    except FileNotFoundError:
+        pass
+    upload.delete()
+
+
+def purge_stale():
+    # брошенные сессии; завершённые хранятся столько же ради повторов complete
+    expiry = timezone.now() - timedelta(seconds=getattr(settings, 'CHUNKED_UPLOAD_EXPIRY', 24 * 60 * 60))
+    stale = list(ChunkedUpload.objects.filter(updated_at__lt=expiry))
+    for upload in stale:
+        discard(upload)
+    return len(stale)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import FriendshipViewSet, FollowerViewSet,UserListViewSet,FullUserListViewSet, HashtagViewSet,UserSearchView, ChatViewSet,NotificationViewSet, MessageViewSet,ChatHistoryView,BugReportViewSet,FeedbackViewSet
+from .views import FriendshipViewSet, FollowerViewSet,UserListViewSet,FullUserListViewSet, HashtagViewSet,UserSearchView, ChatViewSet,NotificationViewSet, MessageViewSet,ChatHistoryView,BugReportViewSet,FeedbackViewSet,AuthCacheStatsView,ChunkedUploadViewSet
 from drf_yasg.views import get_schema_view
 from rest_framework import permissions
 from drf_yasg import openapi
@@ -10,6 +10,7 @@ router.register(r'friendships', FriendshipViewSet, basename='friendship')
 router.register(r'followers', FollowerViewSet, basename='follower')
 router.register(r'chats', ChatViewSet, basename='chat')
 router.register(r'messages', MessageViewSet, basename='message')
+router.register(r'uploads', ChunkedUploadViewSet, basename='upload')
 router.register(r'bug-reports', BugReportViewSet)
 router.register(r'feedbacks', FeedbackViewSet)
 router.register(r'allusers', UserListViewSet, basename='user')
@@ -33,6 +34,7 @@ schema_view = get_schema_view(
 urlpatterns = [
     path('users/search/', UserSearchView.as_view(), name='user-search'),
     path('api/chat/<int:chat_id>/history/', ChatHistoryView.as_view(), name='chat-history'),
+    path('auth-cache/stats/', AuthCacheStatsView.as_view(), name='auth-cache-stats'),
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('swagger.json/', schema_view.without_ui(cache_timeout=0), name='schema-json'),
     path('', include(router.urls)),   
@@ -1,20 +1,32 @@
 from rest_framework import viewsets, status, generics, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from rest_framework.views import APIView
 from django.shortcuts import get_object_or_404
 
-from .models import CustomUser, Friendship, Hashtag, Follower, Chat, Message, BugReport, Feedback, Notification
+from .models import CustomUser, Friendship, Hashtag, Follower, Chat, ChatReadMarker, Message, BugReport, Feedback, Notification, ChunkedUpload
+from . import uploads
+from .auth_cache import principal_cache
+from .push import publish_chat_membership
+from posts.models import Post
+from posts.serializers import PostSerializer
+from posts.views import get_int_param
+from search.autocomplete import autocomplete
+from search.filters import AutocompleteSearchFilter
 from .serializers import (
     FriendshipSerializer, UnfriendSerializer, UserSerializer,
     UnfollowSerializer, CustomUserSerializer, HashtagSerializer,
     FollowerSerializer, NotificationSerializer, FollowBackSerializer,
-    ChatSerializer, MessageSerializer, BugReportSerializer, FeedbackSerializer
+    ChatSerializer, MessageSerializer, BugReportSerializer, FeedbackSerializer,
+    ChatHistoryMessageSerializer, ChatSenderSerializer, InboxChatSerializer,
 )
 
 from django.contrib.auth import get_user_model
 from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.filters import SearchFilter
 
 User = get_user_model()
 
@@ -31,23 +43,73 @@ class FeedbackViewSet(viewsets.ModelViewSet):
 class FullUserListViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    filter_backends = [DjangoFilterBackend, AutocompleteSearchFilter]
     filterset_fields = ['id']
     search_fields = ['name']
 
 class UserListViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter]
+    filter_backends = [DjangoFilterBackend, AutocompleteSearchFilter]
     filterset_fields = ['hashtags']
     search_fields = ['name']
 
+class AuthCacheStatsView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(principal_cache.stats())
+
+CHAT_HISTORY_LIMIT = 50
+MAX_CHAT_HISTORY_LIMIT = 200
+
+
 class ChatHistoryView(generics.ListAPIView):
-    serializer_class = MessageSerializer
+    # Листание истории по ключу (timestamp, id): ?before=<id> - более старые,
+    # ?after=<id> - более новые сообщения, ?limit - размер страницы.
+    serializer_class = ChatHistoryMessageSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         chat_id = self.kwargs.get('chat_id')
-        return Message.objects.filter(chat_id=chat_id).order_by('-timestamp')
+        return Message.objects.filter(chat_id=chat_id)
+
+    def list(self, request, *args, **kwargs):
+        chat = get_object_or_404(Chat, pk=self.kwargs.get('chat_id'))
+        if not chat.users.filter(id=request.user.id).exists():
+            return Response({"detail": "Вы не являетесь участником этого чата."}, status=status.HTTP_403_FORBIDDEN)
+
+        limit = get_int_param(request, 'limit', CHAT_HISTORY_LIMIT, MAX_CHAT_HISTORY_LIMIT) or CHAT_HISTORY_LIMIT
+        queryset = self.get_queryset()
+        before = get_int_param(request, 'before')
+        after = get_int_param(request, 'after')
+        newer = after is not None and before is None
+        anchor_id = after if newer else before
+
+        if anchor_id is not None:
+            anchor = queryset.filter(pk=anchor_id).values_list('timestamp', flat=True).first()
+            if anchor is None:
+                return Response({"detail": "Сообщение не найдено в этом чате."}, status=status.HTTP_400_BAD_REQUEST)
+            if newer:
+                queryset = queryset.filter(Q(timestamp__gt=anchor) | Q(timestamp=anchor, id__gt=anchor_id))
+            else:
+                queryset = queryset.filter(Q(timestamp__lt=anchor) | Q(timestamp=anchor, id__lt=anchor_id))
+
+        ordering = ('timestamp', 'id') if newer else ('-timestamp', '-id')
+        messages = list(queryset.order_by(*ordering)[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+        if newer:
+            messages.reverse()
+
+        senders = CustomUser.objects.filter(id__in={m.sender_id for m in messages})
+        return Response({
+            'results': self.get_serializer(messages, many=True).data,
+            'users': ChatSenderSerializer(senders, many=True, context=self.get_serializer_context()).data,
+            'has_more': has_more,
+            'before': messages[-1].id if messages else None,
+            'after': messages[0].id if messages else None,
+        })
 
 class UserSearchView(generics.ListAPIView):
     serializer_class = UserSerializer
@@ -58,12 +120,14 @@ class UserSearchView(generics.ListAPIView):
         queryset = CustomUser.objects.all()
 
         if name_query:
-            queryset = queryset.filter(name__icontains=name_query)
+            queryset = queryset.filter(id__in=autocomplete.ids('users', name_query))
 
         if hashtag_query:
-            queryset = queryset.filter(hashtags__name__icontains=hashtag_query)
+            hashtag_ids = autocomplete.ids('user_hashtags', hashtag_query)
+            # подзапрос вместо join + distinct
+            queryset = queryset.filter(id__in=CustomUser.objects.filter(hashtags__in=hashtag_ids).values('id'))
 
-        return queryset.distinct()
+        return queryset
 
 class FriendshipViewSet(viewsets.ModelViewSet):
     queryset = Friendship.objects.all()
@@ -146,10 +210,89 @@ class FollowerViewSet(viewsets.ModelViewSet):
             return Response({'message': f'You are no longer following {follower.name}'}, status=status.HTTP_204_NO_CONTENT)
         return Response({'message': 'You are not following this user'}, status=status.HTTP_404_NOT_FOUND)
 
+INBOX_PARTICIPANTS = 3
+
+
 class ChatViewSet(viewsets.ModelViewSet):
     queryset = Chat.objects.all()
     serializer_class = ChatSerializer
 
+    def list(self, request, *args, **kwargs):
+        # Входящие: по чату - последнее сообщение, несколько участников и число
+        # непрочитанных. Число запросов не зависит ни от числа чатов, ни от сообщений.
+        if not request.user.is_authenticated:
+            return Response({"detail": "Authentication credentials were not provided."}, status=status.HTTP_401_UNAUTHORIZED)
+        user = request.user
+        read_pointer = ChatReadMarker.objects.filter(chat=OuterRef('pk'), user=user).values('last_read_message_id')
+        latest = Message.objects.filter(chat=OuterRef('pk')).order_by('-timestamp', '-id')
+        unread = (
+            Message.objects.filter(chat=OuterRef('pk'), id__gt=OuterRef('read_pointer'))
+            .exclude(sender=user).order_by().values('chat').annotate(c=Count('pk')).values('c')
+        )
+        members = (
+            Chat.users.through.objects.filter(chat=OuterRef('pk'))
+            .order_by().values('chat').annotate(c=Count('pk')).values('c')
+        )
+        chats = (
+            Chat.objects.filter(users=user)
+            .annotate(
+                read_pointer=Coalesce(Subquery(read_pointer), 0),
+                last_message_id=Subquery(latest.values('id')[:1]),
+                last_activity=Coalesce(Subquery(latest.values('timestamp')[:1]), F('created_at')),
+                unread_count=Coalesce(Subquery(unread), 0),
+                participants_count=Coalesce(Subquery(members), 0),
+            )
+            .order_by('-last_activity', '-id')
+        )
+
+        page = self.paginate_queryset(chats)
+        chats = page if page is not None else list(chats)
+
+        chat_ids = [chat.id for chat in chats]
+        last_messages = Message.objects.in_bulk([chat.last_message_id for chat in chats if chat.last_message_id])
+        participants = {}
+        rows = (
+            Chat.users.through.objects.filter(chat_id__in=chat_ids)
+            .annotate(rank=Window(RowNumber(), partition_by=[F('chat_id')], order_by=F('customuser_id').asc()))
+            .filter(rank__lte=INBOX_PARTICIPANTS)
+            .select_related('customuser')
+        )
+        for row in rows:
+            participants.setdefault(row.chat_id, []).append(row.customuser)
+        for chat in chats:
+            chat.last_message = last_messages.get(chat.last_message_id)
+            chat.participants = participants.get(chat.id, [])
+
+        serializer = InboxChatSerializer(chats, many=True, context=self.get_serializer_context())
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['post'])
+    def read(self, request, *args, **kwargs):
+        chat = self.get_object()
+        if not chat.users.filter(id=request.user.id).exists():
+            return Response({"detail": "Вы не являетесь участником этого чата."}, status=status.HTTP_403_FORBIDDEN)
+
+        message_id = request.data.get('message_id')
+        if message_id is None:
+            message_id = chat.messages.order_by('-timestamp', '-id').values_list('id', flat=True).first() or 0
+        try:
+            message_id = int(message_id)
+        except (TypeError, ValueError):
+            return Response({"detail": "Invalid message_id."}, status=status.HTTP_400_BAD_REQUEST)
+
+        marker, created = ChatReadMarker.objects.get_or_create(
+            chat=chat, user=request.user, defaults={'last_read_message_id': message_id},
+        )
+        # указатель только двигается вперёд
+        if not created and message_id > marker.last_read_message_id:
+            ChatReadMarker.objects.filter(pk=marker.pk, last_read_message_id__lt=message_id).update(
+                last_read_message_id=message_id, updated_at=timezone.now(),
+            )
+            marker.last_read_message_id = message_id
+        return Response({"chat_id": chat.id, "last_read_message_id": marker.last_read_message_id}, status=status.HTTP_200_OK)
+
     @action(detail=True, methods=['post'], url_path='join/(?P<invite_link>[^/.]+)')
     def join_group_chat(self, request, *args, **kwargs):
         chat_id = self.kwargs.get('pk')
@@ -162,6 +305,7 @@ class ChatViewSet(viewsets.ModelViewSet):
 
         chat.users.add(request.user)
         chat.save()
+        publish_chat_membership(chat.id, [request.user.id])
         return Response({"chat_id": chat.id}, status=status.HTTP_200_OK)
 
     def create_group_chat(self, request, *args, **kwargs):
@@ -176,6 +320,7 @@ class ChatViewSet(viewsets.ModelViewSet):
         with transaction.atomic():
             chat = Chat.objects.create(is_group=True)
             chat.users.add(*users)
+            publish_chat_membership(chat.id, [user.id for user in users])
 
         return Response({"chat_id": chat.id}, status=status.HTTP_201_CREATED)
 
@@ -215,13 +360,13 @@ class MessageViewSet(viewsets.ModelViewSet):
             return Response({"detail": "Вы не являетесь участником этого чата."}, status=status.HTTP_403_FORBIDDEN)
 
 
-        message = Message.objects.create(
+        # одна вставка: повторный save() помечал новое сообщение отредактированным
+        message = Message(
             chat=chat,
             sender=request.user,
             content=request.data.get('content')
         )
 
-
         if 'audio' in request.FILES:
             message.audio = request.FILES['audio']
         if 'files' in request.FILES:
@@ -243,6 +388,84 @@ class MessageViewSet(viewsets.ModelViewSet):
         message.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+class ChunkedUploadViewSet(viewsets.ViewSet):
+    # Загрузка больших файлов частями: POST создаёт сессию, PUT с Content-Range
+    # дописывает часть, GET/HEAD возвращает offset для докачки, complete
+    # прикрепляет файл к новому сообщению или посту.
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_upload(self, request, pk):
+        return get_object_or_404(ChunkedUpload, pk=pk, user=request.user)
+
+    def state(self, upload, status_code=status.HTTP_200_OK, **extra):
+        data = {
+            'id': str(upload.id), 'offset': upload.offset, 'size': upload.size,
+            'chunk_size': uploads.max_chunk_size(), 'result': upload.result, **extra,
+        }
+        return Response(data, status=status_code, headers={'Upload-Offset': str(upload.offset)})
+
+    def create(self, request):
+        try:
+            size = int(request.data.get('size'))
+        except (TypeError, ValueError):
+            return Response({"detail": "Укажите size в байтах."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            upload = uploads.start(
+                request.user, request.data.get('filename') or 'upload', request.data.get('content_type') or '',
+                size, request.data.get('sha256') or '',
+            )
+        except uploads.UploadError as error:
+            return Response({"detail": error.detail}, status=error.status)
+        return self.state(upload, status.HTTP_201_CREATED)
+
+    def retrieve(self, request, pk=None):
+        return self.state(self.get_upload(request, pk))
+
+    def update(self, request, pk=None):
+        upload = self.get_upload(request, pk)
+        # тело не разбирается парсерами DRF: читаем поток блоками прямо в файл
+        try:
+            uploads.write_chunk(upload, request.stream, request.headers.get('Content-Range'), request.headers.get('X-Chunk-SHA256'))
+        except uploads.UploadError as error:
+            return self.state(upload, error.status, detail=error.detail)
+        return self.state(upload)
+
+    def destroy(self, request, pk=None):
+        uploads.discard(self.get_upload(request, pk))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        upload = self.get_upload(request, pk)
+        target = request.data.get('target', 'message')
+        if target == 'message':
+            chat = get_object_or_404(Chat, id=request.data.get('chat_id'))
+            if not chat.users.filter(id=request.user.id).exists():
+                return Response({"detail": "Вы не являетесь участником этого чата."}, status=status.HTTP_403_FORBIDDEN)
+            model = Message
+
+            def attach(field, name):
+                message = Message.objects.create(chat=chat, sender=request.user, content=request.data.get('content'), **{field: name})
+                return {'message': message.id}
+        elif target == 'post':
+            serializer = PostSerializer(
+                data={'user': request.user.id, 'title': request.data.get('title'), 'text': request.data.get('text')},
+                context={'request': request},
+            )
+            serializer.is_valid(raise_exception=True)
+            model = Post
+
+            def attach(field, name):
+                return {'post': serializer.save(**{field: name}).id}
+        else:
+            return Response({"detail": "target: message или post."}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            uploads.complete(upload, model, attach)
+        except uploads.UploadError as error:
+            return self.state(upload, error.status, detail=error.detail)
+        upload.refresh_from_db()
+        return self.state(upload, status.HTTP_201_CREATED)
+
 class HashtagViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Hashtag.objects.all()
     serializer_class = HashtagSerializer
\ No newline at end of file